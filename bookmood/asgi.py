@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bookmood.settings')
 
 application = get_asgi_application()
+
+# Прогреваем in-memory индексы каталога в каждом воркере
+from books.warmup import warm_up  # noqa: E402
+
+warm_up()
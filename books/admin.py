@@ -1,13 +1,141 @@
-from django.contrib import admin
-from .models import Book, UserProfile, BookSelection
+from contextlib import nullcontext
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections, router, transaction
+from django.db.models import Sum
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from . import search
+from .models import Book, BookSelection, SearchQueryStat, UserProfile
+from .signals import catalog_bulk_saved
+
+# Режим больших таблиц (settings.ADMIN_PERFORMANCE): ESTIMATED_COUNTS - число
+# строк без фильтров из статистики планировщика вместо COUNT(*);
+# EXACT_COUNT_LIMIT - дальше этого отфильтрованные строки не досчитываются;
+# SEARCH_LIMIT - сколько самых релевантных книг дает поиск в админке;
+# ACTION_BATCH_SIZE - книг в одном UPDATE массовых действий
+ADMIN_DEFAULTS = {
+    'ESTIMATED_COUNTS': True,
+    'EXACT_COUNT_LIMIT': 10000,
+    'SEARCH_LIMIT': 1000,
+    'ACTION_BATCH_SIZE': 10000,
+}
+
+
+def admin_options():
+    return {**ADMIN_DEFAULTS, **getattr(settings, 'ADMIN_PERFORMANCE', {})}
+
+
+def estimated_count(model, using):
+    """Число строк таблицы по статистике базы или None, если статистики нет"""
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)', [table])
+            row = cursor.fetchone()
+            # -1 - таблицу еще ни разу не анализировали
+            return int(row[0]) if row and row[0] >= 0 else None
+        if connection.vendor == 'sqlite':
+            # sqlite_stat1 появляется после ANALYZE; первое число stat - строк в таблице
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+            row = cursor.fetchone()
+            return int(row[0].split()[0]) if row else None
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Пагинатор списков админки без точного COUNT(*) по большой таблице"""
+
+    @cached_property
+    def count(self):
+        options = admin_options()
+        queryset = self.object_list
+        if not options['ESTIMATED_COUNTS']:
+            return super().count
+        limit = options['EXACT_COUNT_LIMIT']
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > limit:
+                return estimate
+        # С фильтром - точно, но не дальше limit: сотни тысяч совпадений никто не листает
+        return queryset.order_by()[:limit].count()
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # "N из M" над списком - второй COUNT(*) по всей таблице
+    show_full_result_count = False
+
+
+def reclassify_books(queryset, field, value, batch_size=None):
+    """Ставит field=value книгам queryset пачками по одному UPDATE.
+
+    Счетчики, фасеты и матрица рекомендаций узнают об изменениях из
+    ``catalog_bulk_saved``, как при импорте. Возвращает число измененных книг.
+    """
+    batch_size = batch_size or admin_options()['ACTION_BATCH_SIZE']
+    using = router.db_for_write(Book)
+    pending = queryset.using(using).exclude(**{field: value}).order_by('pk')
+    changed, last = 0, 0
+    while True:
+        with transaction.atomic(using=using):
+            books = list(pending.filter(pk__gt=last)[:batch_size])
+            if not books:
+                return changed
+            last = books[-1].pk
+            previous = {book.pk: {name: getattr(book, name) for name in ('mood', 'complexity', 'author')}
+                        for book in books}
+            now = timezone.now()
+            Book.objects.using(using).filter(pk__in=previous).update(**{field: value, 'updated_at': now})
+            for book in books:
+                setattr(book, field, value)
+                book.updated_at = now
+            catalog_bulk_saved.send(sender=Book, created=[], updated=books, previous=previous, using=using,
+                                    fields=(field, 'updated_at'))
+            changed += len(books)
+
+
+def reclassify_action(field, value, label):
+    def action(modeladmin, request, queryset):
+        changed = reclassify_books(queryset, field, value)
+        modeladmin.message_user(request, f'✅ {label}: изменено книг - {changed}', messages.SUCCESS)
+
+    action.__name__ = f'set_{field}_{value}'
+    return admin.action(description=label)(action)
+
 
 # Настройки для модели Book
 @admin.register(Book)
-class BookAdmin(admin.ModelAdmin):
-    list_display = ('title', 'author', 'mood', 'complexity')
-    list_filter = ('mood', 'complexity')
+class BookAdmin(LargeTableAdmin):
+    list_display = ('title', 'author', 'mood', 'complexity', 'genre', 'pages')
+    list_filter = ('mood', 'complexity', 'genre')
     search_fields = ('title', 'author', 'description')
     list_per_page = 20
+    actions = [
+        *(reclassify_action('mood', key, f'Настроение → {label}') for key, label in Book.MOOD_CHOICES),
+        *(reclassify_action('complexity', key, f'Сложность → {label}') for key, label in Book.COMPLEXITY_CHOICES),
+    ]
+
+    def get_search_results(self, request, queryset, search_term):
+        """Поиск (и автодополнение) - по полнотекстовому индексу, а не icontains по трем колонкам"""
+        if not search_term.strip():
+            return queryset, False
+        backend = search.get_backend(queryset.db)
+        try:
+            with backend.time_limit(settings.SEARCH_TIMEOUT_MS) if settings.SEARCH_TIMEOUT_MS else nullcontext():
+                ids, _ = backend.search_ids(search_term, limit=admin_options()['SEARCH_LIMIT'])
+        except search.SearchTimeout:
+            self.message_user(request, '⏱️ Слишком общий запрос - уточните его', messages.WARNING)
+            ids = []
+        return queryset.filter(pk__in=ids), False
 
 # Настройки для модели UserProfile
 @admin.register(UserProfile)
@@ -15,13 +143,68 @@ class UserProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'reading_speed', 'favorite_genres')
     list_filter = ('reading_speed',)
     search_fields = ('user__username', 'user__email', 'favorite_genres')
-    filter_horizontal = ('favorite_books',)  # Удобный виджет для ManyToMany
+    list_select_related = ('user',)
+    # Виджет с поиском вместо списка всего каталога на странице
+    autocomplete_fields = ('user', 'favorite_books')
 
 # Настройки для модели BookSelection
 @admin.register(BookSelection)
-class BookSelectionAdmin(admin.ModelAdmin):
+class BookSelectionAdmin(LargeTableAdmin):
     list_display = ('user', 'selected_mood', 'selected_complexity', 'selected_date')
+    # Фильтр по дате - готовые периоды, без date_hierarchy: тот перебирает даты всей таблицы
     list_filter = ('selected_mood', 'selected_complexity', 'selected_date')
-    search_fields = ('user__username',)
-    date_hierarchy = 'selected_date'
-    filter_horizontal = ('recommended_books',)
\ No newline at end of file
+    # Точное имя - поиск по уникальному индексу, а не LIKE по всем пользователям
+    search_fields = ('=user__username',)
+    list_select_related = ('user',)
+    autocomplete_fields = ('user', 'recommended_books')
+# Аналитика поиска: строки пишет books/analytics.py, руками их не правят
+@admin.register(SearchQueryStat)
+class SearchQueryStatAdmin(admin.ModelAdmin):
+    list_display = ('query_display', 'kind', 'day', 'count', 'overestimate', 'avg_ms', 'results')
+    list_filter = ('kind', 'day')
+    search_fields = ('query',)
+    date_hierarchy = 'day'
+    ordering = ('-day', '-count')
+    list_per_page = 50
+    # Сводка за последние дни над списком
+    change_list_template = 'admin/books/searchquerystat/change_list.html'
+    summary_days = 7
+    summary_size = 20
+
+    @admin.display(description='Запрос', ordering='query')
+    def query_display(self, obj):
+        return obj.query or '(итог дня)'
+
+    @admin.display(description='Среднее время, мс')
+    def avg_ms(self, obj):
+        return obj.avg_ms
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        since = timezone.localdate() - timedelta(days=self.summary_days - 1)
+        rows = SearchQueryStat.objects.filter(day__gte=since)
+        totals = {row['kind']: row for row in rows.filter(query='').values('kind').annotate(
+            count=Sum('count'), total_ms=Sum('total_ms'))}
+        searches = totals.get('all', {}).get('count') or 0
+        zero = totals.get('zero', {}).get('count') or 0
+
+        def top(kind):
+            return list(rows.filter(kind=kind).exclude(query='').values('query').annotate(
+                count=Sum('count'), overestimate=Sum('overestimate'),
+            ).order_by('-count', 'query')[:self.summary_size])
+
+        extra_context = {
+            **(extra_context or {}),
+            'summary_days': self.summary_days,
+            'searches': searches,
+            'zero_share': round(100 * zero / searches, 1) if searches else 0,
+            'avg_ms': round(totals['all']['total_ms'] / searches, 1) if searches else None,
+            'top_queries': top('all'),
+            'top_zero': top('zero'),
+        }
+        return super().changelist_view(request, extra_context)
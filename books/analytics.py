@@ -0,0 +1,293 @@
+# books/analytics.py
+"""Аналитика поиска: что ищут и что не находится.
+
+Запрос поиска только кладет (текст, найдено, мс) в очередь процесса -
+O(1) под блокировкой; очередь и поток - общий с буфером истории подборок
+``BackgroundWriter`` (books/history.py).
+Фоновый поток разбирает очередь в два счетчика Space-Saving: все запросы
+и запросы без результатов. Каждый держит не больше ``CAPACITY`` запросов,
+сколько бы разных запросов ни пришло: новый запрос вытесняет самый редкий
+и наследует его счетчик как погрешность. Частые запросы (чаще 1/CAPACITY
+всех) гарантированно остаются в счетчике.
+
+Раз в ``FLUSH_INTERVAL`` секунд счетчики прибавляются к дневным строкам
+``SearchQueryStat`` и обнуляются; в таблице за день остается не больше
+``KEEP`` самых частых запросов каждого вида. Смотреть - в админке.
+
+Настройки - словарь ``SEARCH_ANALYTICS`` в settings.py; режим ``sync``
+пишет каждое событие сразу (для тестов), ``off`` - ничего не пишет.
+"""
+import heapq
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import DatabaseError, IntegrityError, router, transaction
+from django.db.models import F
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .history import BackgroundWriter
+from .models import SearchQueryStat
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'MODE': 'buffered',
+    'CAPACITY': 500,
+    'BATCH_SIZE': 1000,
+    'FLUSH_INTERVAL': 60.0,
+    'MAX_PENDING': 50000,
+    'KEEP': 2000,
+}
+MAX_QUERY_LENGTH = 200
+# Итог дня хранится строкой с пустым запросом
+TOTAL = ''
+
+
+def normalize_query(query):
+    """Один вид для "Толстой", " толстой  " и "ТОЛСТОЙ" """
+    return ' '.join(query.lower().replace('ё', 'е').split())[:MAX_QUERY_LENGTH]
+
+
+class SpaceSaving:
+    """Приближенный top-N в capacity ячейках (алгоритм Space-Saving).
+
+    Ячейка - [счетчик, погрешность, сумма мс, найдено в последний раз].
+    Самый редкий запрос ищется по куче с ленивым удалением устаревших
+    записей, так что добавление - O(log capacity) в среднем.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counters = {}
+        self._heap = []
+
+    def __len__(self):
+        return len(self.counters)
+
+    def add(self, key, ms=0.0, results=0):
+        entry = self.counters.get(key)
+        if entry is None:
+            floor = self._evict() if len(self.counters) >= self.capacity else 0
+            entry = self.counters[key] = [floor, floor, 0.0, 0]
+        entry[0] += 1
+        entry[2] += ms
+        entry[3] = results
+        heapq.heappush(self._heap, (entry[0], key))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(entry[0], key) for key, entry in self.counters.items()]
+            heapq.heapify(self._heap)
+
+    def _evict(self):
+        while True:
+            count, key = heapq.heappop(self._heap)
+            entry = self.counters.get(key)
+            if entry is not None and entry[0] == count:
+                del self.counters[key]
+                return count
+
+    def top(self, n=None):
+        """[(запрос, счетчик, погрешность, мс, найдено)] по убыванию счетчика"""
+        items = sorted(self.counters.items(), key=lambda item: (-item[1][0], item[0]))
+        return [(key, *entry) for key, entry in items[:n]]
+
+    def clear(self):
+        self.counters.clear()
+        self._heap.clear()
+
+
+class SearchAnalytics(BackgroundWriter):
+    """Очередь и счетчики поисковых запросов одного процесса"""
+    thread_name = 'search-analytics'
+    error_message = 'Ошибка фоновой записи аналитики поиска'
+
+    def __init__(self, mode='buffered', capacity=500, batch_size=1000, flush_interval=60.0,
+                 max_pending=50000, keep=2000, background=True, using=None):
+        super().__init__(batch_size, flush_interval, max_pending, background, using)
+        self.mode = mode
+        self.keep = keep
+
+        self.queries = SpaceSaving(capacity)
+        self.zero_results = SpaceSaving(capacity)
+        self.searches = 0
+        self.zero_searches = 0
+        self.total_ms = 0.0
+
+        # Счетчики меняет и сбрасывает только тот, кто держит эту блокировку
+        self._sketch_lock = threading.Lock()
+        self._written_at = time.monotonic()
+
+        self.written = 0
+        self.failures = 0
+
+    @classmethod
+    def from_settings(cls):
+        options = {**DEFAULTS, **getattr(settings, 'SEARCH_ANALYTICS', {})}
+        return cls(
+            mode=options['MODE'],
+            capacity=options['CAPACITY'],
+            batch_size=options['BATCH_SIZE'],
+            flush_interval=options['FLUSH_INTERVAL'],
+            max_pending=options['MAX_PENDING'],
+            keep=options['KEEP'],
+        )
+
+    def record(self, query, results, ms):
+        """Учесть поиск: текст запроса, сколько найдено, сколько длился"""
+        if self.mode == 'off':
+            return
+        event = (query, results, ms)
+        if self.mode == 'sync':
+            with self._sketch_lock:
+                self._count([event])
+            self.queued += 1
+            self.flush()
+            return
+        self._enqueue(event)
+
+    def _count(self, events):
+        for query, results, ms in events:
+            key = normalize_query(query)
+            if not key:
+                continue
+            self.searches += 1
+            self.total_ms += ms
+            self.queries.add(key, ms, results)
+            if not results:
+                self.zero_searches += 1
+                self.zero_results.add(key, ms, results)
+
+    def drain(self):
+        """Разобрать очередь в счетчики (без записи в базу)"""
+        with self._sketch_lock:
+            while True:
+                batch = self._take()
+                if not batch:
+                    return
+                self._count(batch)
+
+    def flush(self):
+        """Разобрать очередь и прибавить счетчики к дневным строкам. Возвращает число строк"""
+        self.drain()
+        with self._sketch_lock:
+            rows = self._rows()
+            if not rows:
+                return 0
+            try:
+                write_rows(timezone.localdate(), rows, keep=self.keep, using=self.using)
+            except DatabaseError as exc:
+                # Счетчики не сбрасываем - прибавятся к следующей записи
+                self.failures += 1
+                logger.warning('Не удалось записать аналитику поиска: %s', exc)
+                return 0
+            self.queries.clear()
+            self.zero_results.clear()
+            self.searches = self.zero_searches = 0
+            self.total_ms = 0.0
+            self._written_at = time.monotonic()
+            self.written += len(rows)
+            return len(rows)
+
+    def _rows(self):
+        if not self.searches:
+            return []
+        rows = [
+            ('all', TOTAL, self.searches, 0, self.total_ms, 0),
+            ('zero', TOTAL, self.zero_searches, 0, 0.0, 0),
+        ]
+        for kind, sketch in (('all', self.queries), ('zero', self.zero_results)):
+            rows.extend((kind, *item) for item in sketch.top())
+        return rows
+
+    def _wait_time(self):
+        return self._written_at + self.flush_interval - time.monotonic()
+
+    def _work(self):
+        if time.monotonic() - self._written_at < self.flush_interval:
+            # Очередь набралась раньше срока - только разбираем ее, база подождет
+            self.drain()
+        else:
+            # Не записанные из-за ошибки счетчики остаются и прибавятся к следующей записи
+            self.flush()
+
+    def stats(self):
+        return {
+            'pid': os.getpid(),
+            'mode': self.mode,
+            'queued': self.queued,
+            'dropped': self.dropped,
+            'pending': len(self._pending),
+            'tracked': len(self.queries) + len(self.zero_results),
+            'written': self.written,
+            'failures': self.failures,
+        }
+
+
+def write_rows(day, rows, keep=2000, using=None):
+    """Прибавляет строки (вид, запрос, счетчик, погрешность, мс, найдено) к дню day"""
+    using = using or router.db_for_write(SearchQueryStat)
+    stats = SearchQueryStat.objects.using(using)
+    with transaction.atomic(using=using):
+        for kind, query, count, overestimate, total_ms, results in rows:
+            found = stats.filter(day=day, kind=kind, query=query)
+            increment = {'count': F('count') + count, 'overestimate': F('overestimate') + overestimate,
+                         'total_ms': F('total_ms') + total_ms, 'results': results}
+            if found.update(**increment):
+                continue
+            try:
+                with transaction.atomic(using=using):
+                    stats.create(day=day, kind=kind, query=query, count=count, overestimate=overestimate,
+                                 total_ms=total_ms, results=results)
+            except IntegrityError:
+                # Строку успел создать другой воркер
+                found.update(**increment)
+
+        # Таблица не растет с числом разных запросов: за день - не больше keep на вид
+        for kind in {kind for kind, *_ in rows}:
+            day_rows = stats.filter(day=day, kind=kind).exclude(query=TOTAL)
+            boundary = day_rows.order_by('-count', 'id').values_list('count', 'id')[keep:keep + 1]
+            if boundary:
+                count, pk = boundary[0]
+                day_rows.filter(count__lte=count).exclude(count=count, id__lt=pk).delete()
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder():
+    """Аналитика поиска текущего воркера"""
+    global _recorder
+    if _recorder is None:
+        with _recorder_lock:
+            if _recorder is None:
+                _recorder = SearchAnalytics.from_settings()
+    return _recorder
+
+
+def loaded_recorder():
+    """Аналитика, если она уже создана (для метрик)"""
+    return _recorder
+
+
+def reset_recorder():
+    """Записать остаток и забыть текущую аналитику (тесты, смена настроек)"""
+    global _recorder
+    with _recorder_lock:
+        recorder, _recorder = _recorder, None
+    if recorder is not None:
+        recorder.close()
+
+
+def record_search(query, results, ms):
+    get_recorder().record(query, results, ms)
+
+
+@receiver(setting_changed)
+def _reset_on_settings_change(setting, **kwargs):
+    if setting == 'SEARCH_ANALYTICS':
+        reset_recorder()
@@ -0,0 +1,247 @@
+# books/api.py
+"""JSON API: каталог /api/v1/books/, /search/, /selection/ и избранное /favorites/.
+
+Ответы собираются из ``.values()`` - без моделей и шаблонов; ``?fields=``
+выбирает поля книги (``id`` есть всегда). Каталог листается курсором
+(``books.pagination``), как и HTML-страница.
+
+У каждого ответа сильный ETag из версии каталога (``books.caching``), у
+подборки - еще и версии снимка (``books.snapshot``). Клиент присылает его
+в ``If-None-Match`` и получает 304: версия берется из кеша, база при этом
+не открывается.
+
+Избранное - единственная запись: только для вошедших (сессия и CSRF, как
+у форм сайта), ответы без ETag. Операции идемпотентны - повтор запроса
+ничего не меняет (``books.favorites``).
+"""
+import json
+from functools import wraps
+
+from django.http import JsonResponse
+from django.views.decorators.http import condition, require_http_methods, require_safe
+
+from . import caching, favorites, recommender, search, snapshot
+from .forms import GENRE_PREFERENCE_CHOICES, TIME_AVAILABLE_CHOICES
+from .models import Book
+from .pagination import MAX_INT, MAX_PAGE_SIZE, InvalidCursor, paginate, parse_sort
+
+API_VERSION = 'v1'
+FIELDS = ('id', 'title', 'author', 'mood', 'complexity', 'genre', 'pages', 'description')
+# Описание - самое тяжелое поле, по умолчанию его нет
+DEFAULT_FIELDS = ('id', 'title', 'author', 'mood', 'complexity', 'genre', 'pages')
+DEFAULT_LIMIT = 24
+SELECTION_LIMIT = 6
+
+
+class ApiError(Exception):
+    """Ошибка запроса: уходит клиенту JSON-ом с кодом status"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def api_response(data, status=200):
+    return JsonResponse(data, status=status, json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')})
+
+
+def catalog_etag(request, *args, **kwargs):
+    return f'{API_VERSION}-{caching.catalog_version()}'
+
+
+def selection_etag(request, *args, **kwargs):
+    current = snapshot.get_snapshot()
+    return f'{catalog_etag(request)}-{current.version if current is not None else 0}'
+
+
+def _json_view(view):
+    """Результат view → JSON, ApiError → JSON с кодом ошибки"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return api_response(view(request, *args, **kwargs))
+        except ApiError as exc:
+            return api_response({'error': str(exc)}, status=exc.status)
+    return wrapper
+
+
+def api_view(etag_func):
+    """GET/HEAD, ETag и 304 по etag_func"""
+    def decorator(view):
+        return require_safe(condition(etag_func=etag_func)(_json_view(view)))
+    return decorator
+
+
+def user_api_view(methods):
+    """Запросы вошедшего читателя: методы methods, без ETag"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not request.user.is_authenticated:
+                raise ApiError('Нужно войти', status=401)
+            return view(request, *args, **kwargs)
+        return require_http_methods(methods)(_json_view(wrapper))
+    return decorator
+
+
+def parse_fields(request):
+    value = request.GET.get('fields', '')
+    if not value:
+        return DEFAULT_FIELDS
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = sorted(set(fields) - set(FIELDS))
+    if unknown:
+        raise ApiError(f'Неизвестные поля: {", ".join(unknown)}; доступны: {", ".join(FIELDS)}')
+    return ('id', *dict.fromkeys(field for field in fields if field != 'id'))
+
+
+def parse_limit(request, default=DEFAULT_LIMIT, maximum=MAX_PAGE_SIZE):
+    try:
+        limit = int(request.GET.get('limit', default))
+    except ValueError:
+        raise ApiError('limit должен быть числом')
+    return max(1, min(limit, maximum))
+
+
+def parse_choice(request, name, choices):
+    value = request.GET.get(name, '')
+    if value and value not in dict(choices):
+        raise ApiError(f'Недопустимое значение {name}: {value}')
+    return value
+
+
+def _rows_in_order(ids, fields):
+    rows = {row['id']: row for row in Book.objects.filter(pk__in=ids).values(*fields)}
+    return [rows[pk] for pk in ids if pk in rows]
+
+
+@api_view(catalog_etag)
+def books(request):
+    """Каталог: ?mood=, ?complexity=, ?sort=, ?cursor=, ?limit=, ?fields="""
+    fields = parse_fields(request)
+    sort_field, _ = parse_sort(request.GET.get('sort', 'title'))
+    rows = Book.objects.values(*dict.fromkeys((*fields, sort_field)))
+    for name, choices in (('mood', Book.MOOD_CHOICES), ('complexity', Book.COMPLEXITY_CHOICES)):
+        value = parse_choice(request, name, choices)
+        if value:
+            rows = rows.filter(**{name: value})
+    try:
+        page = paginate(rows, sort=request.GET.get('sort', 'title'), cursor=request.GET.get('cursor'),
+                        per_page=parse_limit(request))
+    except InvalidCursor:
+        raise ApiError('Курсор поврежден или не подходит к сортировке')
+    return {
+        'results': [{field: row[field] for field in fields} for row in page],
+        'next': page.next_cursor,
+        'previous': page.prev_cursor,
+    }
+
+
+@api_view(catalog_etag)
+def book_detail(request, book_id):
+    book = Book.objects.filter(pk=book_id).values(*parse_fields(request)).first()
+    if book is None:
+        raise ApiError('Книга не найдена', status=404)
+    return book
+
+
+@api_view(catalog_etag)
+def search_books(request):
+    """Поиск: ?q=, ?mood=, ?complexity=, ?page=, ?limit=, ?fields="""
+    fields = parse_fields(request)
+    query = request.GET.get('q', '').strip()
+    filters = {name: parse_choice(request, name, choices)
+               for name, choices in (('mood', Book.MOOD_CHOICES), ('complexity', Book.COMPLEXITY_CHOICES))}
+    try:
+        number = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        raise ApiError('page должен быть числом')
+    limit = parse_limit(request, default=search.DEFAULT_PAGE_SIZE)
+    if not query:
+        return {'results': [], 'total': 0, 'page': 1, 'pages': 0}
+    page = search.search_books(query, page=number, per_page=limit, filters=filters, fields=fields[1:])
+    if page.timed_out:
+        # Не 200: пустой ответ с ETag клиент закешировал бы до смены каталога
+        raise ApiError('Слишком общий запрос - уточните его', status=503)
+    return {'results': page.books, 'total': page.total, 'page': page.number, 'pages': page.num_pages}
+
+
+@api_view(selection_etag)
+def selection(request):
+    """Подбор: ?mood=, ?complexity=, ?time_available=, ?genre_preference=, ?reading_speed=, ?limit=
+
+    Без персонализации (показанные книги не учитываются) - ответ
+    одинаков для всех и кешируется по ETag.
+    """
+    query = {
+        'mood': parse_choice(request, 'mood', Book.MOOD_CHOICES),
+        'complexity': parse_choice(request, 'complexity', Book.COMPLEXITY_CHOICES),
+        'time_available': parse_choice(request, 'time_available', TIME_AVAILABLE_CHOICES),
+        'genre': parse_choice(request, 'genre_preference', GENRE_PREFERENCE_CHOICES),
+        'reading_speed': request.GET.get('reading_speed', 'medium'),
+    }
+    if query['genre'] == 'any':
+        query['genre'] = ''
+    if query['reading_speed'] not in recommender.PAGES_PER_HOUR:
+        raise ApiError(f'Недопустимое значение reading_speed: {query["reading_speed"]}')
+    if not (query['mood'] or query['complexity'] or query['time_available'] or query['genre']):
+        raise ApiError('Нужен хотя бы один параметр подбора')
+
+    limit = parse_limit(request, default=SELECTION_LIMIT, maximum=snapshot.config()['CANDIDATES'])
+    current = snapshot.get_snapshot()
+    ids = current.pick(k=limit, **query) if current is not None else None
+    if ids is None:
+        ids = recommender.get_recommender().recommend(k=limit, **query)
+    return {'results': _rows_in_order(ids, parse_fields(request))}
+
+
+def _valid_id(pk):
+    # Id вне диапазона BIGINT валит драйвер базы (OverflowError), а не "не найдено"
+    return isinstance(pk, int) and not isinstance(pk, bool) and 1 <= pk <= MAX_INT
+
+
+def parse_ids(data, name):
+    value = data.get(name, [])
+    if not isinstance(value, list) or not all(_valid_id(pk) for pk in value):
+        raise ApiError(f'{name} должен быть списком id книг')
+    return value
+
+
+@user_api_view(['GET', 'POST'])
+def favorites_list(request):
+    """Избранное: GET - id книг; POST {"add": [...], "remove": [...]} - пакетная правка"""
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            raise ApiError('Тело запроса - не JSON')
+        if not isinstance(data, dict):
+            raise ApiError('Ожидается объект {"add": [...], "remove": [...]}')
+        add, remove = parse_ids(data, 'add'), parse_ids(data, 'remove')
+        if len(add) + len(remove) > favorites.MAX_BATCH:
+            raise ApiError(f'Не больше {favorites.MAX_BATCH} книг за запрос')
+        try:
+            added, removed = favorites.update_favorites(request.user, add=add, remove=remove)
+        except ValueError as exc:
+            raise ApiError(str(exc))
+        return {'added': added, 'removed': removed, 'results': favorites.favorite_ids(request.user)}
+    return {'results': favorites.favorite_ids(request.user)}
+
+
+@user_api_view(['PUT', 'DELETE'])
+def favorite(request, book_id):
+    """PUT - добавить книгу в избранное, DELETE - убрать; повтор ничего не меняет"""
+    if not _valid_id(book_id) or not Book.objects.filter(pk=book_id).exists():
+        raise ApiError('Книга не найдена', status=404)
+    if request.method == 'PUT':
+        added, _ = favorites.update_favorites(request.user, add=[book_id])
+        changed = bool(added)
+    else:
+        _, removed = favorites.update_favorites(request.user, remove=[book_id])
+        changed = bool(removed)
+    return {
+        'id': book_id,
+        'favorite': request.method == 'PUT',
+        'changed': changed,
+        'favorites_count': Book.objects.filter(pk=book_id).values_list('favorites_count', flat=True).get(),
+    }
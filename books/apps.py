@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class BooksConfig(AppConfig):
     name = 'books'
+
+    def ready(self):
+        # Подключаем обработчики сигналов каталога
+        from . import signals  # noqa: F401
+        # Замер SQL для /metrics подключается к каждому новому соединению
+        from . import metrics  # noqa: F401
@@ -0,0 +1,480 @@
+# books/benchmarks.py
+"""Микробенчмарки горячих путей, запускаются командой ``manage.py benchmark``.
+
+Каждый бенчмарк - функция, которая возвращает список строк-словарей;
+команда печатает их таблицей и, при ``--json``, сохраняет как есть.
+Первый столбец строки - ее ключ при сравнении с сохраненным результатом.
+
+``views`` гоняет страницы приложения по текущей базе (наполнить ее можно
+командой ``seed_books``): через тестовый клиент в этом же процессе или,
+с ``--url``, по HTTP к запущенному gunicorn. ``pages`` - время отрисовки
+шаблонов и вес HTML-страниц со статикой при первом и повторном визите.
+Память в ``views`` - пик всего процесса к концу сценария (``ru_maxrss``
+не сбрасывается), а не расход отдельного сценария.
+"""
+import asyncio
+import gzip
+import os
+import re
+import resource
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+import numpy as np
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.cache import cache
+from django.db import close_old_connections, connections as db_connections
+from django.db.models import Count
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, Client, override_settings
+
+from . import facets, metrics, recommender, seeding, seen
+from .models import Book
+
+
+def percentiles(samples_ms):
+    samples = np.asarray(samples_ms)
+    return {
+        'p50_ms': round(float(np.percentile(samples, 50)), 3),
+        'p95_ms': round(float(np.percentile(samples, 95)), 3),
+        'p99_ms': round(float(np.percentile(samples, 99)), 3),
+    }
+
+
+def _synthetic_recommender(books, rng):
+    ids = np.arange(1, books + 1, dtype=np.int64)
+    features = np.column_stack([
+        rng.integers(0, len(recommender.MOODS), books),
+        rng.integers(0, len(recommender.COMPLEXITIES), books),
+        rng.integers(0, recommender.UNKNOWN_GENRE + 1, books),
+        rng.integers(0, recommender.LENGTH_BUCKETS, books),
+    ]).astype(np.int8)
+    return recommender.Recommender(ids, features)
+
+
+def bench_seen_exclusion(books=100000, history_sizes=(0, 100, 1000, 10000, 50000), repeat=200, seed=1):
+    """Подбор с исключением показанных книг при растущей истории пользователя.
+
+    Замеряется то же, что делает ``selection`` на запрос: чтение множества
+    из кеша и top-k с понижением показанных книг.
+    """
+    rng = np.random.default_rng(seed)
+    matrix = _synthetic_recommender(books, rng)
+    query = {'mood': 'happy', 'complexity': 'easy', 'time_available': 'short'}
+    results = []
+    for size in history_sizes:
+        user_id = f'bench-{size}'
+        shown = rng.choice(books, size=min(size, books), replace=False) + 1
+        cache.set(seen._key(user_id), np.unique(shown).astype(np.int64).tobytes(), 60)
+
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            seen_ids = seen.get_seen(user_id)
+            matrix.recommend(k=6, seen_ids=seen_ids, **query)
+            timings.append((time.perf_counter() - started) * 1000)
+        seen.forget(user_id)
+        results.append({'history': size, 'bytes': int(len(np.unique(shown)) * 8), **percentiles(timings)})
+    return results
+
+
+def _scenario_home(rng):
+    return '/', {}
+
+
+def _scenario_book_list(rng):
+    params = {'sort': rng.choice(['title', '-title', 'author'])}
+    if rng.random() < 0.5:
+        params['mood'] = rng.choice([mood for mood, _ in Book.MOOD_CHOICES])
+    return '/books/', params
+
+
+def _scenario_search(rng):
+    words = seeding.ADJECTIVES + seeding.NOUNS + seeding.LAST_NAMES
+    return '/search/', {'q': rng.choice(words)}
+
+
+def _scenario_selection(rng):
+    return '/selection/', {
+        'mood': rng.choice([mood for mood, _ in Book.MOOD_CHOICES]),
+        'complexity': rng.choice(['', 'easy', 'medium', 'hard']),
+    }
+
+
+def _scenario_statistics(rng):
+    return '/statistics/', {}
+
+
+def _api_scenario(scenario, path):
+    # Те же параметры, что у HTML-страницы, - сравнение на одних данных
+    def api_scenario(rng):
+        return path, scenario(rng)[1]
+    return api_scenario
+
+
+VIEW_SCENARIOS = {
+    'home': _scenario_home,
+    'book_list': _scenario_book_list,
+    'search_books': _scenario_search,
+    'selection': _scenario_selection,
+    'statistics': _scenario_statistics,
+    'api_books': _api_scenario(_scenario_book_list, '/api/v1/books/'),
+    'api_search': _api_scenario(_scenario_search, '/api/v1/search/'),
+    'api_selection': _api_scenario(_scenario_selection, '/api/v1/selection/'),
+}
+
+
+def process_peak_rss_mb():
+    """Пиковая память процесса с его запуска: растет от сценария к сценарию, не сбрасывается"""
+    # ru_maxrss в Linux - в килобайтах
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+class _LocalTarget:
+    """Запросы тестовым клиентом в этом процессе; считает SQL-запросы"""
+
+    def __init__(self):
+        self.client = Client()
+
+    def get(self, path, params):
+        queries = 0
+
+        def count(execute, sql, params_, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params_, many, context)
+
+        with ExitStack() as stack:
+            for connection in db_connections.all():
+                stack.enter_context(connection.execute_wrapper(count))
+            response = self.client.get(path, params)
+        size = sum(len(chunk) for chunk in response) if response.streaming else len(response.content)
+        return response.status_code, size, queries
+
+
+class _HttpTarget:
+    """Запросы по HTTP к запущенному серверу; число SQL-запросов неизвестно"""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def get(self, path, params):
+        address = self.url + path + ('?' + urlencode(params) if params else '')
+        try:
+            with urlopen(address, timeout=30) as response:
+                return response.status, len(response.read()), None
+        except HTTPError as exc:
+            return exc.code, 0, None
+
+
+def bench_views(requests=200, warmup=20, url=None, concurrency=1, cold=False, seed=1):
+    """Задержка, пропускная способность и SQL по страницам приложения.
+
+    Параметры запросов берутся из генератора с фиксированным зерном, так что
+    два прогона по одной базе отправляют одну и ту же последовательность.
+    ``cold`` - очищать кеш перед каждым запросом (замер без кеша каталога).
+    """
+    results = []
+    with ExitStack() as stack:
+        if url is None:
+            stack.enter_context(override_settings(ALLOWED_HOSTS=['*']))
+        for name, scenario in VIEW_SCENARIOS.items():
+            rng = np.random.default_rng(seed)
+            plan = [scenario(rng) for _ in range(warmup + requests)]
+
+            def run(item):
+                path, params = item
+                if cold:
+                    cache.clear()
+                target = _HttpTarget(url) if url else _LocalTarget()
+                started = time.perf_counter()
+                try:
+                    status, size, queries = target.get(path, params)
+                finally:
+                    if url is None and concurrency > 1:
+                        close_old_connections()
+                return (time.perf_counter() - started) * 1000, status, size, queries
+
+            for item in plan[:warmup]:
+                run(item)
+            started = time.perf_counter()
+            if concurrency > 1:
+                with ThreadPoolExecutor(concurrency) as pool:
+                    measured = list(pool.map(run, plan[warmup:]))
+            else:
+                measured = [run(item) for item in plan[warmup:]]
+            elapsed = time.perf_counter() - started
+
+            queries = [q for _, _, _, q in measured if q is not None]
+            results.append({
+                'view': name,
+                'requests': len(measured),
+                **percentiles([ms for ms, _, _, _ in measured]),
+                'rps': round(len(measured) / elapsed, 1),
+                'queries_avg': round(float(np.mean(queries)), 2) if queries else None,
+                'queries_max': max(queries) if queries else None,
+                'kb_avg': round(float(np.mean([size for _, _, size, _ in measured])) / 1024, 1),
+                'errors': sum(1 for _, status, _, _ in measured if status >= 400),
+                'process_peak_rss_mb': None if url else process_peak_rss_mb(),
+            })
+    return results
+
+
+PAGE_SCENARIOS = ('home', 'book_list', 'search_books', 'selection', 'statistics')
+INLINE_RE = re.compile(r'<(script|style)\b([^>]*)>(.*?)</\1>', re.DOTALL)
+ASSET_RE = re.compile(r'(?:src|href)="([^"?#]+)')
+
+
+def _gzip_size(data):
+    # Девятый уровень - как у WhiteNoise при collectstatic
+    return len(gzip.compress(data, compresslevel=9))
+
+
+def _static_file(url):
+    """Файл статики по адресу из страницы: собранный collectstatic или исходник"""
+    prefix = '/' + settings.STATIC_URL.lstrip('/')
+    if not url.startswith(prefix):
+        return None
+    name = url[len(prefix):]
+    if settings.STATIC_ROOT and os.path.isfile(os.path.join(settings.STATIC_ROOT, name)):
+        return os.path.join(settings.STATIC_ROOT, name)
+    return finders.find(name)
+
+
+def page_weight(html):
+    """Вес страницы: HTML, встроенные скрипты и стили, своя статика (gzip)"""
+    inline = sum(len(body.encode()) for _, attributes, body in INLINE_RE.findall(html)
+                 if 'application/json' not in attributes)
+    assets = {}
+    for url in dict.fromkeys(ASSET_RE.findall(html)):
+        path = _static_file(url)
+        if path:
+            with open(path, 'rb') as file:
+                assets[url] = _gzip_size(file.read())
+    content = html.encode()
+    html_gz = _gzip_size(content)
+    return {
+        'html_kb': round(len(content) / 1024, 1),
+        'html_gz_kb': round(html_gz / 1024, 1),
+        'inline_kb': round(inline / 1024, 1),
+        'assets': len(assets),
+        'assets_gz_kb': round(sum(assets.values()) / 1024, 1),
+        # Своя статика с хешем в имени кешируется навсегда - повторный визит качает только HTML
+        'first_visit_kb': round((html_gz + sum(assets.values())) / 1024, 1),
+        'repeat_visit_kb': round(html_gz / 1024, 1),
+    }
+
+
+def bench_pages(requests=50, seed=1):
+    """Отрисовка шаблонов и байты по сети для HTML-страниц.
+
+    Время - только render() шаблона страницы, без view и SQL. Первый запрос
+    (разбор шаблона, заполнение кеша карточек) в замер не входит; у каждого
+    запроса свой параметр ``_bench``, чтобы home и statistics рисовались, а
+    не отдавались из кеша страниц. Вес - по последнему ответу; сжатие gzip,
+    как у прокси перед gunicorn и у WhiteNoise для статики.
+    """
+    render_ms = []
+    original = metrics.InstrumentedTemplate.render
+
+    def timed_render(template, context=None, request=None):
+        started = time.perf_counter()
+        try:
+            return original(template, context, request)
+        finally:
+            render_ms.append((time.perf_counter() - started) * 1000)
+
+    results = []
+    with override_settings(ALLOWED_HOSTS=['*']), ExitStack() as stack:
+        metrics.InstrumentedTemplate.render = timed_render
+        stack.callback(setattr, metrics.InstrumentedTemplate, 'render', original)
+        client = Client()
+        for name in PAGE_SCENARIOS:
+            rng = np.random.default_rng(seed)
+            cache.clear()
+            for number in range(requests + 1):
+                if number == 1:
+                    del render_ms[:]
+                path, params = VIEW_SCENARIOS[name](rng)
+                response = client.get(path, {**params, '_bench': number})
+            results.append({
+                'page': name,
+                'requests': requests,
+                **{f'render_{key}': value for key, value in percentiles(render_ms or [0]).items()},
+                **page_weight(response.content.decode()),
+            })
+    return results
+
+
+def _concurrency_row(mode, name, connections, timings, elapsed, statuses):
+    return {
+        'mode': f'{mode}:{name}',
+        'connections': connections,
+        **percentiles(timings),
+        'rps': round(len(timings) / elapsed, 1),
+        'errors': sum(1 for status in statuses if status >= 400),
+    }
+
+
+def _wsgi_burst(plan, threads):
+    """Все запросы приходят разом, gthread-воркер обслуживает их threads потоками"""
+    def run(item):
+        path, params = item
+        try:
+            response = Client().get(path, params)
+            return time.perf_counter(), response.status_code
+        finally:
+            close_old_connections()
+
+    with ThreadPoolExecutor(threads) as pool:
+        started = time.perf_counter()
+        done = list(pool.map(run, plan))
+    return [(finished - started) * 1000 for finished, _ in done], [status for _, status in done], started
+
+
+async def _asgi_burst(plan):
+    """Все запросы разом в один цикл событий ASGI-обработчика"""
+    client = AsyncClient()
+
+    async def run(item):
+        path, params = item
+        response = await client.get(path, params)
+        return time.perf_counter(), response.status_code
+
+    started = time.perf_counter()
+    done = await asyncio.gather(*(run(item) for item in plan))
+    return [(finished - started) * 1000 for finished, _ in done], [status for _, status in done], started
+
+
+_db_latency = 0.0
+
+
+def _slow_query(execute, sql, params, many, context):
+    if _db_latency:
+        time.sleep(_db_latency)
+    return execute(sql, params, many, context)
+
+
+def _add_latency(sender, connection, **kwargs):
+    if _slow_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_slow_query)
+
+
+def bench_concurrency(connections=500, threads=4, url=None, db_latency=0.0, seed=1):
+    """Всплеск из connections одновременных запросов: WSGI (gthread) против ASGI.
+
+    Задержка считается от момента, когда пришли все запросы, до ответа на
+    каждый - то есть вместе с ожиданием в очереди воркера. С ``--url``
+    всплеск отправляется на запущенный сервер (режим - тот, что у сервера).
+    ``db_latency`` (мс) добавляется к каждому SQL-запросу - как сетевая
+    задержка до PostgreSQL, которой у локального SQLite нет.
+    """
+    global _db_latency
+    if db_latency and not url:
+        _db_latency = db_latency / 1000
+        connection_created.connect(_add_latency)
+        for connection in db_connections.all(initialized_only=True):
+            _add_latency(None, connection)
+    try:
+        return _concurrency_rows(connections, threads, url, seed)
+    finally:
+        _db_latency = 0.0
+        connection_created.disconnect(_add_latency)
+
+
+def _concurrency_rows(connections, threads, url, seed):
+    results = []
+    for name in ('selection', 'search_books'):
+        rng = np.random.default_rng(seed)
+        plan = [VIEW_SCENARIOS[name](rng) for _ in range(connections)]
+        if url:
+            target = _HttpTarget(url)
+            with ThreadPoolExecutor(connections) as pool:
+                started = time.perf_counter()
+                done = list(pool.map(lambda item: (target.get(*item)[0], time.perf_counter()), plan))
+            timings = [(finished - started) * 1000 for _, finished in done]
+            results.append(_concurrency_row('http', name, connections, timings,
+                                            time.perf_counter() - started, [status for status, _ in done]))
+            continue
+
+        with override_settings(ALLOWED_HOSTS=['*']):
+            timings, statuses, started = _wsgi_burst(plan, threads)
+            results.append(_concurrency_row(f'wsgi-{threads}', name, connections, timings,
+                                            time.perf_counter() - started, statuses))
+            timings, statuses, started = asyncio.run(_asgi_burst(plan))
+            results.append(_concurrency_row('asgi', name, connections, timings,
+                                            time.perf_counter() - started, statuses))
+    return results
+
+
+FACET_SELECTIONS = {
+    'all': {},
+    'mood=happy': {'mood': 'happy'},
+    'mood=happy,complexity=easy': {'mood': 'happy', 'complexity': 'easy'},
+}
+
+
+def _sql_facet_counts(selected):
+    """То же, что FacetIndex.counts, запросами GROUP BY к базе"""
+    result = {}
+    for facet in facets.FACETS:
+        scope = Book.objects.filter(**{other: value for other, value in selected.items() if other != facet})
+        result[facet] = dict(scope.values_list(facet).annotate(n=Count('id')).order_by())
+    return result, Book.objects.filter(**selected).count()
+
+
+def bench_facets(repeat=200):
+    """Счетчики фасетов по текущей базе: битовые строки воркера против GROUP BY.
+
+    Построение индекса в замер не входит - оно бывает раз на воркер.
+    """
+    index = facets.FacetIndex.from_database()
+    results = []
+    for method, count in (('bitmap', index.counts), ('sql', _sql_facet_counts)):
+        for name, selected in FACET_SELECTIONS.items():
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                count(selected)
+                timings.append((time.perf_counter() - started) * 1000)
+            results.append({'method': f'{method}:{name}', 'books': len(index), **percentiles(timings)})
+    return results
+
+
+BENCHMARKS = {
+    'concurrency': bench_concurrency,
+    'facets': bench_facets,
+    'pages': bench_pages,
+    'seen': bench_seen_exclusion,
+    'views': bench_views,
+}
+
+
+def compare(report, baseline, tolerance=0.1):
+    """Строки, где задержка выросла больше чем на tolerance относительно baseline"""
+    regressions = []
+    for name, rows in report.items():
+        old_rows = baseline.get(name) or []
+        if not rows or not old_rows:
+            continue
+        key = next(iter(rows[0]))
+        old_by_key = {row.get(key): row for row in old_rows}
+        for row in rows:
+            old = old_by_key.get(row[key])
+            if old is None:
+                continue
+            for metric, value in row.items():
+                if not metric.endswith('_ms') or not old.get(metric) or value is None:
+                    continue
+                change = value / old[metric] - 1
+                if change > tolerance:
+                    regressions.append({
+                        'benchmark': name, key: row[key], 'metric': metric,
+                        'baseline': old[metric], 'current': value, 'change': f'{change:+.0%}',
+                    })
+    return regressions
@@ -0,0 +1,107 @@
+# books/caching.py
+"""Кеш страниц и фрагментов, привязанный к версии каталога.
+
+Вместо TTL все ключи содержат номер версии каталога. Сигналы ``Book``
+(сохранение, удаление, массовый импорт, изменения M2M) увеличивают его
+(``bump_catalog_version``), после чего старые ключи просто перестают
+читаться и вытесняются самим бэкендом. Поэтому устаревшие данные не
+отдаются ни секунды, а неизменный каталог не перечитывается вовсе.
+
+Версия лежит в том же Django-кеше, что и данные: с Redis или файловым
+кешем она общая для всех воркеров, с LocMem - своя у каждого процесса.
+"""
+import hashlib
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+
+VERSION_KEY = 'catalog:version'
+# Страхует от неограниченного роста кеша без вытеснения (файловый бэкенд)
+CATALOG_CACHE_TIMEOUT = 24 * 60 * 60
+
+_counters = defaultdict(lambda: {'hits': 0, 'misses': 0})
+_counters_lock = threading.Lock()
+
+
+def catalog_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # После очистки кеша начинаем с метки времени, а не с 1:
+        # старые ключи других воркеров не совпадут с новыми
+        cache.add(VERSION_KEY, time.time_ns() // 1000, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def _bump():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns() // 1000, None)
+
+
+def bump_catalog_version(using=None):
+    """Сделать недействительным все, что закешировано по каталогу"""
+    _bump()
+    # Повторно после коммита: иначе параллельный запрос мог успеть
+    # закешировать еще не закоммиченное состояние под новой версией
+    transaction.on_commit(_bump, using=using)
+
+
+def count(name, hit):
+    with _counters_lock:
+        _counters[name]['hits' if hit else 'misses'] += 1
+
+
+def counters():
+    with _counters_lock:
+        return {name: dict(values) for name, values in _counters.items()}
+
+
+def cached_value(name, parts, compute):
+    """Значение ``compute()`` из кеша по ключу (name, версия каталога, parts)"""
+    key = ':'.join(['catalog', name, str(catalog_version()), *map(str, parts)])
+    value = cache.get(key)
+    count(name, value is not None)
+    if value is None:
+        value = compute()
+        cache.set(key, value, CATALOG_CACHE_TIMEOUT)
+    return value
+
+
+def cache_catalog_page(name, extra_key=None):
+    """Кеширует HTML страницы, которая зависит только от каталога и адреса.
+
+    Подходит лишь для страниц без пользовательских данных и CSRF-форм.
+    ``extra_key`` - функция без аргументов для данных, которые меняются
+    независимо от каталога (например, отметка сверток подборок).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET':
+                return view(request, *args, **kwargs)
+
+            # Адрес хешируем: длинные query string не должны упираться в лимит длины ключа
+            path = hashlib.md5(request.get_full_path().encode('utf-8')).hexdigest()
+            parts = ['catalog', 'page', name, str(catalog_version()), path]
+            if extra_key is not None:
+                parts.append(str(extra_key()))
+            key = ':'.join(parts)
+            cached = cache.get(key)
+            count(name, cached is not None)
+            if cached is not None:
+                content, content_type = cached
+                return HttpResponse(content, content_type=content_type)
+
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming:
+                cache.set(key, (response.content, response['Content-Type']), CATALOG_CACHE_TIMEOUT)
+            return response
+        return wrapper
+    return decorator
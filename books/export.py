@@ -0,0 +1,131 @@
+# books/export.py
+"""Потоковая выгрузка каталога и истории подборок в CSV/JSONL.
+
+Таблица читается пачками по первичному ключу
+(``WHERE id > :last ORDER BY id LIMIT n``), а не одним курсором на всю
+выгрузку: каждый запрос короткий, транзакция не висит открытой часами, а
+выгрузку можно продолжить с любого места параметром ``after``. В памяти
+одновременно лежит только одна пачка, поэтому расход памяти не зависит от
+размера таблицы.
+
+Рекомендованные книги подборки (M2M) подтягиваются одним запросом к
+промежуточной таблице на пачку - по диапазону id подборок.
+"""
+import csv
+import json
+import zlib
+
+from .models import Book, BookSelection
+
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+DEFAULT_CHUNK_SIZE = 2000
+
+BOOK_FIELDS = ('id', 'title', 'author', 'mood', 'complexity', 'genre', 'pages', 'description')
+SELECTION_FIELDS = ('id', 'user_id', 'username', 'selected_mood', 'selected_complexity',
+                    'selected_date', 'recommended_books')
+
+
+def _chunks(queryset, fields, chunk_size, after=0):
+    """Пачки кортежей ``fields`` по возрастанию id, начиная после ``after``"""
+    queryset = queryset.order_by('id').values_list(*fields)
+    last = after or 0
+    while True:
+        rows = list(queryset.filter(id__gt=last)[:chunk_size])
+        if not rows:
+            return
+        yield rows
+        last = rows[-1][0]
+        if len(rows) < chunk_size:
+            return
+
+
+def book_rows(using=None, chunk_size=DEFAULT_CHUNK_SIZE, after=0):
+    """Пачки книг: кортежи в порядке ``BOOK_FIELDS``"""
+    return _chunks(Book.objects.using(using), BOOK_FIELDS, chunk_size, after)
+
+
+def selection_rows(using=None, chunk_size=DEFAULT_CHUNK_SIZE, after=0):
+    """Пачки подборок (порядок ``SELECTION_FIELDS``) со списком id рекомендованных книг"""
+    through = BookSelection.recommended_books.through
+    queryset = BookSelection.objects.using(using)
+    fields = ('id', 'user_id', 'user__username', 'selected_mood', 'selected_complexity', 'selected_date')
+
+    for rows in _chunks(queryset, fields, chunk_size, after):
+        recommended = {}
+        links = through.objects.using(using).filter(
+            bookselection_id__gte=rows[0][0],
+            bookselection_id__lte=rows[-1][0],
+        ).order_by('bookselection_id', 'id').values_list('bookselection_id', 'book_id')
+        for selection_id, book_id in links:
+            recommended.setdefault(selection_id, []).append(book_id)
+
+        yield [
+            (selection_id, user_id, username, mood, complexity, selected_date.isoformat(),
+             recommended.get(selection_id, []))
+            for selection_id, user_id, username, mood, complexity, selected_date in rows
+        ]
+
+
+class _Line:
+    """Псевдофайл для csv.writer: возвращает строку вместо записи"""
+
+    def write(self, value):
+        return value
+
+
+def _selection_csv(row):
+    # M2M в одной ячейке: id через пробел
+    return row[:-1] + (' '.join(map(str, row[-1])),)
+
+
+def serialize(chunks, fields, fmt, csv_row=None):
+    """Текст выгрузки: по одному куску строки на пачку"""
+    if fmt == 'csv':
+        # None csv.writer сам пишет пустой строкой
+        writer = csv.writer(_Line())
+        yield writer.writerow(fields)
+        for rows in chunks:
+            if csv_row is not None:
+                rows = map(csv_row, rows)
+            yield ''.join(map(writer.writerow, rows))
+    else:
+        for rows in chunks:
+            yield ''.join(json.dumps(dict(zip(fields, row)), ensure_ascii=False) + '\n' for row in rows)
+
+
+def encode(pieces, compress=False):
+    """UTF-8 байты выгрузки, при ``compress`` - сразу в gzip"""
+    if not compress:
+        for piece in pieces:
+            yield piece.encode('utf-8')
+        return
+
+    # wbits=31 - формат gzip (заголовок и контрольная сумма)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for piece in pieces:
+        data = compressor.compress(piece.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# Имя выгрузки → (источник пачек, поля, преобразование строки для CSV)
+EXPORTS = {
+    'books': (book_rows, BOOK_FIELDS, None),
+    'selections': (selection_rows, SELECTION_FIELDS, _selection_csv),
+}
+
+
+def export(name, fmt='csv', compress=False, using=None, chunk_size=DEFAULT_CHUNK_SIZE, after=0):
+    """Генератор байтов выгрузки ``name`` ('books' или 'selections')"""
+    rows, fields, csv_row = EXPORTS[name]
+    pieces = serialize(rows(using=using, chunk_size=chunk_size, after=after), fields, fmt, csv_row)
+    return encode(pieces, compress=compress)
+
+
+def filename(name, fmt, compress=False):
+    return f'{name}.{fmt}' + ('.gz' if compress else '')
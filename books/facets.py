@@ -0,0 +1,247 @@
+# books/facets.py
+"""Фасеты каталога: число книг по каждому настроению и сложности.
+
+Каждая книга воркера получает порядковый номер (ordinal), и на каждое
+значение фасета заводится битовая строка над этими номерами: бит i
+стоит, если у книги i такое настроение. Счетчики для текущего выбора
+фильтров - несколько AND по словам uint64 и подсчет единиц, без
+``COUNT(*) ... GROUP BY`` на каждое значение.
+
+Счетчики фасета считаются без его собственного фильтра: при выбранном
+"веселом" настроении рядом с "грустным" видно, сколько книг станет, если
+переключиться на него.
+
+Номера только добавляются: удаленная книга просто пропадает из всех
+битовых строк. Изменения приходят из сигналов каталога, как в
+``books.recommender``.
+"""
+import threading
+
+import numpy as np
+
+from .models import Book
+
+FACETS = {
+    'mood': [key for key, _ in Book.MOOD_CHOICES],
+    'complexity': [key for key, _ in Book.COMPLEXITY_CHOICES],
+}
+# Таблица id → номер держится, пока id плотные (см. recommender.LOOKUP_DENSITY)
+LOOKUP_DENSITY = 4
+NO_VALUE = -1
+
+if hasattr(np, 'bitwise_count'):
+    def popcount(words):
+        return int(np.bitwise_count(words).sum())
+else:
+    # numpy < 2.0: единицы байтов по таблице
+    _BYTE_BITS = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def popcount(words):
+        return int(_BYTE_BITS[words.view(np.uint8)].sum(dtype=np.int64))
+
+
+def _words(capacity):
+    return np.zeros(capacity // 64, dtype=np.uint64)
+
+
+class FacetIndex:
+    """Битовые строки значений фасетов одного процесса"""
+
+    def __init__(self, ids, values, capacity=None):
+        """ids - id книг, values - {фасет: список значений в том же порядке}"""
+        self._lock = threading.Lock()
+        count = len(ids)
+        capacity = max(1024, -(-(capacity or count) // 64) * 64)
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._ids[:count] = ids
+        self._count = count
+        self._alive = _words(capacity)
+        self._bits = {facet: [_words(capacity) for _ in choices] for facet, choices in FACETS.items()}
+        # Текущее значение каждой книги - чтобы при изменении снять старый бит
+        self._codes = {facet: np.full(capacity, NO_VALUE, dtype=np.int8) for facet in FACETS}
+        self._lookup = None
+        self._sparse = {}
+        self._build_lookup(int(max(ids)) + 1 if count else 0)
+
+        ordinals = np.arange(count)
+        self._set_bits(self._alive, ordinals)
+        for facet, choices in FACETS.items():
+            codes = np.array([_code(facet, value) for value in values[facet]], dtype=np.int8)
+            self._codes[facet][:count] = codes
+            for code in range(len(choices)):
+                self._set_bits(self._bits[facet][code], ordinals[codes == code])
+
+    @classmethod
+    def from_database(cls, using=None, chunk_size=10000):
+        ids, values = [], {facet: [] for facet in FACETS}
+        rows = Book.objects.using(using).order_by('id').values_list('id', *FACETS)
+        for book_id, *book_values in rows.iterator(chunk_size=chunk_size):
+            ids.append(book_id)
+            for facet, value in zip(FACETS, book_values):
+                values[facet].append(value)
+        return cls(np.array(ids, dtype=np.int64), values)
+
+    @staticmethod
+    def _set_bits(words, ordinals):
+        mask = np.zeros(len(words) * 64, dtype=bool)
+        mask[ordinals] = True
+        words |= np.packbits(mask, bitorder='little').view(np.uint64)
+
+    def _build_lookup(self, size):
+        size = min(size, LOOKUP_DENSITY * len(self._ids))
+        lookup = np.full(size, -1, dtype=np.int32)
+        ids = self._ids[:self._count]
+        dense = ids < size
+        lookup[ids[dense]] = np.flatnonzero(dense)
+        # Id за пределами таблицы (разреженные) - в словаре
+        self._sparse = {int(pk): int(ordinal) for ordinal, pk in zip(np.flatnonzero(~dense), ids[~dense])}
+        self._lookup = lookup
+
+    def __len__(self):
+        return popcount(self._alive)
+
+    def _ordinal_of(self, book_id):
+        if 0 <= book_id < len(self._lookup):
+            ordinal = int(self._lookup[book_id])
+            return ordinal if ordinal >= 0 else None
+        return self._sparse.get(book_id)
+
+    def ordinals_of(self, book_ids):
+        """Номера книг из массива id; отсутствующие отбрасываются"""
+        book_ids = np.asarray(book_ids, dtype=np.int64)
+        lookup = self._lookup
+        inside = (book_ids >= 0) & (book_ids < len(lookup))
+        ordinals = lookup[book_ids[inside]]
+        ordinals = ordinals[ordinals >= 0]
+        if self._sparse and not inside.all():
+            extra = [self._sparse[pk] for pk in book_ids[~inside].tolist() if pk in self._sparse]
+            ordinals = np.concatenate([ordinals, np.array(extra, dtype=ordinals.dtype)])
+        return ordinals
+
+    def bitset_of(self, book_ids):
+        """Битовая строка книг из списка id (например, найденных поиском)"""
+        words = _words(len(self._ids))
+        self._set_bits(words, self.ordinals_of(book_ids))
+        return words
+
+    def _grow(self):
+        capacity = len(self._ids) * 2
+        ids = np.zeros(capacity, dtype=np.int64)
+        ids[:self._count] = self._ids[:self._count]
+        grown = {}
+        for facet, bitsets in self._bits.items():
+            grown[facet] = [np.concatenate([words, _words(capacity // 2)]) for words in bitsets]
+        codes = {facet: np.concatenate([array, np.full(capacity // 2, NO_VALUE, dtype=np.int8)])
+                 for facet, array in self._codes.items()}
+        alive = np.concatenate([self._alive, _words(capacity // 2)])
+        # Подмена под блокировкой upsert: counts видит либо старые, либо новые массивы
+        self._ids, self._bits, self._codes, self._alive = ids, grown, codes, alive
+
+    def upsert(self, book_id, **values):
+        """Добавить книгу или обновить ее значения фасетов"""
+        with self._lock:
+            ordinal = self._ordinal_of(book_id)
+            if ordinal is None:
+                if self._count == len(self._ids):
+                    self._grow()
+                ordinal = self._count
+                self._ids[ordinal] = book_id
+                self._count += 1
+                if book_id >= len(self._lookup):
+                    # Таблица растет с запасом, но не дальше порога плотности
+                    wanted = min(max(book_id + 1, len(self._lookup) * 2), LOOKUP_DENSITY * len(self._ids))
+                    if wanted > len(self._lookup):
+                        self._build_lookup(wanted)
+                if 0 <= book_id < len(self._lookup):
+                    self._lookup[book_id] = ordinal
+                else:
+                    self._sparse[book_id] = ordinal
+            word, bit = ordinal // 64, np.uint64(1) << np.uint64(ordinal % 64)
+            self._alive[word] |= bit
+            for facet in FACETS:
+                old = self._codes[facet][ordinal]
+                if old != NO_VALUE:
+                    self._bits[facet][old][word] &= ~bit
+                code = _code(facet, values.get(facet))
+                self._codes[facet][ordinal] = code
+                if code != NO_VALUE:
+                    self._bits[facet][code][word] |= bit
+
+    def remove(self, book_id):
+        with self._lock:
+            ordinal = self._ordinal_of(book_id)
+            if ordinal is None:
+                return
+            word, bit = ordinal // 64, np.uint64(1) << np.uint64(ordinal % 64)
+            self._alive[word] &= ~bit
+            for facet in FACETS:
+                old = self._codes[facet][ordinal]
+                if old != NO_VALUE:
+                    self._bits[facet][old][word] &= ~bit
+                self._codes[facet][ordinal] = NO_VALUE
+
+    def counts(self, selected=None, within=None):
+        """Число книг по каждому значению каждого фасета.
+
+        ``selected`` - выбранные фильтры {фасет: значение}, ``within`` -
+        битовая строка, которой ограничен каталог (результаты поиска).
+        Возвращает ({фасет: {значение: число}}, всего с учетом всех фильтров).
+        """
+        selected = {facet: value for facet, value in (selected or {}).items() if value in FACETS.get(facet, ())}
+        with self._lock:
+            # Только ссылки: массивы одного размера, даже если каталог как раз растет
+            bits, alive = self._bits, self._alive
+        if within is not None and len(within) != len(alive):
+            # Строка построена до роста каталога - дополняем нулями
+            padded = np.zeros(len(alive), dtype=np.uint64)
+            size = min(len(within), len(alive))
+            padded[:size] = within[:size]
+            within = padded
+        base = alive if within is None else alive & within
+        masks = {facet: bits[facet][FACETS[facet].index(value)] for facet, value in selected.items()}
+
+        result = {}
+        for facet, choices in FACETS.items():
+            # Фильтры остальных фасетов
+            scope = base
+            for other, mask in masks.items():
+                if other != facet:
+                    scope = scope & mask
+            result[facet] = {value: popcount(scope & bits[facet][code]) for code, value in enumerate(choices)}
+
+        total = base
+        for mask in masks.values():
+            total = total & mask
+        return result, popcount(total)
+
+
+def _code(facet, value):
+    try:
+        return FACETS[facet].index(value)
+    except ValueError:
+        return NO_VALUE
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Фасеты текущего воркера, строятся при первом обращении"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = FacetIndex.from_database()
+    return _index
+
+
+def loaded_index():
+    """Фасеты, если они уже построены, иначе None (для сигналов)"""
+    return _index
+
+
+def reset_index():
+    global _index
+    with _index_lock:
+        _index = None
@@ -0,0 +1,124 @@
+# books/favorites.py
+"""Избранное читателей и счетчик ``Book.favorites_count``.
+
+Счетчик двигает обработчик ``m2m_changed`` таблицы избранного
+(books/signals.py): ``UPDATE ... SET favorites_count = favorites_count + n``
+в той же транзакции, что и сама связь, поэтому правки разных читателей
+одной книги не теряются. Учитываются только связи, которые действительно
+появились или исчезли: ``remove()`` Django сообщает все переданные id,
+даже не отмеченные, - их мы сверяем с таблицей до удаления.
+
+Изменения через API идут через ``update_favorites``: она блокирует строку
+профиля, и параллельные переключения одного читателя выполняются по
+очереди. Правки в обход сигналов (SQL, загрузка дампа) чинит команда
+``rebuild_favorites_counts``.
+
+Версию каталога (``books.caching``) избранное не трогает: иначе каждый
+лайк сбрасывал бы кеш страниц, карточек, подборок и ETag API. Список
+«самых любимых» вместо этого живет ``MOST_LOVED_TTL`` секунд - ключ его
+кеша и кеша страниц с ним содержит номер окна ``most_loved_window()``.
+"""
+import time
+from collections import Counter, defaultdict
+
+from django.db import router, transaction
+from django.db.models import Count, F
+
+from . import caching
+from .models import Book, UserProfile
+
+Favorite = UserProfile.favorite_books.through
+# Сколько книг можно переключить одним запросом
+MAX_BATCH = 500
+# Насколько «самые любимые» могут отставать от лайков, с
+MOST_LOVED_TTL = 60
+
+
+def favorite_ids(user, using=None):
+    """Id избранных книг читателя в порядке добавления"""
+    return list(Favorite.objects.using(using).filter(userprofile__user=user).order_by('id')
+                .values_list('book_id', flat=True))
+
+
+def update_favorites(user, add=(), remove=(), using=None):
+    """Добавляет и убирает книги из избранного; повтор ничего не меняет.
+
+    Несуществующие книги пропускаются. Возвращает (добавлено, убрано) -
+    id, которые действительно изменились.
+    """
+    add, remove = set(add), set(remove)
+    if add & remove:
+        raise ValueError('Одна и та же книга и добавляется, и убирается')
+    using = using or router.db_for_write(UserProfile)
+    with transaction.atomic(using=using):
+        profile, _ = UserProfile.objects.using(using).get_or_create(user=user)
+        # Строка профиля - замок на избранное читателя до конца транзакции
+        profile = UserProfile.objects.using(using).select_for_update().get(pk=profile.pk)
+        current = set(Favorite.objects.using(using).filter(userprofile=profile, book_id__in=add | remove)
+                      .values_list('book_id', flat=True))
+        added = sorted(Book.objects.using(using).filter(pk__in=add - current).values_list('id', flat=True))
+        removed = sorted(remove & current)
+        if added:
+            profile.favorite_books.add(*added)
+        if removed:
+            profile.favorite_books.remove(*removed)
+    return added, removed
+
+
+def apply_deltas(deltas, using=None):
+    """Сдвигает favorites_count: {id книги: изменение}, один UPDATE на величину сдвига"""
+    by_delta = defaultdict(list)
+    for book_id, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(book_id)
+    for delta, ids in by_delta.items():
+        Book.objects.using(using).filter(pk__in=ids).update(favorites_count=F('favorites_count') + delta)
+
+
+def count_changes(instance, action, reverse, pk_set, using):
+    """Обработчик m2m_changed: instance - профиль (reverse - книга), pk_set - другая сторона"""
+    if action == 'post_add' and pk_set:
+        apply_deltas({instance.pk: len(pk_set)} if reverse else dict.fromkeys(pk_set, 1), using)
+    elif action in ('pre_remove', 'pre_clear'):
+        links = Favorite.objects.using(using)
+        if reverse:
+            links = links.filter(book_id=instance.pk)
+            if pk_set is not None:
+                links = links.filter(userprofile_id__in=pk_set)
+        else:
+            links = links.filter(userprofile_id=instance.pk)
+            if pk_set is not None:
+                links = links.filter(book_id__in=pk_set)
+        instance._favorites_removed = Counter(links.values_list('book_id', flat=True))
+    elif action in ('post_remove', 'post_clear'):
+        removed = instance.__dict__.pop('_favorites_removed', None) or {}
+        apply_deltas({book_id: -count for book_id, count in removed.items()}, using)
+
+
+def most_loved_window():
+    """Номер окна MOST_LOVED_TTL: меняется - «самые любимые» пересчитываются"""
+    return int(time.time() // MOST_LOVED_TTL)
+
+
+def most_loved(limit=6):
+    """Книги, которые чаще всего добавляют в избранное (по индексу favorites_count)"""
+    return caching.cached_value('most_loved', [limit, most_loved_window()], lambda: list(
+        Book.objects.filter(favorites_count__gt=0).order_by('-favorites_count', '-id')[:limit]
+    ))
+
+
+def rebuild_counts(using=None):
+    """Сверяет favorites_count с таблицей избранного. Возвращает число исправленных книг"""
+    using = using or router.db_for_write(Book)
+    with transaction.atomic(using=using):
+        actual = dict(Favorite.objects.using(using).order_by().values('book_id').annotate(n=Count('id'))
+                      .values_list('book_id', 'n'))
+        stored = dict(Book.objects.using(using).filter(favorites_count__gt=0)
+                      .values_list('id', 'favorites_count'))
+        wrong = {pk: count for pk, count in actual.items() if stored.get(pk, 0) != count}
+        wrong.update({pk: 0 for pk in stored if pk not in actual})
+        Book.objects.using(using).bulk_update(
+            [Book(id=pk, favorites_count=count) for pk, count in wrong.items()], ['favorites_count'],
+            batch_size=1000,
+        )
+    return len(wrong)
@@ -1,6 +1,20 @@
 from django import forms
 from .models import Book
 
+TIME_AVAILABLE_CHOICES = [
+    ('short', '⏱️ Мало времени (15-30 минут)'),
+    ('medium', '🕐 Средне (1-2 часа)'),
+    ('long', '🕔 Много времени (более 2 часов)'),
+]
+
+GENRE_PREFERENCE_CHOICES = [
+    ('any', '🎭 Любой жанр'),
+    ('classic', '📚 Классика'),
+    ('fantasy', '🐉 Фэнтези'),
+    ('novel', '💖 Роман'),
+    ('detective', '🔍 Детектив'),
+    ('biography', '👤 Биография'),
+]
 
 class BookSelectionForm(forms.Form):
     """Форма для подбора книг по настроению"""
@@ -24,11 +38,7 @@ class BookSelectionForm(forms.Form):
     )
 
     time_available = forms.ChoiceField(
-        choices=[
-            ('short', '⏱️ Мало времени (15-30 минут)'),
-            ('medium', '🕐 Средне (1-2 часа)'),
-            ('long', '🕔 Много времени (более 2 часов)'),
-        ],
+        choices=TIME_AVAILABLE_CHOICES,
         label='⏰ Сколько времени готовы уделить чтению?',
         widget=forms.Select(attrs={
             'class': 'form-control',
@@ -37,14 +47,7 @@ class BookSelectionForm(forms.Form):
     )
 
     genre_preference = forms.ChoiceField(
-        choices=[
-            ('any', '🎭 Любой жанр'),
-            ('classic', '📚 Классика'),
-            ('fantasy', '🐉 Фэнтези'),
-            ('novel', '💖 Роман'),
-            ('detective', '🔍 Детектив'),
-            ('biography', '👤 Биография'),
-        ],
+        choices=GENRE_PREFERENCE_CHOICES,
         label='📖 Предпочтительный жанр',
         required=False,
         widget=forms.Select(attrs={
@@ -0,0 +1,312 @@
+# books/history.py
+"""Отложенная (write-behind) запись истории подборок.
+
+Каждая подборка - это строка ``BookSelection`` и по строке в промежуточной
+таблице на каждую рекомендованную книгу. Писать их прямо в запросе дорого,
+а на SQLite еще и упирается в единственного писателя. Поэтому запрос только
+кладет запись в буфер процесса (O(1) под блокировкой), а фоновый поток
+сбрасывает буфер двумя ``bulk_create`` - подборки и связи - когда набралось
+``BATCH_SIZE`` записей или прошло ``FLUSH_INTERVAL`` секунд. При остановке
+воркера остаток дописывается через ``atexit``.
+
+Буфер ограничен ``MAX_PENDING`` записями: если база недоступна дольше, чем
+помещается в буфер, новые записи отбрасываются и учитываются в счетчике
+``dropped`` - воркер не должен расти в памяти бесконечно. В очередь
+возвращается только пачка, упавшая на временной ошибке (``OperationalError``:
+база недоступна, блокировка). Пачку, которую база отвергла (например, книгу
+или читателя успели удалить), пишем по одной записи, а плохие записи
+отбрасываем и считаем в ``rejected`` - иначе одна такая пачка падала бы
+при каждом сбросе и забила бы буфер.
+
+Очередь, фоновый поток и дописывание при выходе - ``BackgroundWriter``,
+на нем же построена аналитика поиска (books/analytics.py).
+
+Режим ``sync`` пишет каждую подборку сразу, в текущей транзакции; он нужен
+для тестов. Настройки - словарь ``HISTORY_WRITER`` в settings.py.
+"""
+import atexit
+import logging
+import os
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import DatabaseError, OperationalError, connections, router, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import seen
+from .models import BookSelection
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'MODE': 'buffered',
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 2.0,
+    'MAX_PENDING': 20000,
+}
+
+
+def write_entries(entries, using=None):
+    """Записывает пачку (user_id, настроение, сложность, id книг, время) в базу"""
+    using = using or router.db_for_write(BookSelection)
+    through = BookSelection.recommended_books.through
+    with transaction.atomic(using=using):
+        selections = BookSelection.objects.using(using).bulk_create([
+            BookSelection(user_id=user_id, selected_mood=mood, selected_complexity=complexity,
+                          selected_date=selected_at)
+            for user_id, mood, complexity, _, selected_at in entries
+        ])
+        # SQLite 3.35+ и PostgreSQL возвращают id из bulk_create (RETURNING)
+        through.objects.using(using).bulk_create([
+            through(bookselection_id=selection.pk, book_id=book_id)
+            for selection, (_, _, _, book_ids, _) in zip(selections, entries)
+            for book_id in dict.fromkeys(book_ids)
+        ])
+
+
+class BackgroundWriter:
+    """Очередь процесса, которую фоновый поток сбрасывает в базу.
+
+    Общая часть буфера истории подборок и аналитики поиска
+    (``books.analytics``): ограниченная очередь, поток, который
+    просыпается раз в ``flush_interval`` или по заполнению пачки, и
+    дописывание остатка при выходе. Подкласс определяет ``flush()`` и,
+    при необходимости, ``_wait_time()`` и ``_work()``.
+    """
+    thread_name = 'background-writer'
+    error_message = 'Ошибка фоновой записи'
+
+    def __init__(self, batch_size, flush_interval, max_pending, background=True, using=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.background = background
+        self.using = using
+
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread = None
+        self._closed = False
+
+        self.queued = 0
+        self.dropped = 0
+
+    def _enqueue(self, item):
+        """Поставить элемент в очередь; при переполнении он отбрасывается"""
+        with self._lock:
+            if self._closed or len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.append(item)
+            self.queued += 1
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.notify()
+        if self.background and self._thread is None:
+            self._start()
+
+    def _take(self):
+        """Следующая пачка из очереди (пустой список - очередь пуста)"""
+        with self._lock:
+            return [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+
+    def _requeue(self, batch):
+        # Возвращаем пачку в начало очереди, не превышая лимит буфера
+        with self._lock:
+            room = max(self.max_pending - len(self._pending), 0)
+            self.dropped += max(len(batch) - room, 0)
+            self._pending.extendleft(reversed(batch[:room]))
+
+    def flush(self):
+        raise NotImplementedError
+
+    def _wait_time(self):
+        """Сколько потоку спать до следующего сброса, если пачка не набралась"""
+        return self.flush_interval
+
+    def _work(self):
+        """Что поток делает, проснувшись"""
+        self.flush()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None or self._closed:
+                return
+            self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                wait = self._wait_time()
+                if len(self._pending) < self.batch_size and not self._closed and wait > 0:
+                    self._wakeup.wait(wait)
+                closed = self._closed
+            if closed:
+                return
+            try:
+                self._work()
+            except Exception:
+                # Поток должен пережить любую ошибку, иначе очередь перестанет
+                # разбираться совсем и будет только расти до max_pending
+                logging.getLogger(type(self).__module__).exception(self.error_message)
+            finally:
+                # У потока свое соединение с базой - не держим его между сбросами
+                connections.close_all()
+
+    def close(self):
+        """Остановить фоновый поток и дописать остаток (вызывается при выходе)"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wakeup.notify()
+        if self._thread is not None:
+            # Поток уже разбужен - ждем только сброс, который он начал
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+
+class HistoryWriter(BackgroundWriter):
+    """Буфер истории подборок одного процесса"""
+    thread_name = 'history-writer'
+    error_message = 'Ошибка фоновой записи истории подборок'
+
+    def __init__(self, mode='buffered', batch_size=500, flush_interval=2.0, max_pending=20000,
+                 background=True, using=None):
+        super().__init__(batch_size, flush_interval, max_pending, background, using)
+        self.mode = mode
+        self._flush_lock = threading.Lock()
+
+        self.flushed = 0
+        self.rejected = 0
+        self.batches = 0
+        self.failures = 0
+
+    @classmethod
+    def from_settings(cls):
+        options = {**DEFAULTS, **getattr(settings, 'HISTORY_WRITER', {})}
+        return cls(
+            mode=options['MODE'],
+            batch_size=options['BATCH_SIZE'],
+            flush_interval=options['FLUSH_INTERVAL'],
+            max_pending=options['MAX_PENDING'],
+        )
+
+    def record(self, user_id, mood, complexity, book_ids):
+        """Поставить подборку в очередь на запись"""
+        entry = (user_id, mood or '', complexity or '', list(book_ids), timezone.now())
+        if self.mode == 'sync':
+            write_entries([entry], using=self.using)
+            self.queued += 1
+            self.flushed += 1
+            return
+        self._enqueue(entry)
+
+    def flush(self):
+        """Записать все, что накопилось. Возвращает число записанных подборок"""
+        written = 0
+        # Один сбрасывающий за раз: фоновый поток и atexit не пишут одно и то же
+        with self._flush_lock:
+            while True:
+                batch = self._take()
+                if not batch:
+                    return written
+                try:
+                    write_entries(batch, using=self.using)
+                except OperationalError as exc:
+                    self.failures += 1
+                    self._requeue(batch)
+                    logger.warning('Не удалось записать историю подборок (%s записей): %s', len(batch), exc)
+                    return written
+                except DatabaseError as exc:
+                    logger.warning('База отвергла пачку истории подборок (%s записей), пишем по одной: %s',
+                                   len(batch), exc)
+                    saved, complete = self._write_each(batch)
+                    written += saved
+                    if not complete:
+                        return written
+                    continue
+                self.batches += 1
+                self.flushed += len(batch)
+                written += len(batch)
+
+    def _write_each(self, batch):
+        """По одной записи: отвергнутые отбрасываются. Возвращает (записано, дошли ли до конца)"""
+        saved = 0
+        for number, entry in enumerate(batch):
+            try:
+                write_entries([entry], using=self.using)
+            except OperationalError as exc:
+                self.failures += 1
+                self._requeue(batch[number:])
+                logger.warning('Не удалось записать историю подборок (%s записей): %s', len(batch) - number, exc)
+                return saved, False
+            except DatabaseError as exc:
+                self.rejected += 1
+                logger.warning('Запись истории подборок отброшена (user_id=%s): %s', entry[0], exc)
+                continue
+            self.flushed += 1
+            saved += 1
+        self.batches += 1
+        return saved, True
+
+    def stats(self):
+        return {
+            'pid': os.getpid(),
+            'mode': self.mode,
+            'queued': self.queued,
+            'flushed': self.flushed,
+            'dropped': self.dropped,
+            'rejected': self.rejected,
+            'pending': len(self._pending),
+            'batches': self.batches,
+            'failures': self.failures,
+        }
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Буфер истории текущего воркера"""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = HistoryWriter.from_settings()
+    return _writer
+
+
+def loaded_writer():
+    """Буфер, если он уже создан: метрики не должны запускать фоновый поток"""
+    return _writer
+
+
+def reset_writer():
+    """Дописать и забыть текущий буфер (тесты, смена настроек)"""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.close()
+
+
+def record_selection(user, mood, complexity, books):
+    """Сохранить подборку пользователя в историю"""
+    if user.is_authenticated and books:
+        book_ids = [book.pk for book in books]
+        get_writer().record(user.pk, mood, complexity, book_ids)
+        # Множество показанных обновляем сразу, не дожидаясь записи в базу
+        seen.add_seen(user.pk, book_ids)
+
+
+@receiver(setting_changed)
+def _reset_on_settings_change(setting, **kwargs):
+    if setting == 'HISTORY_WRITER':
+        reset_writer()
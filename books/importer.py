@@ -0,0 +1,243 @@
+# books/importer.py
+"""Потоковый импорт каталога из CSV/JSONL.
+
+Файл читается построчно и обрабатывается пачками фиксированного размера,
+поэтому память не зависит от размера фида. Каждая пачка - одна транзакция:
+один SELECT существующих книг по названиям, затем ``bulk_create`` новых и
+``bulk_update`` изменившихся. Неизменные строки не переписываются, так что
+повторный прогон того же фида почти ничего не пишет.
+
+Ключ upsert - пара (title, author).
+"""
+import csv
+import io
+import json
+import sys
+import time
+from collections import deque
+from itertools import islice
+
+from django.db import router, transaction
+from django.utils import timezone
+
+from .models import Book
+from .signals import catalog_bulk_saved
+
+FIELDS = ('title', 'author', 'mood', 'complexity', 'description', 'genre', 'pages')
+UPDATE_FIELDS = ('mood', 'complexity', 'description', 'genre', 'pages')
+
+
+def _choice_lookup(choices):
+    # Принимаем и ключ ("happy"), и русское название ("Веселое")
+    lookup = {}
+    for key, label in choices:
+        lookup[key.lower()] = key
+        lookup[label.lower()] = key
+    return lookup
+
+
+MOODS = _choice_lookup(Book.MOOD_CHOICES)
+COMPLEXITIES = _choice_lookup(Book.COMPLEXITY_CHOICES)
+GENRES = _choice_lookup(Book.GENRE_CHOICES)
+
+MAX_LENGTHS = {
+    field: Book._meta.get_field(field).max_length
+    for field in ('title', 'author')
+}
+
+
+class RowError(ValueError):
+    """Строка фида не прошла проверку"""
+
+
+def clean_row(raw):
+    """Проверяет строку фида и приводит ее к полям Book"""
+    if not isinstance(raw, dict):
+        raise RowError('строка должна быть объектом')
+
+    def text(field):
+        value = raw.get(field)
+        return '' if value is None else str(value).strip()
+
+    row = {field: text(field) for field in ('title', 'author', 'description')}
+    for field, max_length in MAX_LENGTHS.items():
+        if not row[field]:
+            raise RowError(f'пустое поле {field}')
+        if len(row[field]) > max_length:
+            raise RowError(f'{field} длиннее {max_length} символов')
+
+    for field, lookup in (('mood', MOODS), ('complexity', COMPLEXITIES)):
+        value = lookup.get(text(field).lower())
+        if value is None:
+            raise RowError(f'недопустимое значение {field}: {text(field)!r}')
+        row[field] = value
+
+    genre = text('genre')
+    row['genre'] = GENRES.get(genre.lower(), '') if genre else ''
+    if genre and not row['genre']:
+        raise RowError(f'недопустимое значение genre: {genre!r}')
+
+    pages = text('pages')
+    if pages:
+        try:
+            row['pages'] = int(pages)
+        except ValueError:
+            raise RowError(f'pages не число: {pages!r}') from None
+        if row['pages'] < 0:
+            raise RowError('pages меньше нуля')
+    else:
+        row['pages'] = None
+    return row
+
+
+def parse_jsonl_lines(numbered_lines):
+    """Разбор и проверка пачки строк JSONL. Выполняется и в дочерних процессах"""
+    results = []
+    for line_number, line in numbered_lines:
+        if not line.strip():
+            continue
+        try:
+            raw = json.loads(line)
+            results.append((line_number, clean_row(raw), None, None))
+        except (ValueError, RowError) as exc:
+            results.append((line_number, None, str(exc), line.rstrip('\n')))
+    return results
+
+
+def iter_jsonl(stream, batch_size, workers=1):
+    """Проверенные строки JSONL: (номер строки, поля, ошибка, исходник)"""
+    numbered = enumerate(stream, start=1)
+    batches = iter(lambda: list(islice(numbered, batch_size)), [])
+    if workers > 1:
+        from multiprocessing import Pool
+        with Pool(workers) as pool:
+            # Не imap: его поток-раздатчик сразу вычитывает весь итератор пачек,
+            # и фид целиком оседает в памяти. Здесь в работе не больше
+            # 2 * workers пачек, результаты отдаются по порядку
+            window = deque()
+            for batch in batches:
+                window.append(pool.apply_async(parse_jsonl_lines, (batch,)))
+                if len(window) >= 2 * workers:
+                    yield from window.popleft().get()
+            while window:
+                yield from window.popleft().get()
+    else:
+        for batch in batches:
+            yield from parse_jsonl_lines(batch)
+
+
+def iter_csv(stream):
+    """Проверенные строки CSV (первая строка - заголовок)"""
+    reader = csv.DictReader(stream)
+    for raw in reader:
+        try:
+            yield reader.line_num, clean_row(raw), None, None
+        except RowError as exc:
+            yield reader.line_num, None, str(exc), json.dumps(raw, ensure_ascii=False)
+
+
+class ImportStats:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.rejected = 0
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'created': self.created,
+            'updated': self.updated,
+            'unchanged': self.unchanged,
+            'rejected': self.rejected,
+            'seconds': round(self.elapsed, 2),
+            'rows_per_second': round(self.rows_per_second, 1),
+        }
+
+
+def upsert_batch(rows, using=None):
+    """Записывает пачку проверенных строк. Возвращает (создано, обновлено, без изменений)"""
+    using = using or router.db_for_write(Book)
+    # Внутри пачки побеждает последняя строка с тем же ключом
+    by_key = {(row['title'], row['author']): row for row in rows}
+
+    with transaction.atomic(using=using):
+        existing = {}
+        titles = {title for title, _ in by_key}
+        for book in Book.objects.using(using).filter(title__in=titles).only('id', *FIELDS):
+            existing.setdefault((book.title, book.author), book)
+
+        to_create, to_update, previous = [], [], {}
+        for key, row in by_key.items():
+            book = existing.get(key)
+            if book is None:
+                to_create.append(Book(**row))
+                continue
+            if all(getattr(book, field) == row[field] for field in UPDATE_FIELDS):
+                continue
+            previous[book.pk] = {field: getattr(book, field) for field in ('mood', 'complexity', 'author')}
+            for field in UPDATE_FIELDS:
+                setattr(book, field, row[field])
+            book.updated_at = timezone.now()
+            to_update.append(book)
+
+        if to_create:
+            Book.objects.using(using).bulk_create(to_create)
+        if to_update:
+            Book.objects.using(using).bulk_update(to_update, UPDATE_FIELDS + ('updated_at',))
+        if to_create or to_update:
+            # bulk-операции не шлют post_save - сообщаем индексам сами
+            catalog_bulk_saved.send(sender=Book, created=to_create, updated=to_update,
+                                    previous=previous, using=using)
+
+    return len(to_create), len(to_update), len(by_key) - len(to_create) - len(to_update)
+
+
+def import_rows(parsed_rows, batch_size=2000, rejects=None, using=None, progress=None):
+    """Импортирует поток (номер, поля, ошибка, исходник).
+
+    ``rejects`` - csv.writer для отклоненных строк, ``progress`` -
+    функция, которую вызывают со статистикой после каждой пачки.
+    """
+    stats = ImportStats()
+    batch = []
+
+    def flush():
+        created, updated, unchanged = upsert_batch(batch, using=using)
+        stats.created += created
+        stats.updated += updated
+        stats.unchanged += unchanged
+        batch.clear()
+        if progress:
+            progress(stats)
+
+    for line_number, row, error, source in parsed_rows:
+        stats.rows += 1
+        if error:
+            stats.rejected += 1
+            if rejects is not None:
+                rejects.writerow([line_number, error, source])
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return stats
+
+
+def open_text(path):
+    """Файл в UTF-8 (с BOM или без); "-" - стандартный ввод"""
+    if path == '-':
+        return io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig', newline='')
+    return open(path, encoding='utf-8-sig', newline='')
@@ -0,0 +1,74 @@
+# books/log.py
+"""Структурное логирование без блокировки запросов.
+
+``QueueHandler`` только кладет запись в очередь; форматирование и запись
+в поток делает ``QueueListener`` в отдельном потоке. Записи ниже WARNING
+можно прореживать (``SamplingFilter``), ошибки проходят всегда.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+# Поля LogRecord, которые есть у любой записи - в JSON попадает только extra
+_STANDARD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON с полями из extra"""
+
+    def format(self, record):
+        payload = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in _STANDARD_FIELDS and not name.startswith('_'):
+                payload[name] = value
+        if record.exc_info:
+            payload['exception'] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает долю rate записей ниже WARNING"""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = float(rate)
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1.0 or random.random() < self.rate
+
+
+class BackgroundHandler(logging.handlers.QueueHandler):
+    """QueueHandler со своим слушателем, который пишет JSON в stderr"""
+
+    def __init__(self, max_size=10000, stream=None):
+        super().__init__(queue.Queue(max_size))
+        target = logging.StreamHandler(stream or sys.stderr)
+        target.setFormatter(JsonFormatter())
+        self.listener = logging.handlers.QueueListener(self.queue, target, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.stop)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Лог не должен тормозить запрос: при переполнении запись теряется
+            pass
+
+    def stop(self):
+        """Дописывает очередь и останавливает поток (повторный вызов ничего не делает)"""
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    def close(self):
+        self.stop()
+        super().close()
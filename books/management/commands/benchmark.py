@@ -0,0 +1,75 @@
+# books/management/commands/benchmark.py
+import inspect
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books.benchmarks import BENCHMARKS, compare
+
+
+class Command(BaseCommand):
+    help = 'Микробенчмарки горячих путей (см. books/benchmarks.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*',
+                            help=f'Какие бенчмарки запускать: {", ".join(sorted(BENCHMARKS))} (по умолчанию все)')
+        parser.add_argument('--json', help='Сохранить результаты в JSON-файл')
+        parser.add_argument('--baseline', help='Сравнить с ранее сохраненным --json; при регрессии - ошибка')
+        parser.add_argument('--tolerance', type=float, default=10.0,
+                            help='Допустимый рост задержки относительно baseline, %% (по умолчанию 10)')
+        # Параметры бенчмарков views и concurrency
+        parser.add_argument('--requests', type=int, help='views: замеряемых запросов на страницу')
+        parser.add_argument('--warmup', type=int, help='views: запросов на прогрев перед замером')
+        parser.add_argument('--url', help='views: адрес запущенного сервера, например http://127.0.0.1:8000')
+        parser.add_argument('--concurrency', type=int, help='views: параллельных запросов')
+        parser.add_argument('--connections', type=int, help='concurrency: одновременных запросов во всплеске')
+        parser.add_argument('--threads', type=int, help='concurrency: потоков gthread-воркера для WSGI')
+        parser.add_argument('--db-latency', type=float, help='concurrency: добавить мс к каждому SQL-запросу')
+        parser.add_argument('--cold', action='store_true', default=None,
+                            help='views: очищать кеш перед каждым запросом')
+
+    def handle(self, *args, **options):
+        names = options['names'] or sorted(BENCHMARKS)
+        unknown = set(names) - set(BENCHMARKS)
+        if unknown:
+            raise CommandError(f'Неизвестные бенчмарки: {", ".join(sorted(unknown))}')
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline'], encoding='utf-8') as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f'Не удалось прочитать {options["baseline"]}: {exc}')
+
+        report = {}
+        for name in names:
+            self.stdout.write(self.style.MIGRATE_HEADING(f'⏱️ {name}'))
+            benchmark = BENCHMARKS[name]
+            # Каждому бенчмарку - только те параметры, которые он принимает
+            params = {key: options[key] for key in inspect.signature(benchmark).parameters
+                      if options.get(key) is not None}
+            rows = benchmark(**params)
+            report[name] = rows
+            self._table(rows)
+
+        if options['json']:
+            with open(options['json'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(f'Результаты сохранены в {options["json"]}')
+
+        if baseline is not None:
+            regressions = compare(report, baseline, options['tolerance'] / 100)
+            if regressions:
+                self.stdout.write(self.style.ERROR('📉 Медленнее, чем в baseline:'))
+                self._table(regressions)
+                raise CommandError(f'Регрессий: {len(regressions)}')
+            self.stdout.write(self.style.SUCCESS('✅ Не медленнее baseline'))
+
+    def _table(self, rows):
+        if not rows:
+            return
+        columns = list(rows[0])
+        widths = {column: max(len(column), *(len(str(row[column])) for row in rows)) for column in columns}
+        self.stdout.write('  '.join(column.rjust(widths[column]) for column in columns))
+        for row in rows:
+            self.stdout.write('  '.join(str(row[column]).rjust(widths[column]) for column in columns))
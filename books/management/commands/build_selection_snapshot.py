@@ -0,0 +1,38 @@
+# books/management/commands/build_selection_snapshot.py
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books import snapshot
+
+
+class Command(BaseCommand):
+    help = 'Ранжирует каталог для всех сочетаний параметров подбора и пишет снимок, который воркеры читают через mmap'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None,
+                            help='Файл снимка (по умолчанию SELECTION_SNAPSHOT["PATH"])')
+        parser.add_argument('--candidates', type=int, default=None,
+                            help='Сколько лучших книг хранить на корзину (по умолчанию SELECTION_SNAPSHOT["CANDIDATES"])')
+        parser.add_argument('--database', default=None, help='Алиас базы данных')
+
+    def handle(self, *args, **options):
+        if options['candidates'] is not None and options['candidates'] < 1:
+            raise CommandError('--candidates должен быть положительным')
+
+        started = time.monotonic()
+        header = snapshot.build(
+            path=options['output'], using=options['database'], candidates=options['candidates'],
+            progress=self._progress(options['verbosity']),
+        )
+        path = options['output'] or snapshot.config()['PATH']
+        self.stdout.write(self.style.SUCCESS(
+            f'📦 Снимок подборок {path}: корзин {len(header["buckets"])}, id {header["ids"]}, '
+            f'версия {header["version"]} за {time.monotonic() - started:.1f} с'
+        ))
+
+    def _progress(self, verbosity):
+        def progress(stage, done, total):
+            if verbosity >= 2:
+                self.stdout.write(f'  {stage}: {done}/{total}')
+        return progress
@@ -0,0 +1,44 @@
+# books/management/commands/build_similarity_index.py
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books import similarity
+
+
+class Command(BaseCommand):
+    help = 'Строит индекс похожих книг (векторы описаний и соседи) для страницы книги'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help='Пересчитать только книги, измененные после прошлой сборки')
+        parser.add_argument('--dim', type=int, default=None, help='Размер векторов (по умолчанию SIMILARITY["DIM"])')
+        parser.add_argument('--neighbors', type=int, default=None, help='Сколько соседей хранить на книгу')
+        parser.add_argument('--dir', default=None, help='Каталог сборок (по умолчанию SIMILARITY["DIR"])')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--database', default=None, help='Алиас базы данных')
+
+    def handle(self, *args, **options):
+        for name in ('dim', 'neighbors', 'batch_size'):
+            if options[name] is not None and options[name] < 1:
+                raise CommandError(f'--{name.replace("_", "-")} должен быть положительным')
+
+        started = time.monotonic()
+        meta = similarity.build(
+            using=options['database'], directory=options['dir'], dim=options['dim'],
+            neighbors=options['neighbors'], incremental=options['incremental'],
+            batch_size=options['batch_size'], progress=self._progress(options['verbosity']),
+        )
+        if meta is None:
+            self.stdout.write('Изменений после прошлой сборки нет - индекс не тронут')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'🧭 Индекс похожих книг: {meta["books"]} книг, векторов пересчитано {meta["embedded"]}, '
+            f'соседей {meta["recomputed"]} за {time.monotonic() - started:.1f} с'
+        ))
+
+    def _progress(self, verbosity):
+        def progress(stage, done, total):
+            if verbosity >= 2:
+                self.stdout.write(f'  {stage}: {done}/{total}')
+        return progress
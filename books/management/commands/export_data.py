@@ -0,0 +1,56 @@
+# books/management/commands/export_data.py
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books import export
+
+
+class Command(BaseCommand):
+    help = 'Потоковая выгрузка книг или истории подборок в CSV/JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(export.EXPORTS), help='Что выгружать')
+        parser.add_argument('--format', choices=export.FORMATS, default='csv')
+        parser.add_argument('--gzip', action='store_true', help='Сжимать выгрузку на лету')
+        parser.add_argument('--output', '-o', default='-', help='Файл или "-" для стандартного вывода')
+        parser.add_argument('--after', type=int, default=0, help='Продолжить с записи после этого id')
+        parser.add_argument('--chunk-size', type=int, default=export.DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--database', default=None, help='Алиас базы данных')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size должен быть положительным')
+
+        chunks = export.export(
+            options['name'],
+            options['format'],
+            compress=options['gzip'],
+            using=options['database'],
+            chunk_size=options['chunk_size'],
+            after=options['after'],
+        )
+        started = time.monotonic()
+        written = 0
+        if options['output'] == '-':
+            target = sys.stdout.buffer
+        else:
+            try:
+                target = open(options['output'], 'wb')
+            except OSError as exc:
+                raise CommandError(f'Не удалось открыть {options["output"]}: {exc}')
+        try:
+            for data in chunks:
+                target.write(data)
+                written += len(data)
+        finally:
+            if target is not sys.stdout.buffer:
+                target.close()
+            else:
+                target.flush()
+
+        # Сводка в stderr, чтобы не смешиваться с выгрузкой в stdout
+        self.stderr.write(
+            f'📦 Выгружено {written / 1024 / 1024:.1f} МБ за {time.monotonic() - started:.1f} с'
+        )
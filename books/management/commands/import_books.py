@@ -0,0 +1,72 @@
+# books/management/commands/import_books.py
+import csv
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books import importer
+
+
+class Command(BaseCommand):
+    help = 'Потоковый импорт книг из CSV или JSONL с upsert по (title, author)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл фида или "-" для стандартного ввода')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='По умолчанию - по расширению файла')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Строк в одной транзакции')
+        parser.add_argument('--rejects', help='CSV-файл для отклоненных строк')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Процессов для разбора JSONL (CSV всегда разбирается в одном)')
+        parser.add_argument('--database', default=None, help='Алиас базы данных')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть положительным')
+        if fmt == 'csv' and options['workers'] > 1:
+            self.stderr.write('⚠️ --workers используется только для JSONL, CSV разбирается в одном процессе')
+
+        try:
+            stream = importer.open_text(path)
+        except OSError as exc:
+            raise CommandError(f'Не удалось открыть {path}: {exc}')
+
+        rejects_file = rejects = None
+        if options['rejects']:
+            rejects_file = open(options['rejects'], 'w', encoding='utf-8', newline='')
+            rejects = csv.writer(rejects_file)
+            rejects.writerow(['line', 'error', 'source'])
+
+        def progress(stats):
+            if options['verbosity'] >= 2:
+                self.stdout.write(
+                    f'  {stats.rows} строк, {stats.rows_per_second:.0f} строк/с '
+                    f'(+{stats.created} ~{stats.updated} ={stats.unchanged} !{stats.rejected})'
+                )
+
+        try:
+            with stream:
+                if fmt == 'jsonl':
+                    rows = importer.iter_jsonl(stream, options['batch_size'], workers=options['workers'])
+                else:
+                    rows = importer.iter_csv(stream)
+                stats = importer.import_rows(
+                    rows,
+                    batch_size=options['batch_size'],
+                    rejects=rejects,
+                    using=options['database'],
+                    progress=progress,
+                )
+        finally:
+            if rejects_file:
+                rejects_file.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'📚 Импорт завершен: {stats.rows} строк за {stats.elapsed:.1f} с '
+            f'({stats.rows_per_second:.0f} строк/с)'
+        ))
+        if stats.rejected and options['rejects']:
+            self.stdout.write(f'⚠️ Отклонено {stats.rejected} строк, см. {options["rejects"]}')
+        # Последней строкой - машиночитаемая сводка
+        self.stdout.write(json.dumps(stats.as_dict(), ensure_ascii=False))
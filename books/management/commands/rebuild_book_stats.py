@@ -0,0 +1,19 @@
+# books/management/commands/rebuild_book_stats.py
+from django.core.management.base import BaseCommand
+
+from books import caching, stats
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики статистики каталога по таблице книг'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=None, help='Алиас базы данных')
+
+    def handle(self, *args, **options):
+        fixed = stats.rebuild(using=options['database'])
+        if fixed:
+            caching.bump_catalog_version(options['database'])
+            self.stdout.write(self.style.WARNING(f'⚠️ Исправлено счетчиков: {fixed}'))
+        else:
+            self.stdout.write(self.style.SUCCESS('✅ Счетчики совпадают с каталогом'))
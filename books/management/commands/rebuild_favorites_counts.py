@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from books import caching, favorites
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает Book.favorites_count по таблице избранного'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=None, help='Алиас базы данных')
+
+    def handle(self, *args, **options):
+        fixed = favorites.rebuild_counts(using=options['database'])
+        if fixed:
+            caching.bump_catalog_version(options['database'])
+            self.stdout.write(self.style.WARNING(f'⚠️ Исправлено счетчиков избранного: {fixed}'))
+        else:
+            self.stdout.write(self.style.SUCCESS('✅ Счетчики избранного совпадают с таблицей'))
@@ -0,0 +1,22 @@
+# books/management/commands/rebuild_search_index.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from books.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Полностью перестраивает полнотекстовый индекс каталога'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=None, help='Алиас базы данных')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        backend = get_backend(options['database'], write=True)
+        started = time.monotonic()
+        backend.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Индекс {type(backend).__name__} перестроен за {time.monotonic() - started:.1f} с'
+        ))
@@ -0,0 +1,36 @@
+# books/management/commands/rollup_selections.py
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books import trends
+
+
+class Command(BaseCommand):
+    help = 'Дополняет часовые и дневные свертки истории подборок (только новые строки)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50000, help='Подборок в одной транзакции')
+        parser.add_argument('--recent-hours', type=int, default=trends.RECENT_HOURS,
+                            help='Сколько последних часов пересчитывать всегда')
+        parser.add_argument('--database', default=None, help='Алиас базы данных')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть положительным')
+
+        def progress(result):
+            if options['verbosity'] >= 2:
+                self.stdout.write(f'  {result["rows"]} подборок, {result["hours"]} часов')
+
+        started = time.monotonic()
+        result = trends.roll_up(
+            batch_size=options['batch_size'],
+            recent_hours=options['recent_hours'],
+            using=options['database'],
+            progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'📈 Учтено подборок: {result["rows"]} ({result["hours"]} часовых корзин) '
+            f'за {time.monotonic() - started:.1f} с, отметка {trends.last_rolled_id(options["database"])}'
+        ))
@@ -0,0 +1,74 @@
+# books/management/commands/seed_books.py
+import json
+import time
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from books import seeding
+from books.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Синтетический каталог для нагрузочных замеров: книги, читатели и история подборок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', default='10k', help='Сколько книг создать: 10k, 100k, 1M (0 - не создавать)')
+        parser.add_argument('--users', default=None, help='Сколько читателей (по умолчанию 1 на 20 книг)')
+        parser.add_argument('--selections', default=None,
+                            help='Сколько подборок в истории (по умолчанию 2 на книгу)')
+        parser.add_argument('--days', type=int, default=90, help='За сколько дней растянуть историю')
+        parser.add_argument('--seed', type=int, default=0, help='Зерно генератора: то же зерно - те же данные')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Строк в одной транзакции')
+        parser.add_argument('--database', default=None, help='Алиас базы данных')
+
+    def handle(self, *args, **options):
+        try:
+            books = seeding.parse_size(options['books'])
+            users = seeding.parse_size(options['users']) if options['users'] is not None else max(books // 20, 1)
+            selections = (seeding.parse_size(options['selections'])
+                          if options['selections'] is not None else books * 2)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть положительным')
+
+        using = options['database']
+        common = {'seed': options['seed'], 'batch_size': options['batch_size'], 'using': using,
+                  'progress': self._progress(options['verbosity'])}
+        summary = {}
+        started = time.perf_counter()
+
+        if books:
+            book_ids, book_moods = seeding.seed_books(books, **common)
+        else:
+            # История подборок по уже существующему каталогу
+            rows = list(Book.objects.using(using).values_list('id', 'mood'))
+            book_ids = np.array([pk for pk, _ in rows], dtype=np.int64)
+            book_moods = np.array([mood for _, mood in rows], dtype=object)
+        summary['books'] = books
+
+        user_ids = seeding.seed_users(users, **common) if users else np.array(
+            User.objects.using(using).values_list('id', flat=True), dtype=np.int64,
+        )
+        summary['users'] = users
+
+        summary['selections'] = seeding.seed_selections(
+            selections, user_ids, book_ids, book_moods, days=options['days'], **common,
+        )
+        summary['seconds'] = round(time.perf_counter() - started, 1)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'🌱 Создано: {summary["books"]} книг, {summary["users"]} читателей, '
+            f'{summary["selections"]} подборок за {summary["seconds"]} с'
+        ))
+        if summary['selections']:
+            self.stdout.write('Для графиков трендов запустите manage.py rollup_selections')
+        self.stdout.write(json.dumps(summary, ensure_ascii=False))
+
+    def _progress(self, verbosity):
+        def progress(kind, done):
+            if verbosity >= 2:
+                self.stdout.write(f'  {kind}: {done}')
+        return progress
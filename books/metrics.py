@@ -0,0 +1,450 @@
+# books/metrics.py
+"""Метрики запросов в формате Prometheus.
+
+``RequestMetricsMiddleware`` замеряет каждый запрос: время ответа, число и
+время SQL-запросов, время отрисовки шаблонов (бэкенд
+``InstrumentedDjangoTemplates``) и размер ответа. SQL считает обертка
+``execute_wrappers``, которую получает каждое соединение при создании: у
+асинхронных представлений запросы идут в потоке ``sync_to_async``, и
+замеры текущего запроса доходят туда через ``contextvars``. Все
+копится в памяти процесса; раз в ``FLUSH_INTERVAL`` секунд снимок пишется
+в ``METRICS['DIR']/metrics-<pid>.json`` (через временный файл и rename).
+``/metrics`` складывает снимки всех воркеров gunicorn, поэтому не важно,
+в какой воркер попал запрос Prometheus. Снимки завершившихся процессов
+(gunicorn перезапускает воркеры по max_requests и после сбоев) при чтении
+удаляются: иначе их счетчики навсегда остались бы в сумме, а каталог рос
+бы с каждым перезапуском. Для Prometheus это обычный сброс счетчика.
+
+Без ``METRICS['TOKEN']`` эндпоинт открыт только при DEBUG.
+
+Если представление выходит за ``QUERY_BUDGET`` запросов, в лог
+``books.metrics`` пишутся повторяющиеся запросы (шаблон N+1).
+"""
+import contextvars
+import glob
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.backends.django import DjangoTemplates, Template
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'DIR': os.path.join(tempfile.gettempdir(), 'bookmood-metrics'),
+    'FLUSH_INTERVAL': 1.0,
+    'QUERY_BUDGET': 20,
+    'TOKEN': '',
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+HISTOGRAMS = {
+    'bookmood_request_duration_seconds': ('Время ответа представления', LATENCY_BUCKETS),
+    'bookmood_request_queries': ('SQL-запросов на запрос', QUERY_BUCKETS),
+    'bookmood_request_query_seconds': ('Время SQL на запрос', LATENCY_BUCKETS),
+    'bookmood_template_render_seconds': ('Время отрисовки шаблонов на запрос', LATENCY_BUCKETS),
+    'bookmood_response_bytes': ('Размер ответа', SIZE_BUCKETS),
+}
+COUNTERS = {
+    'bookmood_requests_total': 'Ответов по представлению и коду',
+    'bookmood_query_budget_exceeded_total': 'Запросов сверх бюджета SQL',
+    'bookmood_search_timeouts_total': 'Поисков, прерванных по SEARCH_TIMEOUT_MS',
+    'bookmood_cache_requests_total': 'Обращений к кешу каталога',
+    'bookmood_history_entries_total': 'Записи буфера истории подборок',
+    'bookmood_search_analytics_events_total': 'События аналитики поиска',
+}
+GAUGES = {
+    'bookmood_history_pending': 'Подборок в буфере, еще не записанных в базу',
+}
+
+_NUMBERS = re.compile(r"\b\d+\b")
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_SNAPSHOT_NAME = re.compile(r'metrics-(\d+)\.json')
+_IN_LISTS = re.compile(r'\((?:\s*(?:\?|%s)\s*,)+\s*(?:\?|%s)\s*\)')
+
+
+def options():
+    return {**DEFAULTS, **getattr(settings, 'METRICS', {})}
+
+
+def normalize_sql(sql):
+    """Шаблон запроса без конкретных значений - для поиска повторов"""
+    sql = _STRINGS.sub('?', sql)
+    sql = _NUMBERS.sub('?', sql)
+    return _IN_LISTS.sub('(...)', sql)
+
+
+def _label_key(labels):
+    return json.dumps(sorted(labels.items()), ensure_ascii=False)
+
+
+class Registry:
+    """Метрики одного процесса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self._flushed_at = 0.0
+
+    def inc(self, name, labels, value=1):
+        key = _label_key(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name][1]
+        key = _label_key(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            point = series.get(key)
+            if point is None:
+                point = series[key] = {'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    point['buckets'][i] += 1
+                    break
+            point['sum'] += value
+            point['count'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            data = {
+                'counters': {name: dict(series) for name, series in self.counters.items()},
+                'histograms': {
+                    name: {key: {**point, 'buckets': list(point['buckets'])} for key, point in series.items()}
+                    for name, series in self.histograms.items()
+                },
+            }
+        data['counters'].update(_collected_counters())
+        data['gauges'] = _collected_gauges()
+        return data
+
+    def flush(self, force=False):
+        """Пишет снимок процесса в общий каталог (не чаще FLUSH_INTERVAL)"""
+        config = options()
+        now = time.monotonic()
+        if not force and now - self._flushed_at < config['FLUSH_INTERVAL']:
+            return
+        self._flushed_at = now
+        try:
+            os.makedirs(config['DIR'], exist_ok=True)
+            path = os.path.join(config['DIR'], f'metrics-{os.getpid()}.json')
+            with tempfile.NamedTemporaryFile('w', dir=config['DIR'], delete=False, suffix='.tmp',
+                                             encoding='utf-8') as f:
+                json.dump(self.snapshot(), f, ensure_ascii=False)
+            os.replace(f.name, path)
+        except OSError as exc:
+            logger.warning('Не удалось записать метрики: %s', exc)
+
+
+registry = Registry()
+
+
+def _collected_counters():
+    """Счетчики, которые другие модули уже ведут сами"""
+    from . import analytics, caching, history
+
+    result = {}
+    cache_series = {}
+    for view, values in caching.counters().items():
+        for outcome in ('hits', 'misses'):
+            cache_series[_label_key({'view': view, 'result': outcome})] = values[outcome]
+    if cache_series:
+        result['bookmood_cache_requests_total'] = cache_series
+
+    writer = history.loaded_writer()
+    if writer is not None:
+        stats = writer.stats()
+        result['bookmood_history_entries_total'] = {
+            _label_key({'state': state}): stats[state] for state in ('queued', 'flushed', 'dropped', 'rejected')
+        }
+
+    recorder = analytics.loaded_recorder()
+    if recorder is not None:
+        stats = recorder.stats()
+        result['bookmood_search_analytics_events_total'] = {
+            _label_key({'state': state}): stats[state] for state in ('queued', 'dropped')
+        }
+    return result
+
+
+def _collected_gauges():
+    from . import history
+
+    writer = history.loaded_writer()
+    if writer is None:
+        return {}
+    return {'bookmood_history_pending': {_label_key({}): writer.stats()['pending']}}
+
+
+def merge_snapshots(snapshots):
+    """Суммирует снимки воркеров"""
+    merged = {'counters': {}, 'histograms': {}, 'gauges': {}}
+    for snapshot in snapshots:
+        for kind in ('counters', 'gauges'):
+            for name, series in snapshot.get(kind, {}).items():
+                target = merged[kind].setdefault(name, {})
+                for key, value in series.items():
+                    target[key] = target.get(key, 0) + value
+        for name, series in snapshot.get('histograms', {}).items():
+            target = merged['histograms'].setdefault(name, {})
+            for key, point in series.items():
+                current = target.get(key)
+                if current is None:
+                    target[key] = {**point, 'buckets': list(point['buckets'])}
+                    continue
+                current['buckets'] = [a + b for a, b in zip(current['buckets'], point['buckets'])]
+                current['sum'] += point['sum']
+                current['count'] += point['count']
+    return merged
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Процесс есть, но принадлежит другому пользователю
+        pass
+    return True
+
+
+def read_all():
+    """Снимки всех процессов из общего каталога; свой - самый свежий, из памяти"""
+    own = os.getpid()
+    snapshots = [registry.snapshot()]
+    for path in glob.glob(os.path.join(options()['DIR'], 'metrics-*.json')):
+        match = _SNAPSHOT_NAME.fullmatch(os.path.basename(path))
+        if match is None or int(match[1]) == own:
+            continue
+        if not _process_alive(int(match[1])):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        try:
+            with open(path, encoding='utf-8') as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return merge_snapshots(snapshots)
+
+
+def _format_labels(key, extra=()):
+    pairs = [tuple(pair) for pair in json.loads(key)] + list(extra)
+    if not pairs:
+        return ''
+    escaped = ((name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+               for name, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def render_prometheus(merged):
+    """Текстовый формат экспорта Prometheus 0.0.4"""
+    lines = []
+    for name, help_text in COUNTERS.items():
+        series = merged['counters'].get(name)
+        if not series:
+            continue
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        lines += [f'{name}{_format_labels(key)} {value}' for key, value in sorted(series.items())]
+    for name, help_text in GAUGES.items():
+        series = merged['gauges'].get(name)
+        if not series:
+            continue
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+        lines += [f'{name}{_format_labels(key)} {value}' for key, value in sorted(series.items())]
+    for name, (help_text, bounds) in HISTOGRAMS.items():
+        series = merged['histograms'].get(name)
+        if not series:
+            continue
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for key, point in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, point['buckets']):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(key, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_bucket{_format_labels(key, [("le", "+Inf")])} {point["count"]}')
+            lines.append(f'{name}_sum{_format_labels(key)} {point["sum"]:.6f}')
+            lines.append(f'{name}_count{_format_labels(key)} {point["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+# --- замеры текущего запроса ----------------------------------------------
+
+class RequestStats:
+    __slots__ = ('queries', 'query_seconds', 'template_seconds', 'statements')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.template_seconds = 0.0
+        self.statements = []
+
+
+_current = contextvars.ContextVar('bookmood_request_stats', default=None)
+
+
+def current_stats():
+    return _current.get()
+
+
+def _record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.query_seconds += time.perf_counter() - started
+        stats.queries += 1
+        stats.statements.append(sql)
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    """Подключает замер SQL к соединению (один раз, переподключения не дублируют)"""
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _record_query)
+
+
+def install_on_open_connections():
+    """Для соединений, открытых до импорта модуля"""
+    for connection in connections.all(initialized_only=True):
+        install_query_recorder(None, connection)
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    # Для неразрешенных адресов одна метка: 404 не раздувают число рядов
+    return match.view_name if match is not None else 'unresolved'
+
+
+def _log_duplicates(view, stats, budget):
+    patterns = Counter(normalize_sql(sql) for sql in stats.statements)
+    repeated = [(sql, count) for sql, count in patterns.most_common(5) if count > 1]
+    logger.warning(
+        'Представление %s выполнило %s SQL-запросов (бюджет %s); повторы: %s',
+        view, stats.queries, budget,
+        '; '.join(f'{count}× {sql[:200]}' for sql, count in repeated) or 'нет',
+        extra={'view': view, 'queries': stats.queries, 'budget': budget,
+               'duplicates': [{'sql': sql, 'count': count} for sql, count in repeated]},
+    )
+
+
+class RequestMetricsMiddleware:
+    """Время, SQL, шаблоны и размер ответа по каждому представлению"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        install_on_open_connections()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if request.path == '/metrics':
+            return self.get_response(request)
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if request.path == '/metrics':
+            return await self.get_response(request)
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, stats, elapsed):
+        view = _view_name(request)
+        labels = {'view': view}
+        registry.inc('bookmood_requests_total', {'view': view, 'status': str(response.status_code)})
+        registry.observe('bookmood_request_duration_seconds', labels, elapsed)
+        registry.observe('bookmood_request_queries', labels, stats.queries)
+        registry.observe('bookmood_request_query_seconds', labels, stats.query_seconds)
+        registry.observe('bookmood_template_render_seconds', labels, stats.template_seconds)
+        if not response.streaming:
+            registry.observe('bookmood_response_bytes', labels, len(response.content))
+
+        budget = options()['QUERY_BUDGET']
+        if budget and stats.queries > budget:
+            registry.inc('bookmood_query_budget_exceeded_total', labels)
+            _log_duplicates(view, stats, budget)
+        registry.flush()
+
+
+def metrics_view(request):
+    """/metrics для Prometheus: нужен заголовок Authorization: Bearer <METRICS['TOKEN']>.
+
+    Без токена эндпоинт доступен только при DEBUG - иначе пустая переменная
+    окружения открыла бы метрики (имена представлений, объемы) всем.
+    """
+    token = options()['TOKEN']
+    if not token and not settings.DEBUG:
+        return HttpResponseForbidden()
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponseForbidden()
+    registry.flush(force=True)
+    return HttpResponse(render_prometheus(read_all()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# --- время отрисовки шаблонов ---------------------------------------------
+
+class InstrumentedTemplate(Template):
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_seconds += time.perf_counter() - started
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """Бэкенд шаблонов Django, который засекает время render()"""
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return InstrumentedTemplate(template.template, self)
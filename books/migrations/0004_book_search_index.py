@@ -0,0 +1,57 @@
+from django.db import migrations
+
+from books.stemmer import stem_text
+
+SQLITE_CREATE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS books_book_fts "
+    "USING fts5(title, author, description, tokenize='unicode61 remove_diacritics 2')"
+)
+
+POSTGRES_CREATE = [
+    "ALTER TABLE books_book ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    "GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('russian', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(author, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(description, '')), 'C')"
+    ") STORED",
+    "CREATE INDEX IF NOT EXISTS book_search_vector_gin ON books_book USING GIN (search_vector)",
+]
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        Book = apps.get_model('books', 'Book')
+        schema_editor.execute(SQLITE_CREATE)
+        rows = [
+            (book.pk, stem_text(book.title), stem_text(book.author), stem_text(book.description))
+            for book in Book.objects.using(connection.alias).iterator()
+        ]
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO books_book_fts (rowid, title, author, description) VALUES (%s, %s, %s, %s)',
+                rows,
+            )
+    elif connection.vendor == 'postgresql':
+        for statement in POSTGRES_CREATE:
+            schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS books_book_fts')
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS book_search_vector_gin')
+        schema_editor.execute('ALTER TABLE books_book DROP COLUMN IF EXISTS search_vector')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0003_book_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
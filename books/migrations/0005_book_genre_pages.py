@@ -0,0 +1,23 @@
+# Generated by Django 4.2.11 on 2026-10-17 03:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_book_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='genre',
+            field=models.CharField(blank=True, choices=[('classic', 'Классика'), ('fantasy', 'Фэнтези'), ('novel', 'Роман'), ('detective', 'Детектив'), ('biography', 'Биография')], max_length=20, verbose_name='Жанр'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='pages',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Страниц'),
+        ),
+    ]
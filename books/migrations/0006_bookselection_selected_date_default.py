@@ -0,0 +1,19 @@
+# Generated by Django 4.2.11 on 2026-10-17 03:39
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0005_book_genre_pages'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bookselection',
+            name='selected_date',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата подбора'),
+        ),
+    ]
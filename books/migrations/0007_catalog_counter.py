@@ -0,0 +1,48 @@
+# Generated by Django 4.2.11 on 2026-10-17 03:45
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_counters(apps, schema_editor):
+    """Начальные значения счетчиков по уже существующим книгам"""
+    Book = apps.get_model('books', 'Book')
+    CatalogCounter = apps.get_model('books', 'CatalogCounter')
+    db = schema_editor.connection.alias
+    books = Book.objects.using(db)
+    counters = [CatalogCounter(kind='total', key='', count=books.count())]
+    for field in ('mood', 'complexity', 'author'):
+        counters.extend(
+            CatalogCounter(kind=field, key=row[field], count=row['n'])
+            for row in books.order_by().values(field).annotate(n=Count('id'))
+        )
+    CatalogCounter.objects.using(db).bulk_create(counters, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0006_bookselection_selected_date_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('total', 'Всего книг'), ('mood', 'Настроение'), ('complexity', 'Сложность'), ('author', 'Автор')], max_length=20, verbose_name='Вид')),
+                ('key', models.CharField(blank=True, max_length=100, verbose_name='Значение')),
+                ('count', models.IntegerField(default=0, verbose_name='Количество')),
+            ],
+            options={
+                'verbose_name': 'Счетчик каталога',
+                'verbose_name_plural': 'Счетчики каталога',
+                'indexes': [models.Index(fields=['kind', 'count'], name='catalog_counter_kind_count_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='catalogcounter',
+            constraint=models.UniqueConstraint(fields=('kind', 'key'), name='catalog_counter_kind_key_uniq'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
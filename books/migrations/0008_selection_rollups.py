@@ -0,0 +1,49 @@
+# Generated by Django 4.2.11 on 2026-10-17 03:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0007_catalog_counter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Свертка')),
+                ('last_id', models.BigIntegerField(default=0, verbose_name='Последний id')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+            ],
+            options={
+                'verbose_name': 'Отметка свертки',
+                'verbose_name_plural': 'Отметки сверток',
+            },
+        ),
+        migrations.CreateModel(
+            name='SelectionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Час'), ('day', 'День')], max_length=4, verbose_name='Период')),
+                ('bucket', models.DateTimeField(verbose_name='Начало периода')),
+                ('selected_mood', models.CharField(choices=[('happy', 'Веселое'), ('sad', 'Грустное'), ('inspiring', 'Вдохновляющее'), ('calm', 'Спокойное'), ('adventurous', 'Приключенческое'), ('romantic', 'Романтическое'), ('mysterious', 'Таинственное'), ('thoughtful', 'Задумчивое')], max_length=50, verbose_name='Настроение')),
+                ('selected_complexity', models.CharField(blank=True, choices=[('easy', 'Легкая'), ('medium', 'Средняя'), ('hard', 'Сложная')], max_length=50, verbose_name='Сложность')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Подборок')),
+            ],
+            options={
+                'verbose_name': 'Свертка подборок',
+                'verbose_name_plural': 'Свертки подборок',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='bookselection',
+            index=models.Index(fields=['selected_date'], name='selection_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='selectionrollup',
+            constraint=models.UniqueConstraint(fields=('period', 'bucket', 'selected_mood', 'selected_complexity'), name='selection_rollup_uniq'),
+        ),
+    ]
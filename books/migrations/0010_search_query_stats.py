@@ -0,0 +1,35 @@
+# Generated by Django 4.2.11 on 2026-10-17 04:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0009_book_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchQueryStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('kind', models.CharField(choices=[('all', 'Все запросы'), ('zero', 'Без результатов')], max_length=4, verbose_name='Вид')),
+                ('query', models.CharField(blank=True, max_length=200, verbose_name='Запрос')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Запросов')),
+                ('overestimate', models.PositiveIntegerField(default=0, verbose_name='Погрешность')),
+                ('total_ms', models.FloatField(default=0, verbose_name='Суммарное время, мс')),
+                ('results', models.PositiveIntegerField(default=0, verbose_name='Найдено (последний раз)')),
+            ],
+            options={
+                'verbose_name': 'Поисковый запрос',
+                'verbose_name_plural': 'Поисковые запросы',
+                'indexes': [models.Index(fields=['kind', 'day', 'count'], name='search_query_stat_top_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='searchquerystat',
+            constraint=models.UniqueConstraint(fields=('day', 'kind', 'query'), name='search_query_stat_uniq'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.11 on 2026-10-17 05:10
+
+from django.db import migrations, models
+
+LEGACY_TABLE = 'users_userprofile'
+
+
+def merge_legacy_profiles(apps, schema_editor):
+    """Переносит профили бывшей модели users.UserProfile, если ее таблица есть в базе"""
+    connection = schema_editor.connection
+    if LEGACY_TABLE not in connection.introspection.table_names():
+        return
+    UserProfile = apps.get_model('books', 'UserProfile')
+    db = connection.alias
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT user_id, favorite_books FROM {LEGACY_TABLE}')
+        legacy = dict(cursor.fetchall())
+    existing = set(UserProfile.objects.using(db).filter(user_id__in=legacy).values_list('user_id', flat=True))
+    UserProfile.objects.using(db).bulk_create(
+        [UserProfile(user_id=user_id) for user_id in legacy if user_id not in existing], batch_size=1000,
+    )
+    profiles = list(UserProfile.objects.using(db).filter(user_id__in=[pk for pk, notes in legacy.items() if notes]))
+    for profile in profiles:
+        profile.favorite_books_notes = legacy[profile.user_id]
+    UserProfile.objects.using(db).bulk_update(profiles, ['favorite_books_notes'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0010_search_query_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='favorite_books_notes',
+            field=models.TextField(blank=True, verbose_name='Любимые книги (текстом)'),
+        ),
+        migrations.RunPython(merge_legacy_profiles, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.11 on 2026-10-17 05:40
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_favorites_count(apps, schema_editor):
+    """Начальные значения по уже отмеченному избранному"""
+    Book = apps.get_model('books', 'Book')
+    UserProfile = apps.get_model('books', 'UserProfile')
+    db = schema_editor.connection.alias
+    favorites = UserProfile.favorite_books.through.objects.using(db)
+    counts = favorites.order_by().values('book_id').annotate(n=Count('id')).values_list('book_id', 'n')
+    books = []
+    for book_id, count in counts:
+        books.append(Book(id=book_id, favorites_count=count))
+    Book.objects.using(db).bulk_update(books, ['favorites_count'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0011_userprofile_merge'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['favorites_count', 'id'], name='book_favorites_count_id_idx'),
+        ),
+        migrations.RunPython(fill_favorites_count, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,6 @@
-from django.db import models
+from django.db import DatabaseError, models, router, transaction
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class Book(models.Model):
     MOOD_CHOICES = [
@@ -19,18 +20,105 @@ class Book(models.Model):
         ('hard', 'Сложная'),
     ]
 
+    GENRE_CHOICES = [
+        ('classic', 'Классика'),
+        ('fantasy', 'Фэнтези'),
+        ('novel', 'Роман'),
+        ('detective', 'Детектив'),
+        ('biography', 'Биография'),
+    ]
+
     title = models.CharField(max_length=200, verbose_name='Название')
     author = models.CharField(max_length=100, verbose_name='Автор')
     mood = models.CharField(max_length=50, choices=MOOD_CHOICES, verbose_name='Настроение')
     complexity = models.CharField(max_length=50, choices=COMPLEXITY_CHOICES, verbose_name='Сложность')
     description = models.TextField(verbose_name='Описание', blank=True)
+    genre = models.CharField(max_length=20, choices=GENRE_CHOICES, blank=True, verbose_name='Жанр')
+    pages = models.PositiveIntegerField(null=True, blank=True, verbose_name='Страниц')
+    # Для инкрементальных пересборок (build_similarity_index --incremental).
+    # bulk_update его не трогает - массовые правки ставят время сами
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name='Изменена')
+    # Сколько читателей добавили книгу в избранное. Меняется только через F()
+    # в обработчике m2m_changed (books/favorites.py), сверяется командой
+    # rebuild_favorites_counts
+    favorites_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном')
 
     def __str__(self):
         return f"{self.title} - {self.author}"
 
+    # Сохранение и удаление вместе с обработчиками сигналов - одна транзакция:
+    # счетчики статистики (CatalogCounter) не расходятся с таблицей книг
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        using = using or router.db_for_write(Book, instance=self)
+        with transaction.atomic(using=using):
+            if self._state.adding or force_insert or update_fields is not None:
+                super().save(force_insert=force_insert, force_update=force_update, using=using,
+                             update_fields=update_fields)
+                return
+            # Устаревший favorites_count из загруженного объекта не должен
+            # затереть параллельные F()-обновления. Отложенные (.only/.defer)
+            # поля тоже не пишем - как и сам Django для таких объектов
+            deferred = self.get_deferred_fields()
+            fields = [field.attname for field in self._meta.concrete_fields
+                      if not field.primary_key and field.name != 'favorites_count'
+                      and field.attname not in deferred]
+            try:
+                with transaction.atomic(using=using):
+                    super().save(force_update=force_update, using=using, update_fields=fields)
+            except DatabaseError:
+                if force_update or Book.objects.using(using).filter(pk=self.pk).exists():
+                    raise
+                # Строки нет (удалена или сохраняем в другую базу) - обычное
+                # сохранение вставит ее, как без ограничения полей
+                super().save(using=using)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(Book, instance=self)):
+            return super().delete(*args, **kwargs)
+
     class Meta:
         verbose_name = 'Книга'
         verbose_name_plural = 'Книги'
+        # Индексы под курсорную пагинацию каталога: (поле сортировки, id)
+        indexes = [
+            models.Index(fields=['title', 'id'], name='book_title_id_idx'),
+            models.Index(fields=['author', 'id'], name='book_author_id_idx'),
+            models.Index(fields=['mood', 'title', 'id'], name='book_mood_title_id_idx'),
+            models.Index(fields=['mood', 'complexity', 'id'], name='book_mood_complexity_id_idx'),
+            # "Самые любимые": обратный проход по индексу, без сортировки каталога
+            models.Index(fields=['favorites_count', 'id'], name='book_favorites_count_id_idx'),
+        ]
+
+class CatalogCounter(models.Model):
+    """Денормализованные счетчики каталога для страницы статистики.
+
+    Поддерживаются сигналами (см. books/stats.py), сверяются командой
+    ``rebuild_book_stats``.
+    """
+    KIND_CHOICES = [
+        ('total', 'Всего книг'),
+        ('mood', 'Настроение'),
+        ('complexity', 'Сложность'),
+        ('author', 'Автор'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name='Вид')
+    key = models.CharField(max_length=100, blank=True, verbose_name='Значение')
+    count = models.IntegerField(default=0, verbose_name='Количество')
+
+    def __str__(self):
+        return f"{self.kind}:{self.key} = {self.count}"
+
+    class Meta:
+        verbose_name = 'Счетчик каталога'
+        verbose_name_plural = 'Счетчики каталога'
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'key'], name='catalog_counter_kind_key_uniq'),
+        ]
+        # Топ авторов - обратный проход по индексу, без сортировки всех авторов
+        indexes = [
+            models.Index(fields=['kind', 'count'], name='catalog_counter_kind_count_idx'),
+        ]
 
 class UserProfile(models.Model):
     READING_SPEED_CHOICES = [
@@ -48,6 +136,8 @@ class UserProfile(models.Model):
         verbose_name='Скорость чтения'
     )
     favorite_books = models.ManyToManyField(Book, blank=True, verbose_name='Избранные книги')
+    # Перенесено из бывшей модели users.UserProfile (миграция 0011)
+    favorite_books_notes = models.TextField(blank=True, verbose_name='Любимые книги (текстом)')
 
     def __str__(self):
         return f"Профиль {self.user.username}"
@@ -61,7 +151,9 @@ class BookSelection(models.Model):
     selected_mood = models.CharField(max_length=50, choices=Book.MOOD_CHOICES, verbose_name='Выбранное настроение')
     selected_complexity = models.CharField(max_length=50, choices=Book.COMPLEXITY_CHOICES,
                                            verbose_name='Выбранная сложность')
-    selected_date = models.DateTimeField(auto_now_add=True, verbose_name='Дата подбора')
+    # default, а не auto_now_add: отложенная запись (books.history) сохраняет
+    # время самого подбора, а не момент сброса буфера в базу
+    selected_date = models.DateTimeField(default=timezone.now, verbose_name='Дата подбора')
     recommended_books = models.ManyToManyField(Book, verbose_name='Рекомендованные книги')
 
     def __str__(self):
@@ -71,23 +163,110 @@ class BookSelection(models.Model):
         verbose_name = 'Подборка книг'
         verbose_name_plural = 'Подборки книг'
         ordering = ['-selected_date']  # Сначала новые
+        # Пересчет часовых корзин трендов читает подборки по диапазону дат
+        indexes = [
+            models.Index(fields=['selected_date'], name='selection_date_idx'),
+        ]
+
+
+class SelectionRollup(models.Model):
+    """Число подборок за час или день по настроению и сложности (books/trends.py)"""
+    PERIOD_CHOICES = [
+        ('hour', 'Час'),
+        ('day', 'День'),
+    ]
 
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES, verbose_name='Период')
+    bucket = models.DateTimeField(verbose_name='Начало периода')
+    selected_mood = models.CharField(max_length=50, choices=Book.MOOD_CHOICES, verbose_name='Настроение')
+    selected_complexity = models.CharField(max_length=50, choices=Book.COMPLEXITY_CHOICES, blank=True,
+                                           verbose_name='Сложность')
+    count = models.PositiveIntegerField(default=0, verbose_name='Подборок')
+
+    def __str__(self):
+        return f"{self.period} {self.bucket:%d.%m.%Y %H:%M} {self.selected_mood}/{self.selected_complexity}: {self.count}"
+
+    class Meta:
+        verbose_name = 'Свертка подборок'
+        verbose_name_plural = 'Свертки подборок'
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'bucket', 'selected_mood', 'selected_complexity'],
+                                    name='selection_rollup_uniq'),
+        ]
 
-# Сигналы для автоматического создания профиля при создании пользователя
-# ЭТО ДОЛЖНО БЫТЬ ВНЕ ВСЕХ КЛАССОВ!
+
+class RollupWatermark(models.Model):
+    """До какого id подборки уже учтены в свертках"""
+    name = models.CharField(max_length=50, unique=True, verbose_name='Свертка')
+    last_id = models.BigIntegerField(default=0, verbose_name='Последний id')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Обновлено')
+
+    def __str__(self):
+        return f"{self.name}: {self.last_id}"
+
+    class Meta:
+        verbose_name = 'Отметка свертки'
+        verbose_name_plural = 'Отметки сверток'
+
+
+class SearchQueryStat(models.Model):
+    """Частые поисковые запросы за день (books/analytics.py).
+
+    Счетчики приближенные: ``overestimate`` - на сколько ``count`` может
+    быть завышен. Строка с пустым запросом - итог дня по всем запросам.
+    """
+    KIND_CHOICES = [
+        ('all', 'Все запросы'),
+        ('zero', 'Без результатов'),
+    ]
+
+    day = models.DateField(verbose_name='День')
+    kind = models.CharField(max_length=4, choices=KIND_CHOICES, verbose_name='Вид')
+    query = models.CharField(max_length=200, blank=True, verbose_name='Запрос')
+    count = models.PositiveIntegerField(default=0, verbose_name='Запросов')
+    overestimate = models.PositiveIntegerField(default=0, verbose_name='Погрешность')
+    total_ms = models.FloatField(default=0, verbose_name='Суммарное время, мс')
+    results = models.PositiveIntegerField(default=0, verbose_name='Найдено (последний раз)')
+
+    def __str__(self):
+        return f"{self.day:%d.%m.%Y} {self.kind} «{self.query}»: {self.count}"
+
+    @property
+    def avg_ms(self):
+        # Время копится только с момента, как запрос попал в top - делим на точную часть счетчика
+        exact = self.count - self.overestimate
+        return round(self.total_ms / exact, 1) if exact > 0 else None
+
+    class Meta:
+        verbose_name = 'Поисковый запрос'
+        verbose_name_plural = 'Поисковые запросы'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'kind', 'query'], name='search_query_stat_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['kind', 'day', 'count'], name='search_query_stat_top_idx'),
+        ]
+
+
+# Профиль создается вместе с пользователем; у пользователей, созданных в обход
+# сигналов (bulk_create, старые данные), - при первом обращении через get_profile.
+# Сохранение пользователя (в том числе last_login при каждом входе) профиль не трогает
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
 
 @receiver(post_save, sender=User)
-def create_user_profile(sender, instance, created, **kwargs):
+def create_user_profile(sender, instance, created, raw=False, using=None, **kwargs):
     """Создать профиль при создании нового пользователя"""
-    if created:
-        UserProfile.objects.create(user=instance)
+    if created and not raw:
+        UserProfile.objects.using(using).get_or_create(user=instance)
 
 
-@receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    """Сохранить профиль при сохранении пользователя"""
-    if hasattr(instance, 'userprofile'):
-        instance.userprofile.save()
+def get_profile(user):
+    """Профиль пользователя; создается, если его еще нет"""
+    try:
+        return user.userprofile
+    except UserProfile.DoesNotExist:
+        profile, _ = UserProfile.objects.get_or_create(user=user)
+        user.userprofile = profile
+        return profile
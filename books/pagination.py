@@ -0,0 +1,176 @@
+# books/pagination.py
+"""Курсорная (keyset) пагинация каталога.
+
+Вместо OFFSET страница продолжается от последней показанной записи:
+``WHERE (title, id) > (:title, :id) ORDER BY title, id LIMIT n``.
+Поэтому первая и пятисотая страницы стоят одинаково - база просто
+продолжает чтение индекса с нужного места.
+"""
+import base64
+import json
+
+from django.db.models import Q
+
+# Допустимые сортировки: ключ из query string → поле модели.
+# Вторым ключом всегда идет id, чтобы порядок был строгим.
+SORT_FIELDS = {
+    'title': 'title',
+    'author': 'author',
+    'id': 'id',
+}
+# Тип значения сортировки в курсоре для каждого поля: курсор приходит от
+# клиента, и число вместо строки иначе дошло бы до сравнения в SQL
+SORT_VALUE_TYPES = {
+    'title': str,
+    'author': str,
+    'id': int,
+}
+
+# Целые в курсоре - в пределах знакового 64-битного: большее число
+# валит драйвер базы (OverflowError) вместо пустой выдачи
+MAX_INT = 2 ** 63 - 1
+
+DEFAULT_SORT = 'title'
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    """Курсор поврежден или не подходит к выбранной сортировке"""
+
+
+def parse_sort(value):
+    """Разбирает ``?sort=`` в пару (поле, по убыванию?)"""
+    value = (value or '').strip()
+    descending = value.startswith('-')
+    key = value.lstrip('-')
+    if key not in SORT_FIELDS:
+        return SORT_FIELDS[DEFAULT_SORT], False
+    return SORT_FIELDS[key], descending
+
+
+def encode_cursor(sort_value, pk, sort_field, backwards=False):
+    """Упаковывает позицию в строку, безопасную для URL"""
+    payload = json.dumps(
+        [sort_field, sort_value, pk, int(backwards)],
+        ensure_ascii=False,
+        separators=(',', ':'),
+    ).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, sort_field):
+    """Распаковывает курсор: (значение сортировки, id, назад?)"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        field, sort_value, pk, backwards = json.loads(
+            base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+        )
+    except (ValueError, TypeError, UnicodeError) as exc:
+        raise InvalidCursor(str(exc)) from exc
+
+    if field != sort_field or not _is_a(pk, int):
+        raise InvalidCursor('cursor does not match sort order')
+    if not _is_a(sort_value, SORT_VALUE_TYPES[sort_field]):
+        raise InvalidCursor(f'cursor value for {sort_field} has wrong type')
+    if not _in_range(pk) or (isinstance(sort_value, int) and not _in_range(sort_value)):
+        raise InvalidCursor('cursor value out of range')
+    return sort_value, pk, bool(backwards)
+
+
+def _is_a(value, kind):
+    # bool - подкласс int, но в курсоре это ошибка
+    return isinstance(value, kind) and not isinstance(value, bool)
+
+
+def _in_range(value):
+    return -MAX_INT - 1 <= value <= MAX_INT
+
+
+def _seek_filter(sort_field, sort_value, pk, forward):
+    """Условие "строго после (value, id)" в заданном направлении.
+
+    Первое слагаемое ``field >= value`` позволяет базе начать
+    range scan по составному индексу (field, id) сразу с нужного места.
+    """
+    if sort_field == 'id':
+        return Q(id__gt=pk) if forward else Q(id__lt=pk)
+    if forward:
+        return Q(**{f'{sort_field}__gte': sort_value}) & (
+            Q(**{f'{sort_field}__gt': sort_value}) | Q(id__gt=pk)
+        )
+    return Q(**{f'{sort_field}__lte': sort_value}) & (
+        Q(**{f'{sort_field}__lt': sort_value}) | Q(id__lt=pk)
+    )
+
+
+class KeysetPage:
+    """Одна страница выдачи и курсоры на соседние страницы"""
+
+    def __init__(self, items, sort_field, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.sort_field = sort_field
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def paginate(queryset, sort='title', cursor=None, per_page=DEFAULT_PAGE_SIZE):
+    """Возвращает KeysetPage для queryset.
+
+    ``sort`` - значение из query string (``title``, ``-author``, ``id``...),
+    ``cursor`` - строка из ``next_cursor``/``prev_cursor`` предыдущей страницы.
+    """
+    sort_field, descending = parse_sort(sort)
+    per_page = max(1, min(int(per_page), MAX_PAGE_SIZE))
+
+    backwards = False
+    if cursor:
+        sort_value, pk, backwards = decode_cursor(cursor, sort_field)
+        # Вперед по убывающей сортировке = "меньше" в терминах индекса
+        forward = descending == backwards
+        queryset = queryset.filter(_seek_filter(sort_field, sort_value, pk, forward))
+
+    # Назад читаем в обратном порядке, потом разворачиваем
+    reverse_scan = descending != backwards
+    prefix = '-' if reverse_scan else ''
+    ordering = [f'{prefix}{sort_field}'] if sort_field == 'id' else [
+        f'{prefix}{sort_field}', f'{prefix}id'
+    ]
+
+    # Берем на одну запись больше, чтобы узнать, есть ли продолжение
+    rows = list(queryset.order_by(*ordering)[:per_page + 1])
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    def cursor_for(obj, to_previous):
+        # Строки .values() (API) - словари с полем сортировки и id
+        if isinstance(obj, dict):
+            return encode_cursor(obj[sort_field], obj['id'], sort_field, to_previous)
+        return encode_cursor(getattr(obj, sort_field), obj.pk, sort_field, to_previous)
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if backwards:
+            next_cursor = cursor_for(rows[-1], False)
+            prev_cursor = cursor_for(rows[0], True) if has_more else None
+        else:
+            next_cursor = cursor_for(rows[-1], False) if has_more else None
+            prev_cursor = cursor_for(rows[0], True) if cursor else None
+
+    return KeysetPage(rows, sort_field, next_cursor, prev_cursor)
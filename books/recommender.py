@@ -0,0 +1,332 @@
+# books/recommender.py
+"""Векторный рекомендатель для подбора книг.
+
+Каталог держится в памяти воркера как матрица признаков numpy:
+настроение, сложность (порядковая), жанр и корзина объема (log2 страниц),
+по одному int8-столбцу на признак. Все четыре признака категориальные,
+поэтому комбинация признаков книги сводится к одному коду (uint16: кодов
+чуть больше тысячи, 2 байта на книгу вместо 8), а оценка
+запроса - к таблице из ``len(MOODS) * 3 * (жанры + 1) * LENGTH_BUCKETS``
+значений. Один проход ``np.take`` оценивает весь каталог, ``argpartition``
+выбирает top-k без полной сортировки. SQL на запрос - только выборка
+итоговых k книг по id.
+
+Матрица обновляется сигналами ``post_save``/``post_delete``.
+"""
+import math
+import threading
+
+import numpy as np
+
+from .models import Book
+
+MOODS = [key for key, _ in Book.MOOD_CHOICES]
+COMPLEXITIES = [key for key, _ in Book.COMPLEXITY_CHOICES]
+# Последний код жанра - "не указан"
+GENRES = [key for key, _ in Book.GENRE_CHOICES]
+UNKNOWN_GENRE = len(GENRES)
+
+# Корзины объема: представительное число страниц, граница - середина по log2
+LENGTH_PAGES = np.array([100, 160, 224, 320, 448, 640, 896, 1200], dtype=np.float32)
+LENGTH_BUCKETS = len(LENGTH_PAGES)
+_LENGTH_EDGES = np.sqrt(LENGTH_PAGES[:-1] * LENGTH_PAGES[1:])
+
+# Объем книги без указанных страниц оцениваем по сложности
+DEFAULT_PAGES = {'easy': 200, 'medium': 350, 'hard': 500}
+
+# Страниц в час для UserProfile.reading_speed
+PAGES_PER_HOUR = {'slow': 20, 'medium': 30, 'fast': 45}
+# Часов чтения за неделю для поля формы time_available
+WEEKLY_HOURS = {'short': 3, 'medium': 10, 'long': 21}
+
+# Близкие настроения получают частичный балл: подбор не пустеет на "почти"
+RELATED_MOODS = {
+    ('happy', 'inspiring'): 0.5,
+    ('happy', 'adventurous'): 0.4,
+    ('happy', 'romantic'): 0.3,
+    ('sad', 'thoughtful'): 0.5,
+    ('sad', 'romantic'): 0.3,
+    ('calm', 'thoughtful'): 0.5,
+    ('calm', 'romantic'): 0.3,
+    ('inspiring', 'thoughtful'): 0.4,
+    ('inspiring', 'adventurous'): 0.4,
+    ('adventurous', 'mysterious'): 0.5,
+    ('mysterious', 'thoughtful'): 0.3,
+}
+
+MOOD_WEIGHT = 3.0
+COMPLEXITY_WEIGHT = 1.0
+GENRE_WEIGHT = 1.5
+LENGTH_WEIGHT = 0.5
+# Уже показанные книги опускаются ниже любой непоказанной, но не исчезают:
+# если новых подходящих книг мало, выдача добирается знакомыми
+SEEN_PENALTY = 1000.0
+
+CODE_COUNT = len(MOODS) * len(COMPLEXITIES) * (len(GENRES) + 1) * LENGTH_BUCKETS
+# Отдельный код для удаленных книг, его оценка всегда -inf
+DEAD_CODE = CODE_COUNT
+# Кодов с DEAD_CODE 1153 - помещаются в uint16
+CODE_DTYPE = np.uint16
+# Таблица id → строка держится, пока id плотные: не больше стольких
+# элементов таблицы на одну книгу (4 байта каждый)
+LOOKUP_DENSITY = 4
+
+
+def _mood_similarity():
+    matrix = np.eye(len(MOODS), dtype=np.float32)
+    for (first, second), value in RELATED_MOODS.items():
+        i, j = MOODS.index(first), MOODS.index(second)
+        matrix[i, j] = matrix[j, i] = value
+    return matrix
+
+
+MOOD_SIMILARITY = _mood_similarity()
+
+
+def length_bucket(pages, complexity):
+    """Корзина объема книги"""
+    if not pages:
+        pages = DEFAULT_PAGES.get(complexity, DEFAULT_PAGES['medium'])
+    return int(np.searchsorted(_LENGTH_EDGES, pages))
+
+
+def encode_features(mood, complexity, genre, pages):
+    """Строка матрицы признаков: (настроение, сложность, жанр, объем)"""
+    return (
+        MOODS.index(mood) if mood in MOODS else 0,
+        COMPLEXITIES.index(complexity) if complexity in COMPLEXITIES else 1,
+        GENRES.index(genre) if genre in GENRES else UNKNOWN_GENRE,
+        length_bucket(pages, complexity),
+    )
+
+
+def combine_codes(features):
+    """Единый код комбинации признаков для каждой строки"""
+    features = features.astype(np.intp)
+    return ((features[:, 0] * len(COMPLEXITIES) + features[:, 1]) * (len(GENRES) + 1)
+            + features[:, 2]) * LENGTH_BUCKETS + features[:, 3]
+
+
+def score_table(mood=None, complexity=None, genre=None, time_available=None, reading_speed='medium'):
+    """Оценка каждой комбинации признаков для запроса.
+
+    Таблица формы (настроения, сложности, жанры, объемы) складывается из
+    независимых слагаемых broadcast-сложением и разворачивается в вектор
+    по тем же кодам, что и ``combine_codes``.
+    """
+    shape = (len(MOODS), len(COMPLEXITIES), len(GENRES) + 1, LENGTH_BUCKETS)
+    table = np.zeros(shape, dtype=np.float32)
+
+    if mood in MOODS:
+        table += MOOD_WEIGHT * MOOD_SIMILARITY[MOODS.index(mood)][:, None, None, None]
+
+    if complexity in COMPLEXITIES:
+        distance = np.abs(np.arange(len(COMPLEXITIES)) - COMPLEXITIES.index(complexity))
+        table -= COMPLEXITY_WEIGHT * distance.astype(np.float32)[None, :, None, None]
+
+    if genre in GENRES:
+        bonus = np.zeros(len(GENRES) + 1, dtype=np.float32)
+        bonus[GENRES.index(genre)] = GENRE_WEIGHT
+        table += bonus[None, None, :, None]
+
+    if time_available in WEEKLY_HOURS:
+        speed = PAGES_PER_HOUR.get(reading_speed, PAGES_PER_HOUR['medium'])
+        target_pages = WEEKLY_HOURS[time_available] * speed
+        # Штраф за каждое удвоение/уполовинивание относительно удобного объема
+        penalty = np.abs(np.log2(LENGTH_PAGES / target_pages))
+        table -= LENGTH_WEIGHT * penalty.astype(np.float32)[None, None, None, :]
+
+    # Последний элемент - код удаленных книг
+    return np.append(table.ravel(), np.float32(-np.inf))
+
+
+class Recommender:
+    """Матрица признаков каталога и top-k подбор по ней"""
+
+    def __init__(self, ids, features):
+        self._lock = threading.Lock()
+        count = len(ids)
+        capacity = max(1024, count)
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._features = np.zeros((capacity, 4), dtype=np.int8)
+        self._codes = np.full(capacity, DEAD_CODE, dtype=CODE_DTYPE)
+        self._count = count
+        if count:
+            self._ids[:count] = ids
+            self._features[:count] = features
+            self._codes[:count] = combine_codes(self._features[:count])
+        self._lookup = None
+        self._build_lookup(int(ids[-1]) + 1 if count else 0)
+
+    def _build_lookup(self, size):
+        """Прямая таблица id → строка: исключение тысяч id - один gather вместо бинарного поиска"""
+        if size > LOOKUP_DENSITY * max(self._count, 1024):
+            # Id слишком разреженные - остается бинарный поиск по _ids
+            self._lookup = None
+            return
+        lookup = np.full(size, -1, dtype=np.int32)
+        lookup[self._ids[:self._count]] = np.arange(self._count, dtype=np.int32)
+        self._lookup = lookup
+
+    @classmethod
+    def from_database(cls, using=None, chunk_size=10000):
+        ids, features = [], []
+        rows = Book.objects.using(using).order_by('id').values_list(
+            'id', 'mood', 'complexity', 'genre', 'pages'
+        )
+        for book_id, mood, complexity, genre, pages in rows.iterator(chunk_size=chunk_size):
+            ids.append(book_id)
+            features.append(encode_features(mood, complexity, genre, pages))
+        return cls(
+            np.array(ids, dtype=np.int64),
+            np.array(features, dtype=np.int8).reshape(-1, 4),
+        )
+
+    def __len__(self):
+        return int(np.count_nonzero(self._codes[:self._count] != DEAD_CODE))
+
+    def _row_of(self, book_id):
+        if self._lookup is not None:
+            if 0 <= book_id < len(self._lookup) and self._lookup[book_id] >= 0:
+                return int(self._lookup[book_id])
+            return None
+        row = int(np.searchsorted(self._ids[:self._count], book_id))
+        if row < self._count and self._ids[row] == book_id:
+            return row
+        return None
+
+    def rows_of(self, book_ids):
+        """Номера строк для массива id, отсутствующие в каталоге отбрасываются"""
+        book_ids = np.asarray(book_ids, dtype=np.int64)
+        lookup = self._lookup
+        if lookup is not None:
+            rows = lookup[book_ids[(book_ids >= 0) & (book_ids < len(lookup))]]
+            return rows[rows >= 0]
+        ids = self._ids[:self._count]
+        rows = np.searchsorted(ids, book_ids)
+        found = rows < self._count
+        rows, book_ids = rows[found], book_ids[found]
+        return rows[ids[rows] == book_ids]
+
+    def _grow(self):
+        capacity = len(self._ids) * 2
+        for name, fill in (('_ids', 0), ('_codes', DEAD_CODE)):
+            old = getattr(self, name)
+            new = np.full(capacity, fill, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+        features = np.zeros((capacity, 4), dtype=np.int8)
+        features[:len(self._features)] = self._features
+        self._features = features
+
+    def upsert(self, book_id, mood, complexity, genre, pages):
+        """Добавить книгу или обновить ее признаки"""
+        features = np.array(encode_features(mood, complexity, genre, pages), dtype=np.int8)
+        with self._lock:
+            row = self._row_of(book_id)
+            if row is None:
+                if self._count == len(self._ids):
+                    self._grow()
+                row = int(np.searchsorted(self._ids[:self._count], book_id))
+                if row < self._count:
+                    # Id меньше уже загруженных (редко: явный pk) - сдвигаем хвост,
+                    # чтобы массив id оставался отсортированным
+                    tail = slice(row, self._count)
+                    shifted = slice(row + 1, self._count + 1)
+                    self._ids[shifted] = self._ids[tail].copy()
+                    self._codes[shifted] = self._codes[tail].copy()
+                    self._features[shifted] = self._features[tail].copy()
+                self._ids[row] = book_id
+                self._count += 1
+                self._update_lookup(book_id, row)
+            self._features[row] = features
+            self._codes[row] = combine_codes(features[None, :])[0]
+
+    def _update_lookup(self, book_id, row):
+        lookup = self._lookup
+        if lookup is None or book_id >= len(lookup):
+            # Новый максимальный id (или разреженные id) - перестраиваем с запасом
+            size = int(self._ids[self._count - 1]) + 1
+            if lookup is not None:
+                # Запас на рост каталога, но без выхода за порог плотности
+                size = max(size, min(len(lookup) * 2, LOOKUP_DENSITY * self._count))
+            self._build_lookup(size)
+            return
+        # Строки после вставленной могли сдвинуться на одну
+        self._lookup[self._ids[row:self._count]] = np.arange(row, self._count, dtype=np.int32)
+
+    def remove(self, book_id):
+        with self._lock:
+            row = self._row_of(book_id)
+            if row is not None:
+                self._codes[row] = DEAD_CODE
+
+    def _snapshot(self):
+        with self._lock:
+            # Только ссылки: _grow подменяет массивы, и id должны соответствовать кодам
+            return self._ids, self._codes, self._count
+
+    def scores(self, table, snapshot=None):
+        """Оценка каждой строки каталога (один проход np.take)"""
+        _, codes, count = snapshot or self._snapshot()
+        out = np.empty(count, dtype=np.float32)
+        # Все коды меньше len(table): 'clip' лишь отключает проверку границ
+        np.take(table, codes[:count], out=out, mode='clip')
+        return out
+
+    def recommend(self, k=6, exclude_ids=None, seen_ids=None, **query):
+        """Id лучших k книг по убыванию оценки.
+
+        ``query`` - параметры ``score_table``: mood, complexity, genre,
+        time_available, reading_speed. ``exclude_ids`` убираются из выдачи
+        совсем, ``seen_ids`` (отсортированный массив, см. ``books.seen``)
+        попадают в нее только если непоказанных книг не хватило.
+        """
+        snapshot = self._snapshot()
+        scores = self.scores(score_table(**query), snapshot)
+        if seen_ids is not None and len(seen_ids):
+            scores[self.rows_of(seen_ids)] -= SEEN_PENALTY
+        if exclude_ids is not None and len(exclude_ids):
+            scores[self.rows_of(exclude_ids)] = -np.inf
+        return self._top(scores, k, snapshot[0])
+
+    def _top(self, scores, k, ids):
+        if not len(scores):
+            return []
+        k = min(k, len(scores))
+        top = np.argpartition(scores, -k)[-k:]
+        # Равные оценки упорядочиваем по номеру строки - результат стабилен
+        top = top[np.lexsort((top, -scores[top]))]
+        top = top[np.isfinite(scores[top])]
+        return ids[top].tolist()
+
+
+_recommender = None
+_recommender_lock = threading.Lock()
+
+
+def get_recommender():
+    """Рекомендатель текущего воркера, строится при первом обращении"""
+    global _recommender
+    if _recommender is None:
+        with _recommender_lock:
+            if _recommender is None:
+                _recommender = Recommender.from_database()
+    return _recommender
+
+
+def loaded_recommender():
+    """Рекомендатель, если он уже построен, иначе None (для сигналов)"""
+    return _recommender
+
+
+def reset_recommender():
+    global _recommender
+    with _recommender_lock:
+        _recommender = None
+
+
+def estimated_hours(book, reading_speed='medium'):
+    """Примерное время чтения книги в часах"""
+    pages = book.pages or DEFAULT_PAGES.get(book.complexity, DEFAULT_PAGES['medium'])
+    return math.ceil(pages / PAGES_PER_HOUR.get(reading_speed, PAGES_PER_HOUR['medium']))
@@ -0,0 +1,127 @@
+# books/routers.py
+"""Чтение с реплик, запись в основную базу.
+
+Реплики - алиасы ``replica1``, ``replica2``... в ``DATABASES`` (их задает
+``DATABASE_REPLICA_URLS``, см. settings.py). На реплики уходит только
+чтение каталога, поиска и статистики (``REPLICA_MODELS``); подборки,
+профили, пользователи и сессии всегда читаются из основной базы.
+
+Реплика отстает от основной базы, поэтому после записи запрос читает
+только из основной, а ``ReadYourWritesMiddleware`` ставит cookie на
+``REPLICA_STICKY_SECONDS`` секунд: следующие запросы этого браузера тоже
+идут в основную базу и видят собственные изменения. Cookie, а не сессия -
+чтобы не читать сессию из базы на каждый запрос.
+
+Без реплик роутер ничего не решает, и все идет в ``default``.
+"""
+import random
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# Модели, которые можно читать с реплики (model._meta.label_lower)
+REPLICA_MODELS = {
+    'books.book',
+    'books.catalogcounter',
+    'books.selectionrollup',
+    'books.searchquerystat',
+}
+STICKY_COOKIE = 'bookmood_primary'
+DEFAULT_STICKY_SECONDS = 10
+
+
+class RequestPin:
+    """Куда читать в текущем запросе: pinned - только основная база"""
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+# Объект, а не флаг: запись в потоке sync_to_async видна и middleware
+_current = ContextVar('bookmood_request_pin', default=None)
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias.startswith('replica')]
+
+
+def sticky_seconds():
+    return getattr(settings, 'REPLICA_STICKY_SECONDS', DEFAULT_STICKY_SECONDS)
+
+
+class PrimaryReplicaRouter:
+    def __init__(self):
+        self.replicas = replica_aliases()
+
+    def db_for_read(self, model, **hints):
+        if not self.replicas or model._meta.label_lower not in REPLICA_MODELS:
+            return DEFAULT_DB_ALIAS
+        pin = _current.get()
+        if pin is not None and (pin.pinned or pin.wrote):
+            return DEFAULT_DB_ALIAS
+        return random.choice(self.replicas)
+
+    def db_for_write(self, model, **hints):
+        pin = _current.get()
+        if pin is not None:
+            pin.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики - копии основной базы: связи между ними допустимы
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # migrate --database replica1 нужен только локально, где реплика - второй файл SQLite
+        return None
+
+
+class ReadYourWritesMiddleware:
+    """Закрепляет запросы за основной базой после записи (read-your-writes)"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        pin = self.pin_for(request)
+        token = _current.set(pin)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.stick(pin, response)
+
+    async def __acall__(self, request):
+        pin = self.pin_for(request)
+        token = _current.set(pin)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.stick(pin, response)
+
+    @staticmethod
+    def pin_for(request):
+        try:
+            until = float(request.COOKIES.get(STICKY_COOKIE, 0))
+        except ValueError:
+            until = 0
+        return RequestPin(pinned=until > time.time())
+
+    @staticmethod
+    def stick(pin, response):
+        if pin.wrote:
+            seconds = sticky_seconds()
+            response.set_cookie(STICKY_COOKIE, f'{time.time() + seconds:.0f}', max_age=seconds,
+                                httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,162 @@
+# books/sampling.py
+"""Равномерная случайная выборка книг по настроению и сложности.
+
+Для каждой пары (настроение, сложность) - или только одного из них - в
+памяти воркера лежит массив id подходящих книг. Массив загружается при
+первом обращении и перечитывается, когда меняется версия каталога
+(``caching.catalog_version``), то есть после любого изменения книг - в
+том числе в другом воркере, если кеш общий.
+
+Выборка k книг - O(k) в среднем и не зависит от размера корзины: из
+потока случайных позиций берутся первые k различных (при k много
+меньше размера корзины повторы редки). Маленькие корзины просто
+перемешиваются целиком. Вместо ``ORDER BY RANDOM()``, который сортирует
+все подходящие строки на каждый запрос.
+
+С ``seed`` поток позиций воспроизводим: страница ``page`` - это позиции
+с ``page * k`` по ``(page + 1) * k`` одного и того же потока, поэтому
+страницы не пересекаются и не меняются между запросами. Если часть книг
+уже показана, каждая попытка добора заново начинает тот же поток, и
+страницы остаются срезами одной последовательности непоказанных книг.
+
+Из корзины больше ``SMALL_BUCKET`` поток дает не больше ``n // 2``
+различных позиций (дальше почти каждая позиция - повтор). Поэтому
+постраничный обход с ``seed`` доходит только до половины такой корзины,
+а номера страниц дальше идут по кругу с нулевой (``page_count``). Так
+страница всегда полная и стоит O(k): иначе ``?page=10**9`` заставлял бы
+выбирать позиции до конца потока на каждый запрос. Для подборки это
+приемлемо - полный обход каталога дает список книг, а не случайная выборка.
+"""
+import threading
+import zlib
+
+import numpy as np
+
+from . import caching
+from .models import Book
+
+# Корзины не больше этой перемешиваются целиком - O(n), но n мало
+SMALL_BUCKET = 4096
+# Сколько пачек случайных позиций тянуть, прежде чем сдаться
+# (корзина почти целиком из уже показанных книг)
+MAX_ROUNDS = 8
+
+
+def _rng(seed):
+    if seed is None:
+        return np.random.default_rng()
+    # Строковые ключи ("user:5", ключ сессии) - в стабильное число
+    return np.random.default_rng(zlib.crc32(str(seed).encode('utf-8')))
+
+
+def _contains(sorted_ids, values):
+    """Маска: какие values есть в отсортированном массиве sorted_ids"""
+    if not len(sorted_ids):
+        return np.zeros(len(values), dtype=bool)
+    positions = np.searchsorted(sorted_ids, values)
+    positions[positions == len(sorted_ids)] = 0
+    return sorted_ids[positions] == values
+
+
+def sample_positions(rng, n, count):
+    """Первые count различных позиций из [0, n) в порядке случайного потока"""
+    count = min(count, n)
+    if n <= SMALL_BUCKET:
+        return rng.permutation(n)[:count]
+    chosen = {}
+    batch = max(2 * count, 16)
+    # Больше половины корзины подряд не выбираем: повторов стало бы слишком много
+    count = min(count, n // 2)
+    while len(chosen) < count:
+        for position in rng.integers(0, n, size=batch).tolist():
+            chosen.setdefault(position, None)
+            if len(chosen) == count:
+                break
+    return np.fromiter(chosen, dtype=np.int64, count=len(chosen))
+
+
+def page_count(n, k):
+    """Сколько полных страниц по k дает поток позиций корзины из n книг"""
+    reachable = n if n <= SMALL_BUCKET else n // 2
+    return max(reachable // k, 1)
+
+
+class BucketSampler:
+    """Корзины id книг по (настроение, сложность) одного процесса"""
+
+    def __init__(self, using=None):
+        self.using = using
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def ids(self, mood=None, complexity=None):
+        """Отсортированный массив id книг корзины (пустые параметры - любые)"""
+        key = (mood or None, complexity or None)
+        version = caching.catalog_version()
+        cached = self._buckets.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        books = Book.objects.using(self.using).order_by('id')
+        if mood:
+            books = books.filter(mood=mood)
+        if complexity:
+            books = books.filter(complexity=complexity)
+        ids = np.fromiter(books.values_list('id', flat=True).iterator(chunk_size=10000), dtype=np.int64)
+        with self._lock:
+            self._buckets[key] = (version, ids)
+        return ids
+
+    def sample(self, k, mood=None, complexity=None, seen_ids=None, seed=None, page=0):
+        """До k случайных id корзины.
+
+        ``seen_ids`` (отсортированный массив, см. ``books.seen``) в выдачу
+        не попадают; если непоказанных мало, результат короче k. С
+        ``seed`` выборка стабильна, ``page`` - номер страницы потока (по
+        кругу, см. ``page_count``).
+        """
+        ids = self.ids(mood, complexity)
+        if not len(ids):
+            return []
+        start = page % page_count(len(ids), k) * k
+        if seen_ids is None or not len(seen_ids):
+            return ids[sample_positions(_rng(seed), len(ids), start + k)[start:]].tolist()
+
+        # Показанные книги отбрасываем после выборки и добираем еще. Каждая
+        # попытка - начало того же потока (генератор создается заново), иначе
+        # состав страницы зависел бы от того, сколько попыток понадобилось
+        picked = []
+        wanted = start + k
+        for _ in range(MAX_ROUNDS):
+            candidates = ids[sample_positions(_rng(seed), len(ids), wanted * 2)]
+            fresh = candidates[~_contains(seen_ids, candidates)]
+            picked = list(dict.fromkeys(fresh.tolist()))
+            if len(picked) >= wanted or len(candidates) < wanted * 2:
+                # Поток исчерпан: вся корзина или ее половина (см. sample_positions)
+                break
+            wanted *= 2
+        return picked[start:start + k]
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def get_sampler():
+    """Корзины текущего воркера"""
+    global _sampler
+    if _sampler is None:
+        with _sampler_lock:
+            if _sampler is None:
+                _sampler = BucketSampler()
+    return _sampler
+
+
+def reset_sampler():
+    global _sampler
+    with _sampler_lock:
+        _sampler = None
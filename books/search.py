@@ -0,0 +1,335 @@
+# books/search.py
+"""Полнотекстовый поиск по каталогу.
+
+Один интерфейс, несколько реализаций в зависимости от базы:
+
+* SQLite - виртуальная таблица FTS5 ``books_book_fts`` со стеммированным
+  текстом, ранжирование через ``bm25`` с весами колонок;
+* PostgreSQL - генерируемая колонка ``books_book.search_vector`` (tsvector,
+  словарь ``russian``) с GIN-индексом, ранжирование через ``ts_rank_cd``;
+* остальные базы - запасной вариант на ``icontains``.
+
+Таблица и колонка создаются миграцией ``0004_book_search_index``.
+
+Запрос к индексу ограничен ``SEARCH_TIMEOUT_MS``: слишком общий запрос по
+большому каталогу прерывается и не держит поток воркера.
+"""
+import time
+from contextlib import contextmanager, nullcontext
+
+from django.conf import settings
+from django.db import OperationalError, connections, router, transaction
+from django.db.models import Q
+
+from .models import Book
+from .stemmer import stem, stem_text, tokenize
+
+FTS_TABLE = 'books_book_fts'
+
+# Вес совпадения в названии/авторе относительно описания
+TITLE_WEIGHT = 10.0
+AUTHOR_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+DEFAULT_PAGE_SIZE = 20
+# Поля книги, по которым можно сузить поиск (фасеты)
+FILTER_FIELDS = ('mood', 'complexity')
+# Раз в столько инструкций виртуальной машины SQLite проверяет время
+PROGRESS_STEPS = 1000
+
+
+class SearchTimeout(Exception):
+    """Запрос к индексу не уложился в отведенное время"""
+
+
+class SearchPage:
+    """Страница результатов поиска с общим числом совпадений"""
+
+    def __init__(self, books, total, number, per_page, timed_out=False, matched_ids=None):
+        self.books = books
+        self.total = total
+        self.number = number
+        self.per_page = per_page
+        self.timed_out = timed_out
+        # Все совпадения без фильтров - для счетчиков фасетов
+        self.matched_ids = matched_ids
+
+    @property
+    def num_pages(self):
+        return max(1, -(-self.total // self.per_page))
+
+    @property
+    def has_next(self):
+        return self.number < self.num_pages
+
+    @property
+    def has_previous(self):
+        return self.number > 1
+
+    def __iter__(self):
+        return iter(self.books)
+
+    def __len__(self):
+        return len(self.books)
+
+
+class BaseSearchBackend:
+    """Общий интерфейс поискового индекса"""
+
+    def __init__(self, using):
+        self.using = using
+
+    @property
+    def connection(self):
+        return connections[self.using]
+
+    def index_books(self, books):
+        """Добавить или обновить книги в индексе"""
+
+    def remove_books(self, ids):
+        """Убрать книги из индекса"""
+
+    def rebuild(self, batch_size=2000):
+        """Переиндексировать весь каталог"""
+        self.clear()
+        batch = []
+        for book in Book.objects.using(self.using).only('id', 'title', 'author', 'description').iterator(
+            chunk_size=batch_size
+        ):
+            batch.append(book)
+            if len(batch) >= batch_size:
+                self.index_books(batch)
+                batch = []
+        if batch:
+            self.index_books(batch)
+
+    def clear(self):
+        """Очистить индекс"""
+
+    def search_ids(self, query, offset=0, limit=DEFAULT_PAGE_SIZE, filters=None):
+        """Id книг по убыванию релевантности и общее число совпадений.
+
+        ``filters`` - {поле: значение} из ``FILTER_FIELDS``.
+        """
+        raise NotImplementedError
+
+    def match_ids(self, query):
+        """Id всех совпадений без ранжирования"""
+        raise NotImplementedError
+
+    @contextmanager
+    def time_limit(self, milliseconds):
+        """Прерывает запросы к индексу дольше milliseconds (SearchTimeout)"""
+        yield
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+    """FTS5 + русский стеммер на стороне Python"""
+
+    @staticmethod
+    def build_match(query):
+        # Каждое слово - префиксный поиск по основе: "достоевск"*
+        stems = [stem(token) for token in tokenize(query)]
+        return ' '.join(f'"{value}"*' for value in stems if value)
+
+    @contextmanager
+    def time_limit(self, milliseconds):
+        self.connection.ensure_connection()
+        raw = self.connection.connection
+        deadline = time.monotonic() + milliseconds / 1000
+        # Ненулевой ответ обработчика прерывает текущий запрос
+        raw.set_progress_handler(lambda: time.monotonic() > deadline, PROGRESS_STEPS)
+        try:
+            yield
+        except OperationalError as exc:
+            if time.monotonic() > deadline:
+                raise SearchTimeout from exc
+            raise
+        finally:
+            raw.set_progress_handler(None, 0)
+
+    def index_books(self, books):
+        rows = [
+            (book.pk, stem_text(book.title), stem_text(book.author), stem_text(book.description))
+            for book in books
+        ]
+        if not rows:
+            return
+        with self.connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, author, description) VALUES (%s, %s, %s, %s)',
+                rows,
+            )
+
+    def remove_books(self, ids):
+        ids = list(ids)
+        if not ids:
+            return
+        with self.connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in ids])
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+
+    def search_ids(self, query, offset=0, limit=DEFAULT_PAGE_SIZE, filters=None):
+        match = self.build_match(query)
+        if not match:
+            return [], 0
+        condition, params = filter_sql(filters)
+        if condition:
+            condition = f' AND rowid IN (SELECT id FROM books_book WHERE {condition})'
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s{condition}',
+                           [match, *params])
+            total = cursor.fetchone()[0]
+            if not total or offset >= total:
+                return [], total
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s{condition} '
+                f'ORDER BY bm25({FTS_TABLE}, %s, %s, %s), rowid LIMIT %s OFFSET %s',
+                [match, *params, TITLE_WEIGHT, AUTHOR_WEIGHT, DESCRIPTION_WEIGHT, limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()], total
+
+    def match_ids(self, query):
+        match = self.build_match(query)
+        if not match:
+            return []
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match])
+            return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """tsvector-колонка поддерживается самой базой, индексировать нечего"""
+
+    @staticmethod
+    def build_tsquery(query):
+        # Слова уже без спецсимволов (\w+), добавляем префиксный поиск
+        return ' & '.join(f'{token}:*' for token in tokenize(query))
+
+    @contextmanager
+    def time_limit(self, milliseconds):
+        # SET LOCAL действует до конца транзакции - открываем свою (или точку сохранения)
+        with transaction.atomic(using=self.using):
+            with self.connection.cursor() as cursor:
+                cursor.execute('SET LOCAL statement_timeout = %s', [max(int(milliseconds), 1)])
+            try:
+                yield
+            except OperationalError as exc:
+                # psycopg2 QueryCanceled - подкласс OperationalError
+                raise SearchTimeout from exc
+            with self.connection.cursor() as cursor:
+                cursor.execute('SET LOCAL statement_timeout TO DEFAULT')
+
+    def rebuild(self, batch_size=2000):
+        # Генерируемая колонка пересчитывается при каждом UPDATE/INSERT
+        with self.connection.cursor() as cursor:
+            cursor.execute('REINDEX INDEX book_search_vector_gin')
+
+    def search_ids(self, query, offset=0, limit=DEFAULT_PAGE_SIZE, filters=None):
+        tsquery = self.build_tsquery(query)
+        if not tsquery:
+            return [], 0
+        condition, params = filter_sql(filters)
+        if condition:
+            condition = f' AND {condition}'
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT count(*) FROM books_book WHERE search_vector @@ to_tsquery('russian', %s){condition}",
+                [tsquery, *params],
+            )
+            total = cursor.fetchone()[0]
+            if not total or offset >= total:
+                return [], total
+            cursor.execute(
+                "SELECT id FROM books_book, to_tsquery('russian', %s) AS q "
+                f"WHERE search_vector @@ q{condition} "
+                "ORDER BY ts_rank_cd(search_vector, q) DESC, id LIMIT %s OFFSET %s",
+                [tsquery, *params, limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()], total
+
+    def match_ids(self, query):
+        tsquery = self.build_tsquery(query)
+        if not tsquery:
+            return []
+        with self.connection.cursor() as cursor:
+            cursor.execute("SELECT id FROM books_book WHERE search_vector @@ to_tsquery('russian', %s)", [tsquery])
+            return [row[0] for row in cursor.fetchall()]
+
+
+class SimpleSearchBackend(BaseSearchBackend):
+    """Запасной вариант для баз без полнотекстового индекса"""
+
+    def _matches(self, query):
+        return Book.objects.using(self.using).filter(
+            Q(title__icontains=query) | Q(author__icontains=query) | Q(description__icontains=query)
+        )
+
+    def search_ids(self, query, offset=0, limit=DEFAULT_PAGE_SIZE, filters=None):
+        query = query.strip()
+        if not query:
+            return [], 0
+        matches = self._matches(query).filter(**{field: filters[field] for field in FILTER_FIELDS
+                                                  if (filters or {}).get(field)})
+        total = matches.count()
+        ids = list(matches.order_by('title', 'id').values_list('id', flat=True)[offset:offset + limit])
+        return ids, total
+
+    def match_ids(self, query):
+        query = query.strip()
+        return list(self._matches(query).values_list('id', flat=True)) if query else []
+
+
+def filter_sql(filters):
+    """Условие WHERE по books_book для фильтров поиска и его параметры"""
+    fields = [field for field in FILTER_FIELDS if (filters or {}).get(field)]
+    # Имена колонок - только из FILTER_FIELDS, значения - параметрами
+    return ' AND '.join(f'{field} = %s' for field in fields), [filters[field] for field in fields]
+
+
+BACKENDS = {
+    'sqlite': SQLiteFTSBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_backend(using=None, write=False):
+    """Поисковый бэкенд для базы, в которой лежат книги"""
+    if using is None:
+        using = router.db_for_write(Book) if write else router.db_for_read(Book)
+    vendor = connections[using].vendor
+    return BACKENDS.get(vendor, SimpleSearchBackend)(using)
+
+
+def search_books(query, page=1, per_page=DEFAULT_PAGE_SIZE, timeout=None, filters=None, with_matches=False,
+                 fields=None):
+    """Страница результатов поиска, книги в порядке релевантности.
+
+    ``timeout`` - лимит запроса к индексу в мс (по умолчанию
+    ``SEARCH_TIMEOUT_MS``, 0 - без лимита). Прерванный поиск - пустая
+    страница с ``timed_out=True``. ``filters`` - {поле: значение} из
+    ``FILTER_FIELDS``; ``with_matches`` - заполнить ``matched_ids`` всеми
+    совпадениями без фильтров (в том же лимите времени). С ``fields``
+    книги - словари ``.values(*fields)`` вместо моделей (для API).
+    """
+    page = max(1, page)
+    if timeout is None:
+        timeout = getattr(settings, 'SEARCH_TIMEOUT_MS', 0)
+    backend = get_backend()
+    try:
+        with backend.time_limit(timeout) if timeout else nullcontext():
+            ids, total = backend.search_ids(query, offset=(page - 1) * per_page, limit=per_page, filters=filters)
+            matched_ids = backend.match_ids(query) if with_matches else None
+    except SearchTimeout:
+        return SearchPage([], 0, page, per_page, timed_out=True)
+    books = Book.objects.using(backend.using)
+    if fields:
+        books_by_id = {row['id']: row for row in books.filter(pk__in=ids).values('id', *fields)}
+    else:
+        books_by_id = books.in_bulk(ids)
+    books = [books_by_id[pk] for pk in ids if pk in books_by_id]
+    return SearchPage(books, total, page, per_page, matched_ids=matched_ids)
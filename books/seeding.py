@@ -0,0 +1,187 @@
+# books/seeding.py
+"""Синтетический каталог для нагрузочных замеров (``manage.py seed_books``).
+
+Книги, читатели и история подборок генерируются из фиксированного зерна:
+один и тот же ``seed`` дает те же строки, поэтому замеры до и после
+изменения сравнимы. Распределения неравномерные, как в живом каталоге:
+веселых и приключенческих книг больше, чем грустных, у немногих авторов
+много книг, немногие читатели делают большую часть подборок (степенной
+закон), подборки чаще вечером.
+
+Все пишется пачками через ``bulk_create``; о новых книгах индексы и
+счетчики узнают из ``catalog_bulk_saved``, как при импорте.
+"""
+import re
+from datetime import timedelta
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.db import router, transaction
+from django.utils import timezone
+
+from . import history
+from .models import Book, UserProfile
+from .signals import catalog_bulk_saved
+
+MOOD_WEIGHTS = {
+    'happy': 0.22, 'adventurous': 0.16, 'mysterious': 0.14, 'romantic': 0.13,
+    'thoughtful': 0.11, 'calm': 0.10, 'inspiring': 0.08, 'sad': 0.06,
+}
+COMPLEXITY_WEIGHTS = {'easy': 0.45, 'medium': 0.40, 'hard': 0.15}
+GENRE_WEIGHTS = {'novel': 0.30, 'detective': 0.22, 'fantasy': 0.20, 'classic': 0.18, 'biography': 0.05, '': 0.05}
+SPEED_WEIGHTS = {'medium': 0.55, 'fast': 0.25, 'slow': 0.20}
+# Доля подборок по часу суток: ночью мало, пик вечером
+HOUR_WEIGHTS = np.array([1, 1, 1, 1, 1, 2, 3, 5, 6, 5, 4, 4, 5, 5, 4, 4, 5, 6, 8, 10, 11, 10, 7, 3], dtype=float)
+
+FIRST_NAMES = ['Анна', 'Борис', 'Вера', 'Глеб', 'Дарья', 'Егор', 'Жанна', 'Илья', 'Ксения', 'Лев',
+               'Мария', 'Никита', 'Ольга', 'Павел', 'Роман', 'Софья', 'Тимур', 'Ульяна', 'Федор', 'Юлия']
+LAST_NAMES = ['Андреев', 'Белов', 'Волков', 'Громов', 'Данилов', 'Ершов', 'Жуков', 'Зайцев', 'Ильин',
+              'Козлов', 'Лебедев', 'Морозов', 'Новиков', 'Орлов', 'Петров', 'Родионов', 'Соколов',
+              'Тихонов', 'Уваров', 'Фролов', 'Хромов', 'Чернов', 'Шестаков', 'Яковлев']
+ADJECTIVES = ['Тихий', 'Последний', 'Северный', 'Забытый', 'Далекий', 'Золотой', 'Ночной', 'Старый',
+              'Весенний', 'Тайный', 'Летний', 'Морской', 'Горный', 'Зимний', 'Светлый', 'Темный']
+NOUNS = ['сад', 'дом', 'остров', 'город', 'берег', 'лес', 'поезд', 'маяк', 'путь', 'ветер',
+         'сон', 'мост', 'край', 'голос', 'след', 'свет', 'день', 'вечер', 'архив', 'шторм']
+PHRASES = ['история о дружбе и выборе', 'расследование старого дела', 'путешествие через всю страну',
+           'роман о первой любви', 'хроника одной семьи', 'размышления о времени и памяти',
+           'приключения на краю света', 'тайна заброшенной усадьбы', 'повесть о взрослении']
+
+SIZE_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([kKmMкКмМ]?)\s*$')
+
+
+def parse_size(value):
+    """'10k' → 10000, '1M' → 1000000, '2500' → 2500"""
+    match = SIZE_PATTERN.match(str(value))
+    if not match:
+        raise ValueError(f'Непонятный размер: {value!r}')
+    number, suffix = match.groups()
+    multiplier = {'': 1, 'k': 1000, 'к': 1000, 'm': 1000000, 'м': 1000000}[suffix.lower()]
+    return int(float(number) * multiplier)
+
+
+def _pick(rng, weights, size):
+    keys = list(weights)
+    p = np.array([weights[key] for key in keys], dtype=float)
+    return np.array(keys, dtype=object)[rng.choice(len(keys), size=size, p=p / p.sum())]
+
+
+def _power_law(rng, n, size, exponent=0.7):
+    """Номера 0..n-1 с вероятностью ~ 1 / (номер + 1) ** exponent"""
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    return rng.choice(n, size=size, p=weights / weights.sum())
+
+
+def author_name(index):
+    first = FIRST_NAMES[index % len(FIRST_NAMES)]
+    last = LAST_NAMES[index // len(FIRST_NAMES) % len(LAST_NAMES)]
+    series = index // (len(FIRST_NAMES) * len(LAST_NAMES))
+    return f'{first} {last}' + (f' {series + 1}' if series else '')
+
+
+def generate_books(count, rng, start=0, authors=None):
+    """Несохраненные книги с номерами start..start+count-1 от authors авторов"""
+    author_ids = _power_law(rng, authors or max(count // 8, 1), count)
+    moods = _pick(rng, MOOD_WEIGHTS, count)
+    complexities = _pick(rng, COMPLEXITY_WEIGHTS, count)
+    genres = _pick(rng, GENRE_WEIGHTS, count)
+    pages = np.clip(rng.lognormal(5.6, 0.5, size=count), 40, 1500).astype(int)
+    adjectives = rng.integers(0, len(ADJECTIVES), size=count)
+    nouns = rng.integers(0, len(NOUNS), size=count)
+    phrases = rng.integers(0, len(PHRASES), size=count)
+
+    return [
+        Book(
+            title=f'{ADJECTIVES[adjectives[i]]} {NOUNS[nouns[i]]} {start + i + 1}',
+            author=author_name(int(author_ids[i])),
+            mood=moods[i],
+            complexity=complexities[i],
+            genre=genres[i],
+            pages=int(pages[i]),
+            description=f'{PHRASES[phrases[i]].capitalize()}.',
+        )
+        for i in range(count)
+    ]
+
+
+def seed_books(count, seed=0, batch_size=5000, using=None, progress=None):
+    """Создает count книг. Возвращает массивы (id, настроение) созданных книг"""
+    using = using or router.db_for_write(Book)
+    rng = np.random.default_rng(seed)
+    # Авторов примерно по одному на 8 книг каталога
+    authors = max(count // 8, 1)
+    ids, moods = [], []
+    for start in range(0, count, batch_size):
+        books = generate_books(min(batch_size, count - start), rng, start, authors)
+        with transaction.atomic(using=using):
+            Book.objects.using(using).bulk_create(books)
+            catalog_bulk_saved.send(sender=Book, created=books, updated=[], previous={}, using=using)
+        ids.extend(book.pk for book in books)
+        moods.extend(book.mood for book in books)
+        if progress:
+            progress('books', start + len(books))
+    return np.array(ids, dtype=np.int64), np.array(moods, dtype=object)
+
+
+def seed_users(count, seed=0, batch_size=5000, using=None, progress=None):
+    """Создает читателей seed<seed>-<n> с профилями. Возвращает их id"""
+    using = using or router.db_for_write(User)
+    rng = np.random.default_rng(seed + 1)
+    prefix = f'seed{seed}-'
+    for start in range(0, count, batch_size):
+        size = min(batch_size, count - start)
+        speeds = _pick(rng, SPEED_WEIGHTS, size)
+        with transaction.atomic(using=using):
+            # bulk_create не шлет post_save - профили создаем сами.
+            # Пароль непригоден для входа: хешировать миллион паролей незачем
+            users = User.objects.using(using).bulk_create(
+                [User(username=f'{prefix}{start + i}', password='!') for i in range(size)],
+                ignore_conflicts=True,
+            )
+            created = dict(User.objects.using(using).filter(
+                username__in=[user.username for user in users], userprofile__isnull=True,
+            ).values_list('username', 'id'))
+            UserProfile.objects.using(using).bulk_create([
+                UserProfile(user_id=created[user.username], reading_speed=speeds[i])
+                for i, user in enumerate(users) if user.username in created
+            ])
+        if progress:
+            progress('users', start + size)
+    return np.array(
+        User.objects.using(using).filter(username__startswith=prefix).values_list('id', flat=True),
+        dtype=np.int64,
+    )
+
+
+def seed_selections(count, user_ids, book_ids, book_moods, seed=0, days=90, batch_size=5000,
+                    using=None, progress=None, now=None):
+    """История подборок за последние days дней: по 6 книг нужного настроения"""
+    if not len(user_ids) or not len(book_ids):
+        return 0
+    rng = np.random.default_rng(seed + 2)
+    now = now or timezone.now()
+    pools = {mood: book_ids[book_moods == mood] for mood in MOOD_WEIGHTS}
+    moods_available = {mood: len(pool) for mood, pool in pools.items() if len(pool)}
+    weights = {mood: MOOD_WEIGHTS[mood] for mood in moods_available}
+    # Активные читатели делают больше подборок
+    user_ranks = rng.permutation(len(user_ids))
+
+    for start in range(0, count, batch_size):
+        size = min(batch_size, count - start)
+        moods = _pick(rng, weights, size)
+        complexities = _pick(rng, COMPLEXITY_WEIGHTS, size)
+        users = user_ids[user_ranks[_power_law(rng, len(user_ids), size)]]
+        day_offsets = rng.integers(0, days, size=size)
+        hours = rng.choice(24, size=size, p=HOUR_WEIGHTS / HOUR_WEIGHTS.sum())
+        minutes = rng.integers(0, 60, size=size)
+        entries = []
+        for i in range(size):
+            pool = pools[moods[i]]
+            picked = pool[rng.integers(0, len(pool), size=min(6, len(pool)))]
+            moment = (now - timedelta(days=int(day_offsets[i]))).replace(
+                hour=int(hours[i]), minute=int(minutes[i]), second=0, microsecond=0,
+            )
+            entries.append((int(users[i]), moods[i], complexities[i], picked.tolist(), min(moment, now)))
+        history.write_entries(entries, using=using)
+        if progress:
+            progress('selections', start + size)
+    return count
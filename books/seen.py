@@ -0,0 +1,69 @@
+# books/seen.py
+"""Множество уже показанных пользователю книг.
+
+Для каждого пользователя в кеше лежит отсортированный массив id книг
+(``int64``, 8 байт на книгу) - все, что он получал в подборках, плюс
+избранное. Массив загружается из базы при первом обращении и дальше
+дополняется при каждой новой подборке, поэтому исключение тысяч книг не
+превращается в ``NOT IN (SELECT ...)`` в каждом запросе: рекомендатель
+просто обнуляет оценки этих строк (``Recommender.rows_of`` - бинарный
+поиск по массиву).
+
+Ключ живет ``SEEN_TTL`` секунд: при локальном кеше у каждого воркера своя
+копия, и устаревшая копия рано или поздно перечитывается из базы.
+"""
+import numpy as np
+from django.core.cache import cache
+
+from .models import BookSelection, UserProfile
+
+SEEN_TTL = 600
+_EMPTY = np.empty(0, dtype=np.int64)
+
+
+def _key(user_id):
+    return f'seen:v1:{user_id}'
+
+
+def load_from_database(user_id, using=None):
+    """Все книги из истории подборок и избранного пользователя"""
+    shown = BookSelection.recommended_books.through.objects.using(using).filter(
+        bookselection__user_id=user_id,
+    ).values_list('book_id', flat=True)
+    favorites = UserProfile.favorite_books.through.objects.using(using).filter(
+        userprofile__user_id=user_id,
+    ).values_list('book_id', flat=True)
+    ids = np.fromiter(shown.iterator(chunk_size=5000), dtype=np.int64)
+    ids = np.concatenate([ids, np.fromiter(favorites, dtype=np.int64)])
+    return np.unique(ids)
+
+
+def get_seen(user_id):
+    """Отсортированный массив id книг, которые пользователь уже видел"""
+    data = cache.get(_key(user_id))
+    if data is not None:
+        return np.frombuffer(data, dtype=np.int64)
+    ids = load_from_database(user_id)
+    cache.set(_key(user_id), ids.tobytes(), SEEN_TTL)
+    return ids
+
+
+def add_seen(user_id, book_ids):
+    """Дополнить множество новыми книгами (после подборки или добавления в избранное)"""
+    if not book_ids:
+        return
+    # Без записи в кеше сначала читаем базу: иначе в кеш попала бы только
+    # свежая подборка, а вся прошлая история потерялась бы до истечения TTL
+    ids = np.union1d(get_seen(user_id), np.asarray(list(book_ids), dtype=np.int64))
+    cache.set(_key(user_id), ids.tobytes(), SEEN_TTL)
+
+
+def forget(user_id):
+    cache.delete(_key(user_id))
+
+
+def seen_for(user):
+    """Множество для запроса: у анонимных пользователей оно пустое"""
+    if not user.is_authenticated:
+        return _EMPTY
+    return get_seen(user.pk)
@@ -0,0 +1,128 @@
+# books/signals.py
+"""Обработчики сигналов каталога: держат вспомогательные индексы в актуальном состоянии"""
+from collections import Counter
+
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
+
+from . import caching, facets, favorites, recommender, search, seen, stats, trigram
+from .models import Book, UserProfile
+
+# bulk_create/bulk_update не шлют post_save, поэтому массовые операции
+# (импорт, действия админки) сообщают об изменениях этим сигналом.
+# Аргументы: created, updated - списки Book; previous - {pk: {поле: старое
+# значение}} для mood, complexity и author обновленных книг; using;
+# необязательный fields - какие поля изменились (None - любые).
+catalog_bulk_saved = Signal()
+# Поля, которые попадают в поисковые индексы (полнотекстовый и триграммный)
+TEXT_FIELDS = {'title', 'author', 'description'}
+
+
+@receiver(pre_save, sender=Book)
+def remember_stored_values(sender, instance, using, raw, **kwargs):
+    """Запомнить значения из базы до сохранения, чтобы сдвинуть счетчики"""
+    if not raw:
+        instance._stats_previous = stats.stored_values(instance, using)
+
+
+@receiver(post_save, sender=Book)
+def count_saved_book(sender, instance, using, raw, **kwargs):
+    """Обновить счетчики статистики (в транзакции Book.save)"""
+    if not raw:
+        previous = getattr(instance, '_stats_previous', None)
+        stats.apply_deltas(stats.change_deltas(previous, stats.values_of(instance)), using)
+
+
+@receiver(post_delete, sender=Book)
+def count_deleted_book(sender, instance, using, **kwargs):
+    stats.apply_deltas(stats.change_deltas(stats.values_of(instance), None), using)
+
+
+@receiver(post_save, sender=Book)
+def index_saved_book(sender, instance, using, **kwargs):
+    """Обновить книгу в поисковых индексах, матрице рекомендаций и фасетах"""
+    caching.bump_catalog_version(using)
+    search.get_backend(using).index_books([instance])
+
+    index = trigram.loaded_index()
+    if index is not None:
+        index.add_or_update(instance.pk, instance.title, instance.author)
+
+    matrix = recommender.loaded_recommender()
+    if matrix is not None:
+        matrix.upsert(instance.pk, instance.mood, instance.complexity, instance.genre, instance.pages)
+
+    bitmaps = facets.loaded_index()
+    if bitmaps is not None:
+        bitmaps.upsert(instance.pk, mood=instance.mood, complexity=instance.complexity)
+
+
+@receiver(post_delete, sender=Book)
+def unindex_deleted_book(sender, instance, using, **kwargs):
+    """Убрать удаленную книгу из индексов"""
+    caching.bump_catalog_version(using)
+    search.get_backend(using).remove_books([instance.pk])
+
+    index = trigram.loaded_index()
+    if index is not None:
+        index.remove(instance.pk)
+
+    matrix = recommender.loaded_recommender()
+    if matrix is not None:
+        matrix.remove(instance.pk)
+
+    bitmaps = facets.loaded_index()
+    if bitmaps is not None:
+        bitmaps.remove(instance.pk)
+
+
+@receiver(catalog_bulk_saved, sender=Book)
+def count_bulk_saved_books(sender, created, updated, previous, using, **kwargs):
+    """Счетчики после массовых операций: previous - старые значения обновленных книг"""
+    deltas = Counter()
+    for book in created:
+        deltas.update(stats.change_deltas(None, stats.values_of(book)))
+    for book in updated:
+        deltas.update(stats.change_deltas(previous.get(book.pk), stats.values_of(book)))
+    stats.apply_deltas(deltas, using)
+
+
+@receiver(catalog_bulk_saved, sender=Book)
+def index_bulk_saved_books(sender, created, updated, using, fields=None, **kwargs):
+    """Массовое обновление индексов после импорта"""
+    caching.bump_catalog_version(using)
+    books = list(created) + list(updated)
+    # Смена настроения или сложности не трогает текст - переиндексировать нечего
+    text_changed = created or fields is None or TEXT_FIELDS & set(fields)
+    if text_changed:
+        search.get_backend(using).index_books(books)
+
+    index = trigram.loaded_index() if text_changed else None
+    matrix = recommender.loaded_recommender()
+    bitmaps = facets.loaded_index()
+    for book in books:
+        if index is not None:
+            index.add_or_update(book.pk, book.title, book.author)
+        if matrix is not None:
+            matrix.upsert(book.pk, book.mood, book.complexity, book.genre, book.pages)
+        if bitmaps is not None:
+            bitmaps.upsert(book.pk, mood=book.mood, complexity=book.complexity)
+
+
+@receiver(m2m_changed, sender=UserProfile.favorite_books.through)
+def count_favorites(sender, instance, action, reverse, pk_set, using, **kwargs):
+    """Book.favorites_count - в той же транзакции, что и связь"""
+    favorites.count_changes(instance, action, reverse, pk_set, using)
+
+
+@receiver(m2m_changed, sender=UserProfile.favorite_books.through)
+def mark_favorites_seen(sender, instance, action, reverse, pk_set, **kwargs):
+    """Книги из избранного тоже считаются показанными"""
+    if action != 'post_add' or not pk_set:
+        return
+    if reverse:
+        # instance - книга, pk_set - профили: проще перечитать их множества
+        for user_id in UserProfile.objects.filter(pk__in=pk_set).values_list('user_id', flat=True):
+            seen.forget(user_id)
+    else:
+        seen.add_seen(instance.user_id, pk_set)
@@ -0,0 +1,412 @@
+# books/similarity.py
+"""Похожие книги по тексту: название, автор и описание.
+
+Каждая книга - хешированный мешок слов (основы слов названия и описания,
+автор целиком) с весами TF-IDF, нормированный до единичной длины; похожесть
+- косинус. Векторы и по ``NEIGHBORS`` ближайших соседей на книгу считает
+офлайн команда ``build_similarity_index`` и пишет в ``.npy``-файлы
+отдельной сборки. Воркеры открывают их через mmap: страницы файлов общие
+для всех процессов, а ответ на запрос - чтение одной строки таблицы
+соседей по номеру книги.
+
+Сборки лежат в ``SIMILARITY['DIR']/<время сборки>/``, файл ``CURRENT``
+указывает на действующую. Новая сборка пишется рядом и включается
+атомарной заменой ``CURRENT``; воркеры замечают ее сами.
+
+``--incremental`` перевычисляет только книги, измененные после прошлой
+сборки (``Book.updated_at``), новые и удаленные. Списки соседей остальных
+книг дополняются косинусами с измененными; целиком пересчитываются лишь
+те, у кого сосед изменился или удален. IDF при этом берется из прошлой
+полной сборки - его имеет смысл иногда пересчитывать полной сборкой.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+import zlib
+from datetime import datetime
+
+import numpy as np
+from django.conf import settings
+from django.db import router
+from django.utils import timezone
+
+from .models import Book
+from .stemmer import stem, tokenize
+
+CURRENT = 'CURRENT'
+# Соседи с меньшим косинусом не показываются: общего почти ничего
+MIN_SCORE = 0.05
+# Как часто воркер проверяет, не вышла ли новая сборка, с
+CHECK_INTERVAL = 5.0
+# Сколько сборок держать на диске (действующая и предыдущая)
+KEEP_BUILDS = 2
+# Потолок блока косинусов при поиске соседей, чисел float32 (128 МБ)
+BLOCK_CELLS = 2 ** 25
+# Слова названия значат больше слов описания
+TITLE_WEIGHT = 2
+
+
+def config():
+    return {
+        'DIR': os.path.join(settings.BASE_DIR, 'similarity'),
+        'DIM': 512,
+        'NEIGHBORS': 12,
+        **getattr(settings, 'SIMILARITY', {}),
+    }
+
+
+def book_terms(title, author, description):
+    """Термины книги: основы слов названия (с весом) и описания, слова автора"""
+    terms = [stem(word) for word in tokenize(title) if len(word) > 1] * TITLE_WEIGHT
+    terms += [stem(word) for word in tokenize(description) if len(word) > 1]
+    # Автор - отдельные термины, чтобы "Толстой" в описании не совпадал с автором
+    terms += ['@' + word for word in tokenize(author)]
+    return terms
+
+
+def term_frequencies(texts, dim):
+    """Матрица сублинейных частот 1 + log(tf) для строк (title, author, description)"""
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    for i, (title, author, description) in enumerate(texts):
+        terms = book_terms(title, author, description)
+        if not terms:
+            continue
+        buckets = np.fromiter((zlib.crc32(term.encode('utf-8')) % dim for term in terms),
+                              dtype=np.int64, count=len(terms))
+        counts = np.bincount(buckets, minlength=dim)
+        present = counts > 0
+        matrix[i, present] = 1 + np.log(counts[present])
+    return matrix
+
+
+def inverse_frequencies(document_counts, total):
+    # Без привычной "+1": слово, которое есть почти в каждой книге, ничего не весит
+    return np.log((1 + total) / (1 + document_counts)).astype(np.float32)
+
+
+def normalize_rows(matrix):
+    """Нормирует строки на месте; нулевые строки (книга без текста) остаются нулевыми"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    matrix /= norms
+
+
+def _contains(sorted_ids, values):
+    if not len(sorted_ids):
+        return np.zeros(np.shape(values), dtype=bool)
+    positions = np.searchsorted(sorted_ids, values)
+    positions[positions == len(sorted_ids)] = 0
+    return sorted_ids[positions] == values
+
+
+def _texts_in_range(ids, using):
+    """Тексты книг ids (отсортированных) одним запросом по диапазону id"""
+    rows = Book.objects.using(using).filter(id__gte=ids[0], id__lte=ids[-1]).values_list(
+        'id', 'title', 'author', 'description')
+    by_id = {pk: (title, author, description) for pk, title, author, description in rows}
+    # Книга, удаленная во время сборки, получает нулевой вектор
+    return [by_id.get(pk, ('', '', '')) for pk in ids.tolist()]
+
+
+def _texts_of(ids, using, chunk_size=500):
+    by_id = {}
+    for start in range(0, len(ids), chunk_size):
+        rows = Book.objects.using(using).filter(id__in=ids[start:start + chunk_size].tolist()).values_list(
+            'id', 'title', 'author', 'description')
+        by_id.update((pk, (title, author, description)) for pk, title, author, description in rows)
+    return [by_id.get(pk, ('', '', '')) for pk in ids.tolist()]
+
+
+def _top(candidate_ids, candidate_scores, k):
+    """По k лучших кандидатов в каждой строке: (id, косинусы) по убыванию, -1 - пусто"""
+    columns = candidate_scores.shape[1]
+    result_ids = np.full((len(candidate_scores), k), -1, dtype=np.int64)
+    result_scores = np.zeros((len(candidate_scores), k), dtype=np.float32)
+    if not columns:
+        return result_ids, result_scores
+    width = min(k, columns)
+    best = np.argpartition(-candidate_scores, width - 1, axis=1)[:, :width]
+    best_scores = np.take_along_axis(candidate_scores, best, axis=1)
+    order = np.argsort(-best_scores, axis=1, kind='stable')
+    best = np.take_along_axis(best, order, axis=1)
+    best_scores = np.take_along_axis(best_scores, order, axis=1)
+    valid = best_scores > 0
+    result_ids[:, :width] = np.where(valid, np.take_along_axis(candidate_ids, best, axis=1), -1)
+    result_scores[:, :width] = np.where(valid, best_scores, 0)
+    return result_ids, result_scores
+
+
+def _neighbors_of(rows, vectors, ids, k, neighbors, scores, progress=None):
+    """Соседи строк rows по всей матрице - блоками, чтобы косинусы влезли в память"""
+    step = max(1, BLOCK_CELLS // max(len(ids), 1))
+    for start in range(0, len(rows), step):
+        block = rows[start:start + step]
+        cosines = np.asarray(vectors[block]) @ np.asarray(vectors).T
+        cosines[np.arange(len(block)), block] = -np.inf
+        neighbors[block], scores[block] = _top(np.broadcast_to(ids, cosines.shape), cosines, k)
+        if progress:
+            progress('neighbors', min(start + step, len(rows)), len(rows))
+
+
+def _write_array(directory, name, shape, dtype):
+    return np.lib.format.open_memmap(os.path.join(directory, name), mode='w+', dtype=dtype, shape=shape)
+
+
+def _write_lookup(directory, ids):
+    """rows.npy: номер строки по id книги, если id идут достаточно плотно"""
+    if not len(ids) or ids[-1] > 4 * len(ids) + 1024:
+        return False
+    lookup = _write_array(directory, 'rows.npy', (int(ids[-1]) + 1,), np.int32)
+    lookup[:] = -1
+    lookup[ids] = np.arange(len(ids), dtype=np.int32)
+    lookup.flush()
+    return True
+
+
+def _build_full(target, using, dim, k, batch_size, progress):
+    ids = np.fromiter(Book.objects.using(using).order_by('id').values_list('id', flat=True)
+                      .iterator(chunk_size=10000), dtype=np.int64)
+    vectors = _write_array(target, 'vectors.npy', (len(ids), dim), np.float32)
+    document_counts = np.zeros(dim, dtype=np.int64)
+    for start in range(0, len(ids), batch_size):
+        chunk = ids[start:start + batch_size]
+        block = term_frequencies(_texts_in_range(chunk, using), dim)
+        vectors[start:start + len(chunk)] = block
+        document_counts += (block > 0).sum(axis=0)
+        if progress:
+            progress('vectors', start + len(chunk), len(ids))
+
+    idf = inverse_frequencies(document_counts, len(ids))
+    for start in range(0, len(ids), batch_size):
+        block = vectors[start:start + batch_size]
+        block *= idf
+        normalize_rows(block)
+
+    neighbors = _write_array(target, 'neighbors.npy', (len(ids), k), np.int64)
+    scores = _write_array(target, 'scores.npy', (len(ids), k), np.float32)
+    _neighbors_of(np.arange(len(ids)), vectors, ids, k, neighbors, scores, progress)
+    np.save(os.path.join(target, 'ids.npy'), ids)
+    np.save(os.path.join(target, 'idf.npy'), idf)
+    for array in (vectors, neighbors, scores):
+        array.flush()
+    return {'books': len(ids), 'embedded': len(ids), 'recomputed': len(ids)}
+
+
+def _build_incremental(target, previous, using, k, batch_size, progress):
+    ids = np.fromiter(Book.objects.using(using).order_by('id').values_list('id', flat=True)
+                      .iterator(chunk_size=10000), dtype=np.int64)
+    changed = np.unique(np.fromiter(
+        Book.objects.using(using).filter(updated_at__gte=previous.built_at).values_list('id', flat=True),
+        dtype=np.int64,
+    ))
+    embed = ~_contains(previous.ids, ids) | _contains(changed, ids)
+    deleted = previous.ids[~_contains(ids, previous.ids)]
+    if not embed.any() and not len(deleted):
+        return None
+
+    dim = previous.dim
+    vectors = _write_array(target, 'vectors.npy', (len(ids), dim), np.float32)
+    kept = np.flatnonzero(~embed)
+    old_rows = np.searchsorted(previous.ids, ids[kept])
+    for start in range(0, len(kept), batch_size):
+        vectors[kept[start:start + batch_size]] = previous.vectors[old_rows[start:start + batch_size]]
+    embedded = np.flatnonzero(embed)
+    for start in range(0, len(embedded), batch_size):
+        rows = embedded[start:start + batch_size]
+        block = term_frequencies(_texts_of(ids[rows], using), dim) * previous.idf
+        normalize_rows(block)
+        vectors[rows] = block
+        if progress:
+            progress('vectors', start + len(rows), len(embedded))
+
+    neighbors = _write_array(target, 'neighbors.npy', (len(ids), k), np.int64)
+    scores = _write_array(target, 'scores.npy', (len(ids), k), np.float32)
+    neighbors[kept] = previous.neighbors[old_rows]
+    scores[kept] = previous.scores[old_rows]
+
+    # У кого сосед изменился или исчез - список соседей неизвестен, считаем заново
+    touched = np.union1d(ids[embedded], deleted)
+    stale = _contains(touched, np.asarray(neighbors[kept])).any(axis=1)
+    recompute = np.union1d(embedded, kept[stale])
+    _neighbors_of(recompute, vectors, ids, k, neighbors, scores, progress)
+
+    # Остальным достаточно сравнить себя с измененными книгами
+    merge = kept[~stale]
+    changed_vectors = np.asarray(vectors[embedded])
+    step = max(1, BLOCK_CELLS // max(len(embedded), 1))
+    for start in range(0, len(merge) if len(embedded) else 0, step):
+        rows = merge[start:start + step]
+        cosines = np.asarray(vectors[rows]) @ changed_vectors.T
+        candidate_ids = np.hstack([neighbors[rows], np.broadcast_to(ids[embedded], cosines.shape)])
+        candidate_scores = np.hstack([np.where(neighbors[rows] >= 0, scores[rows], 0), cosines])
+        neighbors[rows], scores[rows] = _top(candidate_ids, candidate_scores, k)
+
+    np.save(os.path.join(target, 'ids.npy'), ids)
+    np.save(os.path.join(target, 'idf.npy'), previous.idf)
+    for array in (vectors, neighbors, scores):
+        array.flush()
+    return {'books': len(ids), 'embedded': len(embedded), 'recomputed': len(recompute)}
+
+
+def build(using=None, directory=None, dim=None, neighbors=None, incremental=False, batch_size=2000,
+          progress=None):
+    """Строит и включает новую сборку. Возвращает статистику или None, если
+    инкрементальной сборке нечего делать.
+
+    ``progress(этап, сделано, всего)`` вызывается по ходу сборки.
+    """
+    options = config()
+    directory = directory or options['DIR']
+    dim = dim or options['DIM']
+    k = neighbors or options['NEIGHBORS']
+    using = using or router.db_for_read(Book)
+    started = timezone.now()
+
+    previous = open_index(directory) if incremental else None
+    if previous is not None and (previous.dim != dim or previous.k != k):
+        # Другие параметры - старые векторы не годятся
+        previous = None
+
+    name = started.strftime('%Y%m%d-%H%M%S-%f')
+    target = os.path.join(directory, name)
+    os.makedirs(target)
+    try:
+        if previous is not None:
+            stats = _build_incremental(target, previous, using, k, batch_size, progress)
+            if stats is None:
+                shutil.rmtree(target, ignore_errors=True)
+                return None
+        else:
+            stats = _build_full(target, using, dim, k, batch_size, progress)
+        ids = np.load(os.path.join(target, 'ids.npy'))
+        meta = {
+            # Изменения, сделанные во время сборки, попадут в следующую
+            'built_at': started.isoformat(),
+            'dim': dim,
+            'neighbors': k,
+            'incremental': previous is not None,
+            'dense': _write_lookup(target, ids),
+            **stats,
+        }
+        with open(os.path.join(target, 'meta.json'), 'w', encoding='utf-8') as file:
+            json.dump(meta, file, ensure_ascii=False)
+        _publish(directory, name)
+    except BaseException:
+        shutil.rmtree(target, ignore_errors=True)
+        raise
+    _remove_old_builds(directory, name)
+    return meta
+
+
+def _publish(directory, name):
+    temporary = os.path.join(directory, f'.{CURRENT}.{os.getpid()}')
+    with open(temporary, 'w', encoding='utf-8') as file:
+        file.write(name)
+    os.replace(temporary, os.path.join(directory, CURRENT))
+
+
+def _remove_old_builds(directory, current):
+    # Воркер со старой сборкой в mmap продолжит ее читать и после удаления файлов
+    builds = sorted(entry for entry in os.listdir(directory)
+                    if not entry.startswith('.') and os.path.isdir(os.path.join(directory, entry)))
+    for name in builds[:-KEEP_BUILDS]:
+        if name != current:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+def current_build(directory=None):
+    """Имя действующей сборки или None"""
+    try:
+        with open(os.path.join(directory or config()['DIR'], CURRENT), encoding='utf-8') as file:
+            return file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+class SimilarityIndex:
+    """Сборка на диске, открытая через mmap"""
+
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as file:
+            self.meta = json.load(file)
+        self.path = path
+        self.built_at = datetime.fromisoformat(self.meta['built_at'])
+        self.ids = self._load('ids.npy')
+        self.vectors = self._load('vectors.npy')
+        self.neighbors = self._load('neighbors.npy')
+        self.scores = self._load('scores.npy')
+        self.idf = np.load(os.path.join(path, 'idf.npy'))
+        self.rows = self._load('rows.npy') if self.meta.get('dense') else None
+
+    def _load(self, name):
+        return np.load(os.path.join(self.path, name), mmap_mode='r')
+
+    @property
+    def dim(self):
+        return self.meta['dim']
+
+    @property
+    def k(self):
+        return self.meta['neighbors']
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row_of(self, book_id):
+        """Номер строки книги или -1"""
+        if self.rows is not None:
+            return int(self.rows[book_id]) if 0 <= book_id < len(self.rows) else -1
+        position = int(np.searchsorted(self.ids, book_id))
+        return position if position < len(self.ids) and self.ids[position] == book_id else -1
+
+    def similar(self, book_id, limit=6):
+        """Id похожих книг по убыванию похожести"""
+        row = self.row_of(book_id)
+        if row < 0:
+            return []
+        neighbors = self.neighbors[row, :limit]
+        return neighbors[(neighbors >= 0) & (self.scores[row, :limit] >= MIN_SCORE)].tolist()
+
+
+def open_index(directory=None):
+    """Действующая сборка каталога directory или None, если ее еще нет"""
+    directory = directory or config()['DIR']
+    name = current_build(directory)
+    if name is None:
+        return None
+    return SimilarityIndex(os.path.join(directory, name))
+
+
+_index = None
+_index_name = None
+_checked_at = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Сборка текущего воркера; новую он подхватывает не позже чем через CHECK_INTERVAL"""
+    global _index, _index_name, _checked_at
+    now = time.monotonic()
+    if _checked_at is not None and now - _checked_at < CHECK_INTERVAL:
+        return _index
+    with _index_lock:
+        name = current_build()
+        if name != _index_name:
+            _index = open_index() if name else None
+            _index_name = name
+        _checked_at = now
+    return _index
+
+
+def reset_index():
+    global _index, _index_name, _checked_at
+    with _index_lock:
+        _index = _index_name = _checked_at = None
+
+
+def similar_ids(book_id, limit=6):
+    """Id похожих книг или пустой список, если индекс еще не строили"""
+    index = get_index()
+    return index.similar(book_id, limit) if index is not None else []
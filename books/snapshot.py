@@ -0,0 +1,230 @@
+# books/snapshot.py
+"""Готовые подборки: ранжированные кандидаты на каждый запрос ``selection``.
+
+Параметров подбора немного - настроение, сложность, жанр, время и скорость
+чтения дают около двух тысяч сочетаний (корзин). Команда
+``build_selection_snapshot`` заранее ранжирует каталог рекомендателем для
+каждой корзины и пишет по ``CANDIDATES`` лучших id в один файл:
+
+    MAGIC | длина заголовка (uint64) | заголовок JSON | id (int64) | книги JSON
+
+Заголовок - версия, время сборки и {корзина: [смещение, длина]} в массиве
+id. Воркер открывает файл через mmap (страницы общие для всех процессов),
+и подбор - поиск корзины в словаре и срез массива, без расчета оценок.
+Книги в конце файла (название, автор, описание) читаются, только если
+база каталога недоступна: подборку тогда можно показать и без нее.
+
+Новый файл пишется рядом и подменяет старый через ``os.replace``; воркеры
+замечают это по stat не реже чем раз в ``CHECK_INTERVAL`` секунд. Снимок не
+следит за правками каталога - его пересобирают по расписанию, как индекс
+похожих книг; новые книги до пересборки подбираются только без снимка.
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from itertools import product
+
+import numpy as np
+from django.conf import settings
+from django.db import router
+from django.utils import timezone
+
+from . import caching, recommender
+from .forms import GENRE_PREFERENCE_CHOICES, TIME_AVAILABLE_CHOICES
+from .models import Book
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'BMSNAP\x00\x01'
+FORMAT = 1
+HEADER = struct.Struct('<8sQ')
+# Как часто воркер проверяет, не появился ли новый снимок, с
+CHECK_INTERVAL = 5.0
+# Описание в снимке - только для карточки подборки (она режет до 150 символов)
+DESCRIPTION_LENGTH = 200
+
+MOODS = [''] + [key for key, _ in Book.MOOD_CHOICES]
+COMPLEXITIES = [''] + [key for key, _ in Book.COMPLEXITY_CHOICES]
+GENRES = [''] + [key for key, _ in GENRE_PREFERENCE_CHOICES if key != 'any']
+TIMES = [''] + [key for key, _ in TIME_AVAILABLE_CHOICES]
+SPEEDS = list(recommender.PAGES_PER_HOUR)
+
+
+def config():
+    return {
+        'PATH': os.path.join(settings.BASE_DIR, 'selection.snap'),
+        'CANDIDATES': 48,
+        **getattr(settings, 'SELECTION_SNAPSHOT', {}),
+    }
+
+
+def bucket_key(mood='', complexity='', genre='', time_available='', reading_speed='medium'):
+    """Ключ корзины; скорость чтения важна только вместе со временем"""
+    return '|'.join((mood or '', complexity or '', genre or '', time_available or '',
+                     (reading_speed or 'medium') if time_available else ''))
+
+
+def buckets():
+    """Все запросы, которые может прислать форма подбора"""
+    for mood, complexity, genre, time_available in product(MOODS, COMPLEXITIES, GENRES, TIMES):
+        for reading_speed in (SPEEDS if time_available else ['medium']):
+            yield {'mood': mood, 'complexity': complexity, 'genre': genre,
+                   'time_available': time_available, 'reading_speed': reading_speed}
+
+
+def build(path=None, using=None, candidates=None, progress=None):
+    """Собирает снимок и атомарно подменяет им path. Возвращает заголовок"""
+    options = config()
+    path = path or options['PATH']
+    candidates = candidates or options['CANDIDATES']
+    using = using or router.db_for_read(Book)
+    version = caching.catalog_version()
+    matrix = recommender.Recommender.from_database(using=using)
+
+    offsets, chunks, position = {}, [], 0
+    queries = list(buckets())
+    for number, query in enumerate(queries, 1):
+        ids = np.asarray(matrix.recommend(k=candidates, **query), dtype=np.int64)
+        offsets[bucket_key(**query)] = [position, len(ids)]
+        chunks.append(ids)
+        position += len(ids)
+        if progress and number % 500 == 0:
+            progress('buckets', number, len(queries))
+    ids = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int64)
+
+    books = {}
+    rows = Book.objects.using(using).filter(pk__in=np.unique(ids).tolist()).values_list(
+        'id', 'title', 'author', 'mood', 'complexity', 'genre', 'pages', 'description')
+    for pk, title, author, mood, complexity, genre, pages, description in rows.iterator(chunk_size=2000):
+        books[pk] = [title, author, mood, complexity, genre, pages, description[:DESCRIPTION_LENGTH]]
+    books_blob = json.dumps(books, ensure_ascii=False, separators=(',', ':')).encode()
+
+    header = {
+        'format': FORMAT,
+        'version': time.time_ns(),
+        'catalog_version': version,
+        'built_at': timezone.now().isoformat(),
+        'candidates': candidates,
+        'buckets': offsets,
+        'ids': len(ids),
+        'books': len(books_blob),
+    }
+    header_blob = json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode()
+    # Массив id выровнен по 8 байтам - numpy читает его из mmap без копии
+    header_blob += b' ' * (-(HEADER.size + len(header_blob)) % 8)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    temporary = os.path.join(directory, f'.{os.path.basename(path)}.{os.getpid()}')
+    with open(temporary, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, len(header_blob)))
+        file.write(header_blob)
+        file.write(ids.astype('<i8').tobytes())
+        file.write(books_blob)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+    return header
+
+
+class SelectionSnapshot:
+    """Файл снимка, открытый через mmap"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path}: не файл снимка подборок')
+        self.header = json.loads(self._mmap[HEADER.size:HEADER.size + header_length])
+        if self.header['format'] != FORMAT:
+            raise ValueError(f'{path}: формат {self.header["format"]}, ожидается {FORMAT}')
+        self.path = path
+        self.version = self.header['version']
+        self._buckets = self.header['buckets']
+        start = HEADER.size + header_length
+        self.ids = np.frombuffer(self._mmap, dtype='<i8', count=self.header['ids'], offset=start)
+        self._books_at = start + self.ids.nbytes
+        self._books = None
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def candidates(self, **query):
+        """Ранжированные id корзины запроса или None, если такой корзины нет"""
+        found = self._buckets.get(bucket_key(**query))
+        if found is None:
+            return None
+        offset, length = found
+        return self.ids[offset:offset + length]
+
+    def pick(self, k=6, seen_ids=None, **query):
+        """k лучших id; показанные (seen_ids) - в конце, если непоказанных мало"""
+        ranked = self.candidates(**query)
+        if ranked is None:
+            return None
+        if seen_ids is not None and len(seen_ids):
+            seen = np.isin(ranked, seen_ids)
+            ranked = np.concatenate([ranked[~seen], ranked[seen]])
+        return ranked[:k].tolist()
+
+    def books(self, ids):
+        """Несохраненные Book из снимка - когда базы каталога нет"""
+        if self._books is None:
+            self._books = json.loads(self._mmap[self._books_at:self._books_at + self.header['books']])
+        fields = ('title', 'author', 'mood', 'complexity', 'genre', 'pages', 'description')
+        return [Book(id=pk, **dict(zip(fields, self._books[str(pk)]))) for pk in ids if str(pk) in self._books]
+
+
+def open_snapshot(path=None):
+    """Снимок из файла или None, если его еще не собирали"""
+    path = path or config()['PATH']
+    try:
+        return SelectionSnapshot(path)
+    except FileNotFoundError:
+        return None
+
+
+def _file_id(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+_snapshot = None
+_snapshot_file = None
+_checked_at = None
+_snapshot_lock = threading.Lock()
+
+
+def get_snapshot():
+    """Снимок текущего воркера; новый он подхватывает не позже чем через CHECK_INTERVAL"""
+    global _snapshot, _snapshot_file, _checked_at
+    now = time.monotonic()
+    if _checked_at is not None and now - _checked_at < CHECK_INTERVAL:
+        return _snapshot
+    with _snapshot_lock:
+        path = config()['PATH']
+        file_id = _file_id(path)
+        if file_id != _snapshot_file:
+            try:
+                _snapshot = open_snapshot(path) if file_id else None
+            except (OSError, ValueError) as exc:
+                # Битый файл - работаем без снимка, пока его не пересоберут
+                logger.warning('Не удалось открыть снимок подборок %s: %s', path, exc)
+                _snapshot = None
+            _snapshot_file = file_id
+        _checked_at = now
+    return _snapshot
+
+
+def reset_snapshot():
+    global _snapshot, _snapshot_file, _checked_at
+    with _snapshot_lock:
+        _snapshot = _snapshot_file = _checked_at = None
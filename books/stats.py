@@ -0,0 +1,121 @@
+# books/stats.py
+"""Счетчики каталога для страницы статистики.
+
+Вместо ``GROUP BY`` по всей таблице книг на каждый запрос статистика
+читается из ``CatalogCounter``: одна строка на настроение, сложность,
+автора и общий итог. Сигналы книги превращают каждое изменение в набор
+приращений ``(вид, значение) → ±n`` и применяют их ``UPDATE ... SET
+count = count + n`` в той же транзакции, что и само изменение.
+
+Все, что обходит сигналы (``QuerySet.update``, правка базы руками),
+сверяется командой ``manage.py rebuild_book_stats``.
+"""
+from collections import Counter
+
+from django.db import IntegrityError, router, transaction
+from django.db.models import Count, F
+
+from .models import Book, CatalogCounter
+
+TRACKED = ('mood', 'complexity', 'author')
+
+
+def book_keys(values):
+    """Счетчики, в которые входит книга с такими значениями полей"""
+    return [('total', '')] + [(field, values[field]) for field in TRACKED]
+
+
+def values_of(book):
+    return {field: getattr(book, field) for field in TRACKED}
+
+
+def change_deltas(previous, current):
+    """Приращения при переходе книги от ``previous`` к ``current`` (любой может быть None)"""
+    deltas = Counter()
+    if previous is not None:
+        deltas.subtract(book_keys(previous))
+    if current is not None:
+        deltas.update(book_keys(current))
+    return deltas
+
+
+def apply_deltas(deltas, using=None):
+    """Применяет приращения атомарным UPDATE; отсутствующие счетчики создает"""
+    using = using or router.db_for_write(CatalogCounter)
+    counters = CatalogCounter.objects.using(using)
+    with transaction.atomic(using=using):
+        for (kind, key), delta in sorted(deltas.items()):
+            if not delta:
+                continue
+            if counters.filter(kind=kind, key=key).update(count=F('count') + delta):
+                continue
+            try:
+                with transaction.atomic(using=using):
+                    counters.create(kind=kind, key=key, count=delta)
+            except IntegrityError:
+                # Строку успел создать параллельный запрос
+                counters.filter(kind=kind, key=key).update(count=F('count') + delta)
+
+
+def stored_values(book, using=None):
+    """Значения полей книги в базе до сохранения (None для новой книги)"""
+    if book._state.adding or book.pk is None:
+        return None
+    return Book.objects.using(using).filter(pk=book.pk).values(*TRACKED).first()
+
+
+def rebuild(using=None):
+    """Пересчитывает все счетчики по таблице книг. Возвращает число исправленных строк"""
+    using = using or router.db_for_write(CatalogCounter)
+    books = Book.objects.using(using)
+    actual = {('total', ''): books.count()}
+    for field in TRACKED:
+        for row in books.order_by().values(field).annotate(n=Count('id')):
+            actual[(field, row[field])] = row['n']
+
+    with transaction.atomic(using=using):
+        stored = {(c.kind, c.key): c for c in CatalogCounter.objects.using(using).select_for_update()}
+        to_create, to_update = [], []
+        for key, count in actual.items():
+            counter = stored.pop(key, None)
+            if counter is None:
+                to_create.append(CatalogCounter(kind=key[0], key=key[1], count=count))
+            elif counter.count != count:
+                counter.count = count
+                to_update.append(counter)
+        # Оставшиеся счетчики не соответствуют ни одной книге
+        to_delete = [counter.pk for counter in stored.values()]
+
+        CatalogCounter.objects.using(using).bulk_create(to_create, batch_size=1000)
+        CatalogCounter.objects.using(using).bulk_update(to_update, ['count'], batch_size=1000)
+        CatalogCounter.objects.using(using).filter(pk__in=to_delete).delete()
+    return len(to_create) + len(to_update) + len(to_delete)
+
+
+def read_statistics(top_authors=5, using=None):
+    """Все, что нужно странице статистики: два запроса по индексам"""
+    counters = CatalogCounter.objects.using(using)
+    moods, complexities, total = [], [], 0
+    for kind, key, count in counters.filter(
+        kind__in=('total', 'mood', 'complexity'), count__gt=0,
+    ).values_list('kind', 'key', 'count'):
+        if kind == 'total':
+            total = count
+        elif kind == 'mood':
+            moods.append({'mood': key, 'count': count})
+        else:
+            complexities.append({'complexity': key, 'count': count})
+
+    moods.sort(key=lambda row: -row['count'])
+    complexities.sort(key=lambda row: -row['count'])
+    authors = [
+        {'author': key, 'book_count': count}
+        for key, count in counters.filter(kind='author', count__gt=0)
+        .order_by('-count').values_list('key', 'count')[:top_authors]
+    ]
+    return {
+        'mood_stats': moods,
+        'complexity_stats': complexities,
+        'top_authors': authors,
+        'total_books': total,
+    }
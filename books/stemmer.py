@@ -0,0 +1,90 @@
+# books/stemmer.py
+"""Стеммер для русского языка (алгоритм Snowball / Портер).
+
+Нужен SQLite-бэкенду поиска: у FTS5 нет русской морфологии, поэтому
+в индекс пишутся уже обрезанные основы слов, а запрос стеммится так же.
+PostgreSQL использует собственный словарь ``russian``.
+"""
+import re
+
+VOWELS = 'аеиоуыэюя'
+
+PERFECTIVE_GERUND = re.compile(r'((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$')
+REFLEXIVE = re.compile(r'(с[яь])$')
+ADJECTIVE = re.compile(
+    r'(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$'
+)
+PARTICIPLE = re.compile(r'((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$')
+VERB = re.compile(
+    r'((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|'
+    r'ить|ыть|ишь|ую|ю)|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$'
+)
+NOUN = re.compile(
+    r'(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|'
+    r'ию|ью|ю|ия|ья|я)$'
+)
+DERIVATIONAL = re.compile(r'.*[^аеиоуыэюя]+[аеиоуыэюя].*ость?$')
+DERIVATIONAL_SUFFIX = re.compile(r'ость?$')
+SUPERLATIVE = re.compile(r'(ейше|ейш)$')
+RV = re.compile(r'^(.*?[аеиоуыэюя])(.*)$')
+
+CYRILLIC_WORD = re.compile(r'^[а-я]+$')
+TOKEN = re.compile(r'\w+')
+
+
+def normalize(text):
+    """Нижний регистр и ё → е"""
+    return text.lower().replace('ё', 'е')
+
+
+def stem(word):
+    """Основа одного слова. Не кириллические слова возвращаются как есть"""
+    word = normalize(word)
+    if not CYRILLIC_WORD.match(word):
+        return word
+
+    match = RV.match(word)
+    if not match:
+        return word
+    prefix, rv = match.groups()
+
+    # Шаг 1: деепричастия, иначе возвратность + прилагательные/глаголы/существительные
+    result = PERFECTIVE_GERUND.sub('', rv, 1)
+    if result == rv:
+        rv = REFLEXIVE.sub('', rv, 1)
+        result = ADJECTIVE.sub('', rv, 1)
+        if result != rv:
+            rv = PARTICIPLE.sub('', result, 1)
+        else:
+            result = VERB.sub('', rv, 1)
+            rv = NOUN.sub('', rv, 1) if result == rv else result
+    else:
+        rv = result
+
+    # Шаг 2: конечное "и"
+    if rv.endswith('и'):
+        rv = rv[:-1]
+
+    # Шаг 3: словообразовательные суффиксы
+    if DERIVATIONAL.match(rv):
+        rv = DERIVATIONAL_SUFFIX.sub('', rv, 1)
+
+    # Шаг 4: мягкий знак, превосходная степень, удвоенное "н"
+    if rv.endswith('ь'):
+        rv = rv[:-1]
+    else:
+        rv = SUPERLATIVE.sub('', rv, 1)
+        if rv.endswith('нн'):
+            rv = rv[:-1]
+
+    return prefix + rv
+
+
+def tokenize(text):
+    """Слова текста в нормализованном виде"""
+    return TOKEN.findall(normalize(text or ''))
+
+
+def stem_text(text):
+    """Текст, в котором каждое слово заменено основой"""
+    return ' '.join(stem(token) for token in tokenize(text))
@@ -0,0 +1,21 @@
+# books/templatetags/books_extras.py
+from django import template
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def query_update(context, **params):
+    """Текущая query string с измененными параметрами.
+
+    Значение None или пустая строка убирает параметр:
+    ``{% query_update sort='author' cursor=None %}``
+    """
+    query = context['request'].GET.copy()
+    for key, value in params.items():
+        if value is None or value == '':
+            query.pop(key, None)
+        else:
+            query[key] = value
+    encoded = query.urlencode()
+    return f'?{encoded}' if encoded else '?'
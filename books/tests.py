@@ -1,3 +1,1455 @@
-from django.test import TestCase
+import csv
+import gzip
+import importlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, OperationalError, connection, connections
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from . import admin as books_admin
+from . import (analytics, benchmarks, caching, export, facets, favorites, history, importer, metrics, recommender,
+               routers, sampling, search, seen, similarity, snapshot, stats, trigram)
+from .models import Book, BookSelection, CatalogCounter, SearchQueryStat, UserProfile, get_profile
+from .pagination import InvalidCursor, decode_cursor, encode_cursor, paginate
+from .stemmer import stem
+
+
+def make_books(count, **fields):
+    """Создает count книг одним запросом"""
+    defaults = {'author': 'Автор', 'mood': 'happy', 'complexity': 'easy'}
+    defaults.update(fields)
+    return Book.objects.bulk_create(
+        Book(title=f'Книга {i:04d}', **defaults) for i in range(count)
+    )
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        make_books(25)
+
+    def test_walks_forward_and_back(self):
+        seen = []
+        page = paginate(Book.objects.all(), sort='title', per_page=10)
+        pages = [page]
+        while page.has_next:
+            seen.extend(book.title for book in page)
+            page = paginate(Book.objects.all(), sort='title', cursor=page.next_cursor, per_page=10)
+            pages.append(page)
+        seen.extend(book.title for book in page)
+
+        self.assertEqual(seen, sorted(Book.objects.values_list('title', flat=True)))
+        self.assertEqual(len(pages), 3)
+
+        previous = paginate(Book.objects.all(), sort='title', cursor=pages[2].prev_cursor, per_page=10)
+        self.assertEqual([b.pk for b in previous], [b.pk for b in pages[1]])
+        self.assertTrue(previous.has_previous)
+
+    def test_descending_sort(self):
+        page = paginate(Book.objects.all(), sort='-id', per_page=10)
+        following = paginate(Book.objects.all(), sort='-id', cursor=page.next_cursor, per_page=10)
+        ids = [b.pk for b in page] + [b.pk for b in following]
+        self.assertEqual(ids, sorted(ids, reverse=True))
+        self.assertFalse(page.has_previous)
+
+    def test_cursor_is_bound_to_sort(self):
+        page = paginate(Book.objects.all(), sort='title', per_page=10)
+        with self.assertRaises(InvalidCursor):
+            decode_cursor(page.next_cursor, 'author')
+        with self.assertRaises(InvalidCursor):
+            decode_cursor('not-a-cursor', 'title')
+
+    def test_cursor_value_must_match_field_type(self):
+        for sort_value, pk, field in ((5, 1, 'title'), (['x'], 1, 'author'), ('1', 1, 'id'), ('a', True, 'title')):
+            with self.subTest(field=field, sort_value=sort_value, pk=pk):
+                with self.assertRaises(InvalidCursor):
+                    decode_cursor(encode_cursor(sort_value, pk, field), field)
+        self.assertEqual(decode_cursor(encode_cursor('Анна', 7, 'title'), 'title'), ('Анна', 7, False))
+        for sort_value, pk, field in (('a', 10 ** 30, 'title'), (-2 ** 63 - 1, 1, 'id')):
+            with self.subTest(field=field, sort_value=sort_value, pk=pk):
+                with self.assertRaises(InvalidCursor):
+                    decode_cursor(encode_cursor(sort_value, pk, field), field)
+
+
+class BookListViewTests(TestCase):
+    def test_filters_and_paginates(self):
+        make_books(30, mood='sad')
+        make_books(5, mood='happy', complexity='hard')
+
+        response = self.client.get('/books/', {'mood': 'sad'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['books']), 24)
+        self.assertTrue(all(book.mood == 'sad' for book in response.context['books']))
+
+        page = response.context['page']
+        response = self.client.get('/books/', {'mood': 'sad', 'cursor': page.next_cursor})
+        self.assertEqual(len(response.context['books']), 6)
+
+    def test_broken_cursor_falls_back_to_first_page(self):
+        make_books(3)
+        response = self.client.get('/books/', {'cursor': '!!!'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['books']), 3)
+
+    def test_out_of_range_cursor_resets_instead_of_failing(self):
+        make_books(3)
+        cursor = encode_cursor('Книга', 10 ** 30, 'title')
+        response = self.client.get('/books/', {'cursor': cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['books']), 3)
+        self.assertEqual(self.client.get('/api/v1/books/', {'cursor': cursor}).status_code, 400)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        # Дописать аналитику поиска в базу теста, пока она еще есть
+        self.addCleanup(analytics.reset_recorder)
+
+    def test_russian_stemming(self):
+        self.assertEqual(stem('Достоевского'), stem('достоевский'))
+        self.assertEqual(stem('приключения'), stem('приключение'))
+
+    def test_index_follows_saves_and_deletes(self):
+        book = Book.objects.create(title='Преступление и наказание', author='Федор Достоевский',
+                                   mood='thoughtful', complexity='hard')
+        self.assertEqual(search.search_books('достоевского').total, 1)
+
+        book.title = 'Бесы'
+        book.save()
+        self.assertEqual(search.search_books('наказание').total, 0)
+        self.assertEqual([b.pk for b in search.search_books('бесов')], [book.pk])
+
+        book.delete()
+        self.assertEqual(search.search_books('бесы').total, 0)
+
+    def test_title_ranks_above_description(self):
+        in_description = Book.objects.create(title='Сборник', author='Разные', mood='calm',
+                                             complexity='easy', description='Рассказы про море')
+        in_title = Book.objects.create(title='Море', author='Автор', mood='calm', complexity='easy')
+        page = search.search_books('море')
+        self.assertEqual([b.pk for b in page], [in_title.pk, in_description.pk])
+
+    def test_paginates_with_total(self):
+        for i in range(25):
+            Book.objects.create(title=f'Сказка {i}', author='Андерсен', mood='happy', complexity='easy')
+        page = search.search_books('сказки', page=2)
+        self.assertEqual(page.total, 25)
+        self.assertEqual(len(page), 5)
+        self.assertFalse(page.has_next)
+
+        response = self.client.get('/search/', {'q': 'андерсен'})
+        self.assertEqual(response.context['total'], 25)
+        self.assertEqual(len(response.context['results']), 20)
+
+    def test_slow_query_is_cut_off(self):
+        search.get_backend().index_books(make_books(500))
+        self.assertEqual(search.search_books('книга', timeout=0).total, 500)
+        page = search.search_books('книга', timeout=0.001)
+        self.assertTrue(page.timed_out)
+        self.assertEqual(len(page), 0)
+
+        with self.settings(SEARCH_TIMEOUT_MS=0.001):
+            response = self.client.get('/search/', {'q': 'книга'})
+        self.assertContains(response, 'Слишком общий запрос')
+
+
+class TrigramIndexTests(TestCase):
+    def setUp(self):
+        trigram.reset_index()
+        self.addCleanup(trigram.reset_index)
+
+    def test_tolerates_typos(self):
+        index = trigram.TrigramIndex.build([
+            (1, 'Преступление и наказание', 'Федор Достоевский'),
+            (2, 'Война и мир', 'Лев Толстой'),
+        ])
+        self.assertEqual(index.suggest('достаевский')[0][0], 1)
+        self.assertEqual(index.suggest('толстй')[0][0], 2)
+        self.assertEqual(index.suggest('войн')[0][0], 2)
+        self.assertGreater(index.memory_usage(), 0)
+
+    def test_incremental_updates(self):
+        index = trigram.TrigramIndex.build([(1, 'Идиот', 'Достоевский')])
+        index.add_or_update(1, 'Бесы', 'Достоевский')
+        index.add_or_update(5, 'Мастер и Маргарита', 'Булгаков')
+        self.assertEqual(index.suggest('бесы')[0][:2], (1, 'Бесы'))
+        self.assertEqual(index.suggest('маргарита')[0][0], 5)
+
+        index.remove(5)
+        self.assertEqual(index.suggest('маргарита'), [])
+        self.assertEqual(len(index), 1)
+
+    def test_suggest_endpoint_follows_signals(self):
+        Book.objects.create(title='Мастер и Маргарита', author='Михаил Булгаков', mood='mysterious',
+                            complexity='medium')
+        trigram.get_index()
+        book = Book.objects.create(title='Собачье сердце', author='Михаил Булгаков', mood='happy',
+                                   complexity='easy')
+
+        response = self.client.get('/search/suggest/', {'q': 'булгакв'})
+        titles = [item['title'] for item in response.json()['suggestions']]
+        self.assertEqual(sorted(titles), ['Мастер и Маргарита', 'Собачье сердце'])
+
+        book.delete()
+        response = self.client.get('/search/suggest/', {'q': 'собачье'})
+        self.assertEqual(response.json()['suggestions'], [])
+
+
+class RecommenderTests(TestCase):
+    def setUp(self):
+        recommender.reset_recommender()
+        self.addCleanup(recommender.reset_recommender)
+
+    def test_scores_all_preferences(self):
+        short_fantasy = Book.objects.create(title='Сказка', author='А', mood='happy', complexity='easy',
+                                            genre='fantasy', pages=120)
+        long_fantasy = Book.objects.create(title='Эпопея', author='Б', mood='happy', complexity='easy',
+                                           genre='fantasy', pages=1100)
+        Book.objects.create(title='Детектив', author='В', mood='happy', complexity='easy', genre='detective')
+        matrix = recommender.get_recommender()
+
+        ids = matrix.recommend(k=2, mood='happy', complexity='easy', genre='fantasy', time_available='short')
+        self.assertEqual(ids, [short_fantasy.pk, long_fantasy.pk])
+        ids = matrix.recommend(k=1, mood='happy', genre='fantasy', time_available='long', reading_speed='fast')
+        self.assertEqual(ids, [long_fantasy.pk])
+
+    def test_near_miss_and_exclusion(self):
+        thoughtful = Book.objects.create(title='Эссе', author='А', mood='thoughtful', complexity='hard')
+        happy = Book.objects.create(title='Комедия', author='Б', mood='happy', complexity='hard')
+        matrix = recommender.get_recommender()
+
+        # Грустных книг нет - ближайшее настроение "задумчивое"
+        self.assertEqual(matrix.recommend(k=1, mood='sad'), [thoughtful.pk])
+        self.assertEqual(matrix.recommend(k=2, mood='sad', exclude_ids=[thoughtful.pk]), [happy.pk])
+
+    def test_follows_signals(self):
+        matrix = recommender.get_recommender()
+        book = Book.objects.create(pk=100, title='Новая', author='А', mood='calm', complexity='easy')
+        self.assertEqual(matrix.recommend(k=1, mood='calm'), [book.pk])
+
+        book.mood = 'sad'
+        book.save()
+        self.assertEqual(matrix.recommend(k=1, mood='sad'), [book.pk])
+
+        # Явный pk меньше уже загруженных не ломает порядок id
+        early = Book.objects.create(pk=50, title='Ранняя', author='Б', mood='mysterious', complexity='easy')
+        self.assertEqual(matrix.recommend(k=1, mood='mysterious'), [early.pk])
+        self.assertEqual(matrix.recommend(k=1, mood='sad'), [book.pk])
+
+        book.delete()
+        self.assertEqual(len(matrix), 1)
+
+    def test_sparse_ids_fall_back_to_binary_search(self):
+        matrix = recommender.Recommender(np.array([1, 10 ** 9], dtype=np.int64),
+                                         np.zeros((2, 4), dtype=np.int8))
+        self.assertIsNone(matrix._lookup)
+        self.assertEqual(matrix.rows_of([10 ** 9, 5, 1]).tolist(), [1, 0])
+        matrix.upsert(7, 'sad', 'easy', '', None)
+        self.assertEqual(matrix.recommend(k=1, mood='sad'), [7])
+
+    def test_selection_view(self):
+        make_books(10, mood='calm')
+        response = self.client.get('/selection/', {'mood': 'calm', 'time_available': 'short',
+                                                   'genre_preference': 'any'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['recommended_books']), 6)
+        self.assertEqual(response.context['genre_preference'], '')
+
+
+class ImportBooksTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def run_import(self, *args):
+        out = StringIO()
+        call_command('import_books', *args, stdout=out, stderr=StringIO())
+        return json.loads(out.getvalue().strip().splitlines()[-1])
+
+    def test_csv_upsert_is_idempotent(self):
+        feed = self.write('feed.csv', (
+            'title,author,mood,complexity,genre,pages,description\n'
+            'Идиот,Достоевский,thoughtful,hard,classic,640,Роман\n'
+            'Бесы,Достоевский,Грустное,hard,,,\n'
+            'Плохая,Автор,angry,easy,,,\n'
+        ))
+        rejects = os.path.join(self.tmp.name, 'rejects.csv')
+
+        stats = self.run_import(feed, '--rejects', rejects)
+        self.assertEqual((stats['created'], stats['updated'], stats['rejected']), (2, 0, 1))
+        self.assertEqual(Book.objects.get(title='Бесы').mood, 'sad')
+        with open(rejects, encoding='utf-8') as f:
+            self.assertIn('angry', f.read())
+
+        stats = self.run_import(feed)
+        self.assertEqual((stats['created'], stats['updated'], stats['unchanged']), (0, 0, 2))
+        self.assertEqual(Book.objects.count(), 2)
+
+        changed = self.write('changed.csv', (
+            'title,author,mood,complexity\n'
+            'Идиот,Достоевский,sad,hard\n'
+        ))
+        stats = self.run_import(changed)
+        self.assertEqual(stats['updated'], 1)
+        self.assertEqual(Book.objects.get(title='Идиот').mood, 'sad')
+        self.assertEqual(search.search_books('идиот').total, 1)
+
+    def test_jsonl_with_workers(self):
+        lines = [json.dumps({'title': f'Книга {i}', 'author': 'Автор', 'mood': 'calm', 'complexity': 'easy'},
+                            ensure_ascii=False) for i in range(50)]
+        lines.append('{broken')
+        feed = self.write('feed.jsonl', '\n'.join(lines) + '\n')
+
+        stats = self.run_import(feed, '--workers', '2', '--batch-size', '7')
+        self.assertEqual((stats['created'], stats['rejected']), (50, 1))
+        self.assertEqual(Book.objects.count(), 50)
+
+    def test_jsonl_workers_read_feed_lazily(self):
+        read = []
+
+        def feed():
+            for i in range(1000):
+                read.append(i)
+                yield json.dumps({'title': f'Книга {i}', 'author': 'А', 'mood': 'calm', 'complexity': 'easy'}) + '\n'
+
+        rows = importer.iter_jsonl(feed(), batch_size=10, workers=2)
+        self.assertEqual(next(rows)[0], 1)
+        # В работе не больше 2 * workers пачек, а не весь фид
+        self.assertLessEqual(len(read), 4 * 10)
+        self.assertEqual(sum(1 for _ in rows), 999)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.books = make_books(5)
+        self.staff = User.objects.create_user('admin', password='pass', is_staff=True)
+        for mood in ('happy', 'sad', 'calm'):
+            selection = BookSelection.objects.create(user=self.staff, selected_mood=mood, selected_complexity='easy')
+            selection.recommended_books.set(self.books[:2])
+
+    def test_requires_staff(self):
+        response = self.client.get('/export/books/')
+        self.assertEqual(response.status_code, 302)
+
+    def test_streams_csv_in_chunks(self):
+        self.client.force_login(self.staff)
+        response = self.client.get('/export/selections/')
+        self.assertTrue(response.streaming)
+        rows = list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode('utf-8'))))
+        self.assertEqual([row['selected_mood'] for row in rows], ['happy', 'sad', 'calm'])
+        expected = ' '.join(str(book.pk) for book in self.books[:2])
+        self.assertTrue(all(row['recommended_books'] == expected for row in rows))
+
+        # Пачки по 2 записи и продолжение после id дают те же строки
+        chunks = list(export.book_rows(chunk_size=2, after=self.books[0].pk))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2])
+
+    def test_jsonl_gzip(self):
+        self.client.force_login(self.staff)
+        response = self.client.get('/export/books/', {'format': 'jsonl', 'gzip': '1'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [book.pk for book in self.books])
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'selections.jsonl')
+            call_command('export_data', 'selections', '--format', 'jsonl', '-o', path, stderr=StringIO())
+            with open(path, encoding='utf-8') as f:
+                rows = [json.loads(line) for line in f]
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0]['username'], 'admin')
+
+
+class HistoryWriterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='pass')
+        self.books = make_books(3)
+
+    def test_buffers_until_flush(self):
+        writer = history.HistoryWriter(batch_size=2, background=False)
+        for mood in ('happy', 'sad', 'calm'):
+            writer.record(self.user.pk, mood, 'easy', [book.pk for book in self.books])
+        self.assertEqual(BookSelection.objects.count(), 0)
+
+        self.assertEqual(writer.flush(), 3)
+        self.assertEqual(writer.stats()['batches'], 2)
+        selection = BookSelection.objects.get(selected_mood='sad')
+        self.assertEqual(sorted(selection.recommended_books.values_list('id', flat=True)),
+                         [book.pk for book in self.books])
+
+    def test_drops_when_full(self):
+        writer = history.HistoryWriter(max_pending=2, background=False)
+        for _ in range(3):
+            writer.record(self.user.pk, 'happy', 'easy', [self.books[0].pk])
+        stats = writer.stats()
+        self.assertEqual((stats['queued'], stats['dropped'], stats['pending']), (2, 1, 2))
+
+    def test_rejected_rows_are_dropped_and_transient_errors_requeued(self):
+        writer = history.HistoryWriter(background=False)
+        for mood in ('happy', 'sad', 'calm'):
+            writer.record(self.user.pk, mood, 'easy', [self.books[0].pk])
+        write_entries = history.write_entries
+
+        def reject_sad(entries, using=None):
+            if any(mood == 'sad' for _, mood, _, _, _ in entries):
+                raise IntegrityError('FOREIGN KEY constraint failed')
+            write_entries(entries, using)
+
+        with mock.patch.object(history, 'write_entries', side_effect=reject_sad):
+            self.assertEqual(writer.flush(), 2)
+        stats = writer.stats()
+        self.assertEqual((stats['flushed'], stats['rejected'], stats['pending']), (2, 1, 0))
+        self.assertEqual(sorted(BookSelection.objects.values_list('selected_mood', flat=True)), ['calm', 'happy'])
+
+        writer.record(self.user.pk, 'happy', 'easy', [self.books[0].pk])
+        with mock.patch.object(history, 'write_entries', side_effect=OperationalError('database is locked')):
+            self.assertEqual(writer.flush(), 0)
+        self.assertEqual((writer.stats()['pending'], writer.stats()['failures']), (1, 1))
+        self.assertEqual(writer.flush(), 1)
+
+    @override_settings(HISTORY_WRITER={'MODE': 'sync'})
+    def test_selection_view_records_history(self):
+        self.client.force_login(self.user)
+        self.client.get('/selection/', {'mood': 'happy', 'complexity': 'easy'})
+        selection = BookSelection.objects.get(user=self.user)
+        self.assertEqual(selection.recommended_books.count(), 3)
+
+
+class HistoryWriterThreadTests(TransactionTestCase):
+    def test_background_flush_and_close(self):
+        user = User.objects.create_user('reader', password='pass')
+        book = Book.objects.create(title='Идиот', author='Достоевский', mood='sad', complexity='hard')
+        writer = history.HistoryWriter(batch_size=2, flush_interval=0.05)
+        writer.record(user.pk, 'sad', 'hard', [book.pk])
+        writer.record(user.pk, 'sad', 'hard', [book.pk])
+        writer.record(user.pk, 'calm', 'hard', [book.pk])
+        writer.close()
+
+        self.assertEqual(writer.stats()['flushed'], 3)
+        self.assertEqual(BookSelection.objects.count(), 3)
+        writer.record(user.pk, 'sad', 'hard', [book.pk])
+        self.assertEqual(writer.stats()['dropped'], 1)
+
+    def test_background_thread_survives_unexpected_errors(self):
+        user = User.objects.create_user('reader', password='pass')
+        writer = history.HistoryWriter(batch_size=1, flush_interval=0.05)
+        flush, calls = writer.flush, []
+
+        def flaky_flush():
+            calls.append(1)
+            if len(calls) == 1:
+                raise RuntimeError('сбой')
+            return flush()
+
+        with self.assertLogs('books.history', 'ERROR'), mock.patch.object(writer, 'flush', side_effect=flaky_flush):
+            writer.record(user.pk, 'sad', 'hard', [])
+            for _ in range(100):
+                if writer.stats()['flushed']:
+                    break
+                time.sleep(0.02)
+        self.assertTrue(writer._thread.is_alive())
+        writer.close()
+        self.assertEqual(BookSelection.objects.count(), 1)
+
+
+@override_settings(HISTORY_WRITER={'MODE': 'sync'})
+class SeenBooksTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        recommender.reset_recommender()
+        self.addCleanup(recommender.reset_recommender)
+        self.user = User.objects.create_user('reader', password='pass')
+
+    def test_repeat_selection_shows_new_books(self):
+        make_books(9, mood='calm')
+        self.client.force_login(self.user)
+        first = self.client.get('/selection/', {'mood': 'calm'}).context['recommended_books']
+        second = self.client.get('/selection/', {'mood': 'calm'}).context['recommended_books']
+
+        self.assertEqual(len(second), 6)
+        # Новых книг осталось три - остальное добирается уже показанными
+        self.assertEqual(len(set(b.pk for b in second) - set(b.pk for b in first)), 3)
+        self.assertEqual(len(seen.get_seen(self.user.pk)), 9)
+
+    def test_loads_history_and_favorites(self):
+        books = make_books(4)
+        selection = BookSelection.objects.create(user=self.user, selected_mood='happy', selected_complexity='easy')
+        selection.recommended_books.set(books[:2])
+        self.assertEqual(seen.get_seen(self.user.pk).tolist(), [books[0].pk, books[1].pk])
+
+        self.user.userprofile.favorite_books.add(books[3])
+        self.assertEqual(seen.get_seen(self.user.pk).tolist(), [books[0].pk, books[1].pk, books[3].pk])
+
+
+class SamplingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        sampling.reset_sampler()
+        self.addCleanup(sampling.reset_sampler)
+
+    def test_uniform_and_excludes_seen(self):
+        books = make_books(30, mood='calm')
+        make_books(5, mood='sad')
+        sampler = sampling.get_sampler()
+        picked = sampler.sample(6, mood='calm')
+        self.assertEqual(len(set(picked)), 6)
+        self.assertTrue(set(picked) <= {book.pk for book in books})
+
+        seen_ids = np.array(sorted(book.pk for book in books[:27]), dtype=np.int64)
+        self.assertEqual(sorted(sampler.sample(6, mood='calm', seen_ids=seen_ids)),
+                         [book.pk for book in books[27:]])
+
+    def test_large_bucket_seeded_pages(self):
+        sampler = sampling.BucketSampler()
+        sampler._buckets[('happy', None)] = (caching.catalog_version(), np.arange(1, 100001, dtype=np.int64))
+        pages = [sampler.sample(6, mood='happy', seed='session', page=page) for page in range(3)]
+        self.assertEqual(pages[1], sampler.sample(6, mood='happy', seed='session', page=1))
+        self.assertEqual(len(set(pages[0] + pages[1] + pages[2])), 18)
+        self.assertNotEqual(pages[0], sampler.sample(6, mood='happy', seed='other'))
+
+    def test_page_numbers_past_reachable_stream_wrap_around(self):
+        sampler = sampling.BucketSampler()
+        sampler._buckets[('happy', None)] = (caching.catalog_version(), np.arange(1, 100001, dtype=np.int64))
+        # Половина корзины - 50000 позиций, 8333 полных страницы по 6
+        self.assertEqual(sampling.page_count(100000, 6), 8333)
+        huge = sampler.sample(6, mood='happy', seed='session', page=10 ** 9)
+        self.assertEqual(len(set(huge)), 6)
+        self.assertEqual(huge, sampler.sample(6, mood='happy', seed='session', page=10 ** 9 % 8333))
+        self.assertEqual(sampler.sample(6, mood='happy', seed='session', page=8333),
+                         sampler.sample(6, mood='happy', seed='session', page=0))
+
+    def test_seeded_pages_with_seen_books_stay_slices_of_one_stream(self):
+        sampler = sampling.BucketSampler()
+        sampler._buckets[('happy', None)] = (caching.catalog_version(), np.arange(1, 100001, dtype=np.int64))
+        stream = sampler.sample(60, mood='happy', seed='session')
+        # Начало потока уже показано: первой странице нужно несколько попыток добора
+        seen_ids = np.array(sorted(stream[:20]), dtype=np.int64)
+        pages = [sampler.sample(6, mood='happy', seen_ids=seen_ids, seed='session', page=page) for page in range(3)]
+        self.assertEqual(pages, [stream[20:26], stream[26:32], stream[32:38]])
+
+    def test_reloads_after_catalog_change(self):
+        make_books(3, mood='calm')
+        sampler = sampling.get_sampler()
+        self.assertEqual(len(sampler.ids('calm')), 3)
+        book = Book.objects.create(title='Новая', author='А', mood='calm', complexity='easy')
+        self.assertIn(book.pk, sampler.ids('calm').tolist())
+
+    def test_selection_view_varies_and_pages(self):
+        make_books(40, mood='calm', complexity='medium')
+        query = {'mood': 'calm', 'complexity': 'medium'}
+        results = {tuple(b.pk for b in self.client.get('/selection/', query).context['recommended_books'])
+                   for _ in range(3)}
+        self.assertGreater(len(results), 1)
+
+        first = self.client.get('/selection/', {**query, 'page': 0}).context
+        second = self.client.get('/selection/', {**query, 'page': 1}).context
+        self.assertEqual(second['next_page'], 2)
+        self.assertFalse({b.pk for b in first['recommended_books']} & {b.pk for b in second['recommended_books']})
+        again = self.client.get('/selection/', {**query, 'page': 1}).context['recommended_books']
+        self.assertEqual(again, second['recommended_books'])
+        far = self.client.get('/selection/', {**query, 'page': 10 ** 9}).context['recommended_books']
+        self.assertEqual(len(far), 6)
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        recommender.reset_recommender()
+        self.addCleanup(recommender.reset_recommender)
+
+    def test_pages_cached_until_catalog_changes(self):
+        book = Book.objects.create(title='Идиот', author='Достоевский', mood='sad', complexity='hard')
+        self.client.get('/statistics/')
+        # Попадание в кеш - только чтение отметки сверток подборок
+        with self.assertNumQueries(2):
+            self.client.get('/statistics/')
+            self.client.get('/statistics/')
+
+        book.mood = 'calm'
+        book.save()
+        response = self.client.get('/statistics/')
+        # Промах: страница отрисована заново по свежим данным
+        self.assertEqual(response.context['mood_stats'][0]['mood'], 'calm')
+        self.assertEqual(caching.counters()['statistics'], {'hits': 2, 'misses': 2})
+
+    def test_selection_cached_per_query(self):
+        make_books(8, mood='calm')
+        query = {'mood': 'calm', 'time_available': 'short'}
+        first = self.client.get('/selection/', query).context['recommended_books']
+        with self.assertNumQueries(0):
+            again = self.client.get('/selection/', query).context['recommended_books']
+        self.assertEqual([b.pk for b in again], [b.pk for b in first])
+
+        Book.objects.filter(pk=first[0].pk).delete()
+        fresh = self.client.get('/selection/', query).context['recommended_books']
+        self.assertNotIn(first[0].pk, [b.pk for b in fresh])
+
+
+class CatalogCounterTests(TestCase):
+    def counts(self):
+        return {(c.kind, c.key): c.count for c in CatalogCounter.objects.filter(count__gt=0)}
+
+    def test_follows_saves_deletes_and_imports(self):
+        book = Book.objects.create(title='Идиот', author='Достоевский', mood='sad', complexity='hard')
+        Book.objects.create(title='Бесы', author='Достоевский', mood='sad', complexity='hard')
+        book.mood = 'calm'
+        book.save()
+        self.assertEqual(self.counts(), {
+            ('total', ''): 2, ('author', 'Достоевский'): 2,
+            ('mood', 'sad'): 1, ('mood', 'calm'): 1, ('complexity', 'hard'): 2,
+        })
+
+        book.delete()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        feed = os.path.join(tmp.name, 'feed.csv')
+        with open(feed, 'w', encoding='utf-8') as f:
+            f.write('title,author,mood,complexity\nБесы,Достоевский,happy,hard\nОбломов,Гончаров,calm,easy\n')
+        call_command('import_books', feed, stdout=StringIO())
+
+        self.assertEqual(self.counts(), {
+            ('total', ''): 2, ('author', 'Достоевский'): 1, ('author', 'Гончаров'): 1,
+            ('mood', 'happy'): 1, ('mood', 'calm'): 1, ('complexity', 'hard'): 1, ('complexity', 'easy'): 1,
+        })
+
+    def test_rebuild_fixes_drift_and_page_reads_counters(self):
+        make_books(3, author='Толстой', mood='calm')
+        make_books(2, author='Чехов', mood='happy')
+        stats.rebuild()
+        # update() обходит сигналы - счетчики расходятся до пересчета
+        Book.objects.filter(author='Чехов').update(mood='sad')
+        out = StringIO()
+        call_command('rebuild_book_stats', stdout=out)
+        self.assertIn('Исправлено', out.getvalue())
+        self.assertEqual(self.counts()[('mood', 'sad')], 2)
+        self.assertNotIn(('mood', 'happy'), self.counts())
+
+        cache.clear()
+        # Отметка сверток, два счетчика, тренды и «самые любимые» по индексу - без GROUP BY по книгам
+        with self.assertNumQueries(5):
+            context = self.client.get('/statistics/').context
+        self.assertEqual(context['top_authors'][0], {'author': 'Толстой', 'book_count': 3})
+        self.assertEqual(context['total_books'], 5)
+
+
+class SelectionRollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='pass')
+
+    def select(self, mood, when):
+        return BookSelection.objects.create(user=self.user, selected_mood=mood, selected_complexity='easy',
+                                            selected_date=when)
+
+    def test_incremental_and_late_rows(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import SelectionRollup
+
+        now = timezone.now()
+        yesterday = now - timedelta(days=1)
+        self.select('happy', now)
+        self.select('happy', now)
+        self.select('sad', yesterday)
+        call_command('rollup_selections', stdout=StringIO())
+
+        def daily():
+            return {(timezone.localdate(r.bucket), r.selected_mood): r.count
+                    for r in SelectionRollup.objects.filter(period='day')}
+
+        self.assertEqual(daily(), {
+            (timezone.localdate(now), 'happy'): 2,
+            (timezone.localdate(yesterday), 'sad'): 1,
+        })
+
+        # Повторный запуск ничего не задваивает, поздняя строка попадает во вчерашний день
+        self.select('sad', yesterday)
+        call_command('rollup_selections', stdout=StringIO())
+        call_command('rollup_selections', stdout=StringIO())
+        self.assertEqual(daily()[(timezone.localdate(yesterday), 'sad')], 2)
+        self.assertEqual(daily()[(timezone.localdate(now), 'happy')], 2)
+
+        data = self.client.get('/statistics/trends/').json()
+        self.assertEqual(len(data['labels']), 14)
+        happy = next(s for s in data['datasets'] if s['key'] == 'happy')
+        self.assertEqual(happy['data'][-1], 2)
+        hourly = self.client.get('/statistics/trends/', {'period': 'hour', 'span': 48}).json()
+        self.assertEqual(sum(sum(s['data']) for s in hourly['datasets']), 4)
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        overridden = self.settings(METRICS={'DIR': self.directory, 'FLUSH_INTERVAL': 0, 'QUERY_BUDGET': 20,
+                                            'TOKEN': 'secret'})
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        metrics.registry = metrics.Registry()
+
+    def scrape(self):
+        return self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').content.decode()
+
+    def test_exposes_view_histograms(self):
+        make_books(3)
+        self.client.get('/books/')
+        text = self.scrape()
+        self.assertIn('bookmood_requests_total{status="200",view="all_books"} 1', text)
+        self.assertIn('bookmood_request_duration_seconds_count{view="all_books"} 1', text)
+        self.assertIn('bookmood_request_queries_bucket{view="all_books",le="+Inf"} 1', text)
+        self.assertIn('bookmood_template_render_seconds_sum{view="all_books"}', text)
+        self.assertIn('bookmood_response_bytes_count{view="all_books"} 1', text)
+
+    def test_sums_snapshots_of_other_workers(self):
+        self.client.get('/books/')
+        other = metrics.Registry()
+        other.inc('bookmood_requests_total', {'view': 'all_books', 'status': '200'}, 4)
+        dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+        dead.wait()
+        # Живой "воркер" - родительский процесс; снимок завершившегося удаляется
+        for pid in (os.getppid(), dead.pid):
+            with open(os.path.join(self.directory, f'metrics-{pid}.json'), 'w', encoding='utf-8') as f:
+                json.dump({'counters': other.counters, 'histograms': {}}, f)
+        text = self.scrape()
+        self.assertIn('bookmood_requests_total{status="200",view="all_books"} 5', text)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, f'metrics-{dead.pid}.json')))
+
+    def test_logs_repeated_queries_over_budget(self):
+        books = make_books(5)
+
+        def n_plus_one(request):
+            for book in Book.objects.all():
+                Book.objects.get(pk=book.pk)
+            return HttpResponse('ok')
+
+        middleware = metrics.RequestMetricsMiddleware(n_plus_one)
+        with self.settings(METRICS={'DIR': self.directory, 'QUERY_BUDGET': 3}):
+            with self.assertLogs('books.metrics', 'WARNING') as logs:
+                middleware(RequestFactory().get('/n-plus-one/'))
+        record = logs.records[0]
+        self.assertEqual(record.queries, len(books) + 1)
+        self.assertEqual(record.duplicates[0]['count'], len(books))
+        self.assertIn('WHERE "books_book"."id" = %s', record.duplicates[0]['sql'])
+        self.assertEqual(metrics.normalize_sql("SELECT * FROM t WHERE id IN (1, 2, 3) AND a = 'x'"),
+                         'SELECT * FROM t WHERE id IN (...) AND a = ?')
+
+    async def test_counts_queries_under_asgi(self):
+        # ASGI-обработчик: middleware асинхронное, SQL выполняется в потоке sync_to_async.
+        # Фасеты воркера строятся заранее - иначе их загрузка попадет в счет запроса
+        await sync_to_async(facets.get_index)()
+        self.addCleanup(facets.reset_index)
+        await self.async_client.get('/books/')
+        text = (await self.async_client.get('/metrics', headers={'Authorization': 'Bearer secret'})).content.decode()
+        self.assertIn('bookmood_request_queries_sum{view="all_books"} 1.0', text)
+
+    def test_token_protects_endpoint(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+    def test_empty_token_opens_endpoint_only_in_debug(self):
+        with self.settings(METRICS={'DIR': self.directory, 'TOKEN': ''}):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            with self.settings(DEBUG=True):
+                self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+class SeedAndBenchmarkTests(TestCase):
+    def setUp(self):
+        self.addCleanup(analytics.reset_recorder)
+
+    def test_seed_is_reproducible_and_keeps_counters(self):
+        out = StringIO()
+        call_command('seed_books', books='300', users='20', selections='50', seed=7, stdout=out)
+        self.assertEqual(json.loads(out.getvalue().splitlines()[-1])['selections'], 50)
+        first = list(Book.objects.order_by('id').values_list('title', 'author', 'mood', 'pages'))
+        self.assertEqual(BookSelection.objects.count(), 50)
+        self.assertEqual(stats.rebuild(), 0)
+        self.assertGreater(search.search_books(first[0][0].split()[1]).total, 0)
+
+        Book.objects.all().delete()
+        call_command('seed_books', books='300', users='0', selections='0', seed=7, stdout=StringIO())
+        again = list(Book.objects.order_by('id').values_list('title', 'author', 'mood', 'pages'))
+        self.assertEqual(again, first)
+
+    def test_views_benchmark_and_baseline_compare(self):
+        make_books(10)
+        rows = benchmarks.bench_views(requests=3, warmup=1)
+        self.assertEqual([row['view'] for row in rows], list(benchmarks.VIEW_SCENARIOS))
+        self.assertTrue(all(row['errors'] == 0 and row['queries_max'] is not None for row in rows))
+
+        baseline = {'views': [{**row, 'p50_ms': row['p50_ms'] / 2} for row in rows]}
+        regressions = benchmarks.compare({'views': rows}, baseline, tolerance=0.5)
+        self.assertEqual({r['view'] for r in regressions if r['metric'] == 'p50_ms'},
+                         {row['view'] for row in rows if row['p50_ms'] > 0})
+
+
+class SimilarityIndexTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        overridden = self.settings(SIMILARITY={'DIR': self.directory, 'DIM': 256, 'NEIGHBORS': 3})
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        similarity.reset_index()
+        self.addCleanup(similarity.reset_index)
+
+    def make(self, title, description, author='Автор'):
+        return Book.objects.create(title=title, author=author, description=description,
+                                   mood='calm', complexity='easy')
+
+    def test_neighbors_by_text_and_detail_page(self):
+        sea = self.make('Морской волк', 'Шхуна, шторм и капитан в открытом море')
+        storm = self.make('Шторм', 'Капитан ведет шхуну сквозь шторм в море')
+        garden = self.make('Сад', 'Тихий сад, цветы и пчелы летом')
+        bees = self.make('Пчелы', 'Цветы в саду и пчелы')
+        self.assertEqual(self.client.get(f'/book/{sea.pk}/').context['similar_books'], [])
+
+        call_command('build_similarity_index', stdout=StringIO())
+        # Воркер замечает новую сборку не сразу (CHECK_INTERVAL)
+        similarity.reset_index()
+        index = similarity.get_index()
+        self.assertIsInstance(index.vectors, np.memmap)
+        self.assertEqual(index.similar(sea.pk, 1), [storm.pk])
+        self.assertEqual(index.similar(garden.pk, 1), [bees.pk])
+
+        response = self.client.get(f'/book/{storm.pk}/')
+        self.assertEqual(response.context['similar_books'][0], sea)
+        self.assertEqual(self.client.get('/book/999999/').context['book'], None)
+
+    def test_incremental_build(self):
+        sea, captain, garden, bees, city = [
+            self.make(f'Книга {i}', f'история про {words}') for i, words in enumerate(
+                ['море и шторм', 'море и капитана', 'сад и цветы', 'сад и пчел', 'город и дождь'])]
+        similarity.build()
+        self.assertIsNone(similarity.build(incremental=True))
+        self.assertEqual(similarity.open_index().similar(city.pk), [])
+
+        city.description = 'история про море и шторм'
+        city.save()
+        captain_id = captain.pk
+        captain.delete()
+        new = self.make('Новая', 'история про сад и пчел')
+        meta = similarity.build(incremental=True)
+        self.assertEqual((meta['books'], meta['embedded']), (5, 2))
+
+        index = similarity.open_index()
+        self.assertEqual(index.similar(city.pk, 1), [sea.pk])
+        self.assertEqual(index.similar(sea.pk, 1), [city.pk])
+        self.assertEqual(index.similar(new.pk, 1), [bees.pk])
+        self.assertNotIn(captain_id, [pk for book in (sea, garden, bees) for pk in index.similar(book.pk)])
+        self.assertEqual(index.row_of(captain_id), -1)
+
+
+class SearchAnalyticsTests(TestCase):
+    def test_space_saving_keeps_heavy_hitters_in_bounded_memory(self):
+        sketch = analytics.SpaceSaving(10)
+        for i in range(5000):
+            sketch.add('толстой' if i % 4 == 0 else f'редкий {i}')
+            if i % 10 == 0:
+                sketch.add('чехов')
+        self.assertEqual(len(sketch), 10)
+        self.assertLessEqual(len(sketch._heap), 40)
+        (first, count, error, *_), (second, *_) = sketch.top(2)
+        self.assertEqual((first, second), ('толстой', 'чехов'))
+        # Точный счет - 1250; Space-Saving может только завысить, не больше чем на погрешность
+        self.assertLessEqual(count - error, 1250)
+        self.assertGreaterEqual(count, 1250)
+
+    def test_buffered_recording_and_daily_rows(self):
+        recorder = analytics.SearchAnalytics(capacity=3, keep=2, background=False)
+        for query, results in [('Толстой', 5), (' толстой ', 5), ('ТОЛСТОЙ', 4), ('драконы', 0),
+                               ('драконы', 0), ('чехов', 2)]:
+            recorder.record(query, results, 10.0)
+        self.assertEqual(SearchQueryStat.objects.count(), 0)
+
+        self.assertEqual(recorder.flush(), 6)
+        recorder.record('толстой', 3, 20.0)
+        recorder.flush()
+        rows = {(row.kind, row.query): row for row in SearchQueryStat.objects.all()}
+        self.assertEqual(rows[('all', '')].count, 7)
+        self.assertEqual(rows[('zero', '')].count, 2)
+        self.assertEqual((rows[('all', 'толстой')].count, rows[('all', 'толстой')].results), (4, 3))
+        self.assertEqual(rows[('all', 'толстой')].avg_ms, 12.5)
+        self.assertEqual(rows[('zero', 'драконы')].count, 2)
+        # В таблице за день не больше keep запросов каждого вида
+        self.assertNotIn(('all', 'чехов'), rows)
+
+    @override_settings(SEARCH_ANALYTICS={'MODE': 'sync'})
+    def test_search_view_records_and_admin_shows_summary(self):
+        search.get_backend().index_books(make_books(2, description='морская история'))
+        self.client.get('/search/', {'q': 'морская'})
+        self.client.get('/search/', {'q': 'морская', 'page': 2})
+        self.client.get('/search/', {'q': 'единороги'})
+        self.assertEqual(SearchQueryStat.objects.get(kind='all', query='').count, 2)
+        self.assertEqual(SearchQueryStat.objects.get(kind='zero', query='единороги').count, 1)
+
+        self.client.force_login(User.objects.create_superuser('admin', password='pass'))
+        response = self.client.get('/admin/books/searchquerystat/')
+        self.assertEqual(response.context['searches'], 2)
+        self.assertEqual(response.context['zero_share'], 50.0)
+        self.assertEqual([row['query'] for row in response.context['top_zero']], ['единороги'])
+
+
+class SearchAnalyticsThreadTests(TransactionTestCase):
+    def test_background_thread_survives_database_errors(self):
+        recorder = analytics.SearchAnalytics(batch_size=1, flush_interval=0.05)
+        write_rows, calls = analytics.write_rows, []
+
+        def flaky_write_rows(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 1:
+                raise RuntimeError('база недоступна')
+            return write_rows(*args, **kwargs)
+
+        with self.assertLogs('books.analytics', 'ERROR'), \
+                mock.patch.object(analytics, 'write_rows', side_effect=flaky_write_rows):
+            recorder.record('толстой', 2, 5.0)
+            for _ in range(100):
+                if recorder.stats()['written']:
+                    break
+                time.sleep(0.02)
+        self.assertTrue(recorder._thread.is_alive())
+        recorder.close()
+        # Счетчики после сбоя не потерялись
+        self.assertEqual(SearchQueryStat.objects.get(kind='all', query='толстой').count, 1)
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        facets.reset_index()
+        self.addCleanup(facets.reset_index)
+        self.addCleanup(analytics.reset_recorder)
+
+    def test_counts_exclude_own_filter(self):
+        make_books(3, mood='happy', complexity='easy')
+        make_books(2, mood='happy', complexity='hard')
+        make_books(4, mood='sad', complexity='easy')
+        counts, total = facets.get_index().counts({'mood': 'happy', 'complexity': 'easy'})
+        self.assertEqual(total, 3)
+        # Настроения - при выбранной сложности, сложности - при выбранном настроении
+        self.assertEqual((counts['mood']['happy'], counts['mood']['sad']), (3, 4))
+        self.assertEqual((counts['complexity']['easy'], counts['complexity']['hard']), (3, 2))
+
+    def test_follows_catalog_changes(self):
+        index = facets.get_index()
+        book = Book.objects.create(title='Одна', author='А', mood='calm', complexity='easy')
+        self.assertEqual(index.counts({})[0]['mood']['calm'], 1)
+
+        book.mood = 'sad'
+        book.save()
+        counts, total = index.counts({})
+        self.assertEqual((counts['mood']['calm'], counts['mood']['sad'], total), (0, 1, 1))
+
+        book.delete()
+        self.assertEqual(index.counts({})[1], 0)
+
+        # Массовое создание - через catalog_bulk_saved, как у seed_books
+        call_command('seed_books', books='70', users='0', selections='0', seed=3, stdout=StringIO())
+        self.assertEqual(index.counts({})[1], 70)
+        self.assertEqual(index.counts({})[1], len(facets.FacetIndex.from_database()))
+
+    def test_index_grows_past_capacity(self):
+        index = facets.FacetIndex(np.array([], dtype=np.int64), {facet: [] for facet in facets.FACETS})
+        for pk in range(1, 3001):
+            index.upsert(pk * 7, mood='happy' if pk % 2 else 'sad', complexity='easy')
+        within = index.bitset_of([7, 14, 21, 999999])
+        counts, total = index.counts({'mood': 'happy'}, within=within)
+        self.assertEqual(len(index), 3000)
+        self.assertEqual((counts['mood']['happy'], counts['mood']['sad'], total), (2, 1, 2))
+
+    def test_book_list_and_search_counts(self):
+        make_books(3, mood='happy', complexity='easy')
+        make_books(2, mood='sad', complexity='easy')
+        response = self.client.get('/books/', {'mood': 'sad'})
+        self.assertIn(('happy', 'Веселое', 3), response.context['moods_list'])
+        self.assertIn(('easy', 'Легкая', 2), response.context['complexity_list'])
+        self.assertEqual(response.context['total'], 2)
+
+        search.get_backend().index_books(Book.objects.all())
+        Book.objects.create(title='Другое', author='Б', mood='sad', complexity='hard')
+        response = self.client.get('/search/', {'q': 'книга', 'mood': 'sad'})
+        self.assertEqual(response.context['total'], 2)
+        self.assertIn(('happy', 'Веселое', 3), response.context['moods_list'])
+        self.assertIn(('hard', 'Сложная', 0), response.context['complexity_list'])
+
+    def test_benchmark_matches_sql(self):
+        call_command('seed_books', books='50', users='0', selections='0', seed=5, stdout=StringIO())
+        for selected in benchmarks.FACET_SELECTIONS.values():
+            counts, total = facets.FacetIndex.from_database().counts(selected)
+            sql_counts, sql_total = benchmarks._sql_facet_counts(selected)
+            self.assertEqual(total, sql_total)
+            for facet, values in counts.items():
+                self.assertEqual({key: n for key, n in values.items() if n}, sql_counts[facet])
+        rows = benchmarks.bench_facets(repeat=3)
+        self.assertEqual(len(rows), 2 * len(benchmarks.FACET_SELECTIONS))
+
+
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        self.router = routers.PrimaryReplicaRouter()
+        self.router.replicas = ['replica1']
+
+    def test_reads_catalog_from_replica(self):
+        self.assertEqual(self.router.db_for_read(Book), 'replica1')
+        self.assertEqual(self.router.db_for_read(CatalogCounter), 'replica1')
+        self.assertEqual(self.router.db_for_read(BookSelection), 'default')
+        self.assertEqual(self.router.db_for_read(User), 'default')
+        self.assertEqual(self.router.db_for_write(Book), 'default')
+        self.assertIsNone(routers._current.get())
+
+    def test_reads_own_writes_after_write(self):
+        seen_dbs = []
+
+        def view(request):
+            seen_dbs.append(self.router.db_for_read(Book))
+            if request.method == 'POST':
+                self.router.db_for_write(BookSelection)
+                seen_dbs.append(self.router.db_for_read(Book))
+            return HttpResponse('ok')
+
+        middleware = routers.ReadYourWritesMiddleware(view)
+        factory = RequestFactory()
+        response = middleware(factory.post('/selection/'))
+        self.assertEqual(seen_dbs, ['replica1', 'default'])
+        cookie = response.cookies[routers.STICKY_COOKIE]
+        self.assertEqual(cookie['max-age'], 10)
+
+        # Следующий запрос этого браузера - тоже из основной базы, пока cookie не истекла
+        request = factory.get('/books/')
+        request.COOKIES[routers.STICKY_COOKIE] = cookie.value
+        self.assertNotIn(routers.STICKY_COOKIE, middleware(request).cookies)
+        request = factory.get('/books/')
+        request.COOKIES[routers.STICKY_COOKIE] = '1'
+        middleware(request)
+        self.assertEqual(seen_dbs[2:], ['default', 'replica1'])
+
+
+class UserProfileTests(TestCase):
+    def profile_queries(self, queries):
+        return [q['sql'] for q in queries if 'books_userprofile' in q['sql']]
+
+    def test_login_and_user_updates_do_not_write_profile(self):
+        user = User.objects.create_user('reader', password='secret-pass-42')
+        self.assertTrue(UserProfile.objects.filter(user=user).exists())
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(self.client.login(username='reader', password='secret-pass-42'))
+            user.first_name = 'Анна'
+            user.save()
+        self.assertEqual(self.profile_queries(queries.captured_queries), [])
+
+    def test_profile_created_lazily(self):
+        user = User.objects.bulk_create([User(username='imported')])[0]
+        self.assertFalse(UserProfile.objects.filter(user=user).exists())
+        profile = get_profile(user)
+        self.assertEqual(profile.reading_speed, 'medium')
+        with self.assertNumQueries(0):
+            self.assertEqual(get_profile(user), profile)
+
+    def test_merges_legacy_profiles(self):
+        migration = importlib.import_module('books.migrations.0011_userprofile_merge')
+        with_profile = User.objects.create_user('old')
+        without_profile = User.objects.bulk_create([User(username='older')])[0]
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE TABLE users_userprofile (id integer PRIMARY KEY, user_id integer, '
+                           'favorite_books text)')
+            cursor.executemany('INSERT INTO users_userprofile (user_id, favorite_books) VALUES (%s, %s)',
+                               [(with_profile.pk, 'Мастер и Маргарита'), (without_profile.pk, '')])
+        migration.merge_legacy_profiles(django_apps, SimpleNamespace(connection=connection))
+        self.assertEqual(UserProfile.objects.get(user=with_profile).favorite_books_notes, 'Мастер и Маргарита')
+        self.assertTrue(UserProfile.objects.filter(user=without_profile).exists())
+
+
+class AdminPerformanceTests(TestCase):
+    def setUp(self):
+        facets.reset_index()
+        self.addCleanup(facets.reset_index)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret-pass-42'))
+
+    def test_estimated_count_for_unfiltered_list(self):
+        make_books(30)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        Book.objects.filter(pk__in=Book.objects.values('pk')[:10]).delete()
+        with self.settings(ADMIN_PERFORMANCE={'EXACT_COUNT_LIMIT': 5}):
+            # Без фильтра - статистика ANALYZE (устаревшая), с фильтром - точно, но не больше лимита
+            self.assertEqual(books_admin.EstimatedCountPaginator(Book.objects.order_by('pk'), 10).count, 30)
+            self.assertEqual(books_admin.EstimatedCountPaginator(Book.objects.filter(mood='happy').order_by('pk'), 10).count, 5)
+        self.assertEqual(books_admin.EstimatedCountPaginator(Book.objects.order_by('pk'), 10).count, 20)
+
+    def test_search_uses_index_and_selection_list_loads(self):
+        make_books(3)
+        book = Book.objects.create(title='Мастер и Маргарита', author='Булгаков', mood='mysterious',
+                                   complexity='hard')
+        response = self.client.get('/admin/books/book/', {'q': 'маргариты'})
+        self.assertEqual([b.pk for b in response.context['cl'].result_list], [book.pk])
+
+        BookSelection.objects.create(user=User.objects.get(username='admin'), selected_mood='happy',
+                                     selected_complexity='easy')
+        response = self.client.get('/admin/books/bookselection/add/')
+        self.assertContains(response, 'admin-autocomplete')
+
+    def test_reclassify_action_keeps_counters(self):
+        books = make_books(25, mood='happy', complexity='easy')
+        stats.rebuild()
+        index = facets.get_index()
+        response = self.client.post('/admin/books/book/', {
+            'action': 'set_mood_sad', '_selected_action': [book.pk for book in books[:20]],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Book.objects.filter(mood='sad').count(), 20)
+        self.assertEqual(index.counts({})[0]['mood']['sad'], 20)
+        self.assertEqual(CatalogCounter.objects.get(kind='mood', key='sad').count, 20)
+        self.assertEqual(CatalogCounter.objects.get(kind='mood', key='happy').count, 5)
+        with self.settings(ADMIN_PERFORMANCE={'ACTION_BATCH_SIZE': 2}):
+            self.assertEqual(books_admin.reclassify_books(Book.objects.all(), 'complexity', 'hard'), 25)
+        self.assertEqual(CatalogCounter.objects.get(kind='complexity', key='hard').count, 25)
+
+
+class SelectionSnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'selection.snap')
+        overridden = self.settings(SELECTION_SNAPSHOT={'PATH': self.path, 'CANDIDATES': 8})
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        snapshot.reset_snapshot()
+        self.addCleanup(snapshot.reset_snapshot)
+        recommender.reset_recommender()
+        self.addCleanup(recommender.reset_recommender)
+
+    def test_buckets_match_recommender(self):
+        make_books(10, mood='calm', complexity='easy', pages=150)
+        make_books(10, mood='sad', complexity='hard', genre='classic', pages=600)
+        call_command('build_selection_snapshot', stdout=StringIO())
+        current = snapshot.get_snapshot()
+        matrix = recommender.Recommender.from_database()
+        self.assertEqual(len(current), len(list(snapshot.buckets())))
+        for query in ({'mood': 'calm', 'complexity': 'easy'},
+                      {'mood': 'sad', 'genre': 'classic', 'time_available': 'long', 'reading_speed': 'fast'}):
+            self.assertEqual(current.candidates(**query).tolist(), matrix.recommend(k=8, **query))
+
+        ranked = current.candidates(mood='calm').tolist()
+        seen_ids = np.array(sorted(ranked[:7]), dtype=np.int64)
+        self.assertEqual(current.pick(k=3, seen_ids=seen_ids, mood='calm'), [ranked[7], *ranked[:2]])
+
+    def test_selection_served_from_snapshot_and_reloaded(self):
+        make_books(10, mood='calm', complexity='easy', pages=150)
+        call_command('build_selection_snapshot', stdout=StringIO())
+        query = {'mood': 'calm', 'time_available': 'short'}
+        first = [b.pk for b in self.client.get('/selection/', query).context['recommended_books']]
+        self.assertEqual(first, snapshot.get_snapshot().pick(k=6, **query))
+
+        # Новой книги нет в снимке, пока его не пересоберут
+        newcomer = Book.objects.create(title='Новая', author='А', mood='calm', complexity='easy', pages=100)
+        cache.clear()
+        self.assertNotIn(newcomer, self.client.get('/selection/', query).context['recommended_books'])
+        version = snapshot.get_snapshot().version
+        call_command('build_selection_snapshot', stdout=StringIO())
+        with mock.patch.object(snapshot, 'CHECK_INTERVAL', 0):
+            self.assertNotEqual(snapshot.get_snapshot().version, version)
+
+    def test_database_down_uses_snapshot_books(self):
+        books = make_books(6, mood='calm', complexity='easy', pages=150, description='Тихая история')
+        call_command('build_selection_snapshot', stdout=StringIO())
+        with mock.patch.object(Book.objects, 'in_bulk', side_effect=DatabaseError('down')):
+            with self.assertLogs('books.requests', 'WARNING'):
+                response = self.client.get('/selection/', {'mood': 'calm', 'time_available': 'short'})
+        picked = response.context['recommended_books']
+        self.assertEqual({b.pk for b in picked}, {b.pk for b in books})
+        self.assertEqual(picked[0].description, 'Тихая история')
+        self.assertContains(response, 'Тихая история')
+
+
+class ApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        snapshot.reset_snapshot()
+        recommender.reset_recommender()
+        self.addCleanup(recommender.reset_recommender)
+        self.addCleanup(analytics.reset_recorder)
+
+    def test_books_fields_cursor_and_etag(self):
+        make_books(5, mood='calm')
+        make_books(3, mood='sad')
+        response = self.client.get('/api/v1/books/', {'mood': 'calm', 'limit': 3, 'fields': 'title'})
+        data = response.json()
+        self.assertEqual(data['results'][0], {'id': data['results'][0]['id'], 'title': 'Книга 0000'})
+        second = self.client.get('/api/v1/books/', {'mood': 'calm', 'limit': 3, 'fields': 'title',
+                                                    'cursor': data['next']}).json()
+        self.assertEqual([row['title'] for row in second['results']], ['Книга 0003', 'Книга 0004'])
+        self.assertIsNone(second['next'])
+
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('"v1-'))
+        with self.assertNumQueries(0):
+            cached = self.client.get('/api/v1/books/', {'mood': 'calm'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.status_code, 304)
+
+        Book.objects.create(title='Новая', author='А', mood='calm', complexity='easy')
+        fresh = self.client.get('/api/v1/books/', {'mood': 'calm'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(fresh.status_code, 200)
+        self.assertNotEqual(fresh['ETag'], etag)
+
+    def test_rejects_bad_parameters(self):
+        self.assertEqual(self.client.get('/api/v1/books/', {'fields': 'title,password'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/books/', {'cursor': 'garbage'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/books/', {'cursor': encode_cursor(5, 1, 'title')}).status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/books/999999/').status_code, 404)
+        self.assertEqual(self.client.get('/api/v1/selection/').status_code, 400)
+        self.assertEqual(self.client.post('/api/v1/books/').status_code, 405)
+
+    def test_search_and_selection(self):
+        book = Book.objects.create(title='Мастер и Маргарита', author='Булгаков', mood='mysterious',
+                                   complexity='hard', pages=480)
+        Book.objects.create(title='Маргарита', author='Другой', mood='calm', complexity='easy')
+        data = self.client.get('/api/v1/search/', {'q': 'маргарита', 'mood': 'mysterious',
+                                                   'fields': 'author,pages'}).json()
+        self.assertEqual(data['total'], 1)
+        self.assertEqual(data['results'], [{'id': book.pk, 'author': 'Булгаков', 'pages': 480}])
+
+        data = self.client.get('/api/v1/selection/', {'mood': 'mysterious', 'complexity': 'hard',
+                                                      'limit': 1}).json()
+        self.assertEqual([row['id'] for row in data['results']], [book.pk])
+        self.assertNotIn('description', data['results'][0])
+
+
+def favorites_in_table(book):
+    return favorites.Favorite.objects.filter(book=book).count()
+
+
+class FavoritesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.books = make_books(3)
+        self.users = [User.objects.create_user(f'reader{i}', password='pass') for i in range(3)]
+
+    def assertCountsExact(self):
+        for book in Book.objects.all():
+            self.assertEqual(book.favorites_count, favorites_in_table(book), book.title)
+
+    def test_counts_follow_add_remove_clear_and_reverse(self):
+        first, second, third = self.books
+        profile = get_profile(self.users[0])
+        profile.favorite_books.add(first, second)
+        profile.favorite_books.add(first)
+        # remove() сообщает и книги, которых в избранном не было
+        profile.favorite_books.remove(second, third)
+        self.assertCountsExact()
+        self.assertEqual(Book.objects.get(pk=first.pk).favorites_count, 1)
+
+        first.userprofile_set.add(get_profile(self.users[1]), get_profile(self.users[2]))
+        self.assertEqual(Book.objects.get(pk=first.pk).favorites_count, 3)
+        first.userprofile_set.remove(get_profile(self.users[2]))
+        profile.favorite_books.set([second, third])
+        self.assertCountsExact()
+        # Сохранение загруженной раньше книги не затирает счетчик
+        stale = Book.objects.get(pk=second.pk)
+        get_profile(self.users[1]).favorite_books.add(second)
+        stale.title = 'Переименована'
+        stale.save()
+        self.assertCountsExact()
+        first.userprofile_set.clear()
+        profile.favorite_books.clear()
+        self.assertCountsExact()
+        self.assertEqual(list(Book.objects.filter(favorites_count__gt=0).values_list('id', flat=True)), [second.pk])
+
+    def test_save_without_update_fields_still_inserts_missing_row(self):
+        book = Book.objects.get(pk=self.books[0].pk)
+        Book.objects.filter(pk=book.pk).delete()
+        book.title = 'Вернулась'
+        book.save()
+        self.assertEqual(Book.objects.get(pk=book.pk).title, 'Вернулась')
+
+        Book.objects.filter(pk=book.pk).delete()
+        with self.assertRaises(DatabaseError):
+            book.save(force_update=True)
+
+        partial = Book.objects.only('title').get(pk=self.books[1].pk)
+        partial.title = 'Только название'
+        with CaptureQueriesContext(connection) as queries:
+            partial.save()
+        # Как у Django для .only(): пишутся только загруженные поля
+        updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE "books_book"')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"author"', updates[0])
+        self.assertEqual(Book.objects.get(pk=partial.pk).title, 'Только название')
+
+    def test_most_loved_and_rebuild(self):
+        first, second, _ = self.books
+        version = caching.catalog_version()
+        self.assertEqual(favorites.most_loved(), [])
+        for user in self.users:
+            favorites.update_favorites(user, add=[first.pk])
+        favorites.update_favorites(self.users[0], add=[second.pk])
+        # Лайки не сбрасывают кеш каталога; список обновится в следующем окне
+        self.assertEqual(caching.catalog_version(), version)
+        self.assertEqual(favorites.most_loved(), [])
+        with mock.patch.object(favorites, 'most_loved_window', return_value=favorites.most_loved_window() + 1):
+            self.assertEqual([book.pk for book in favorites.most_loved()], [first.pk, second.pk])
+            response = self.client.get('/')
+        self.assertContains(response, 'Самые любимые')
+        self.assertContains(response, '❤️ 3')
+
+        Book.objects.filter(pk=first.pk).update(favorites_count=10)
+        favorites.Favorite.objects.filter(book=second).delete()
+        out = StringIO()
+        call_command('rebuild_favorites_counts', stdout=out)
+        self.assertIn('Исправлено счетчиков избранного: 2', out.getvalue())
+        self.assertCountsExact()
+        self.assertEqual([book.pk for book in favorites.most_loved()], [first.pk])
+
+    def test_api_is_idempotent(self):
+        first, second, third = self.books
+        self.assertEqual(self.client.get('/api/v1/favorites/').status_code, 401)
+        self.client.login(username='reader0', password='pass')
+        url = f'/api/v1/favorites/{first.pk}/'
+        self.assertEqual(self.client.put(url).json()['changed'], True)
+        data = self.client.put(url).json()
+        self.assertEqual((data['changed'], data['favorites_count']), (False, 1))
+
+        data = self.client.post('/api/v1/favorites/', {'add': [second.pk, third.pk, 999999], 'remove': [first.pk]},
+                                content_type='application/json').json()
+        self.assertEqual((data['added'], data['removed']), ([second.pk, third.pk], [first.pk]))
+        data = self.client.post('/api/v1/favorites/', {'add': [second.pk], 'remove': [first.pk]},
+                                content_type='application/json').json()
+        self.assertEqual((data['added'], data['removed']), ([], []))
+        self.assertEqual(self.client.get('/api/v1/favorites/').json()['results'], [second.pk, third.pk])
+        self.assertEqual(self.client.delete(f'/api/v1/favorites/{third.pk}/').json()['favorites_count'], 0)
+        self.assertEqual(self.client.delete(f'/api/v1/favorites/{third.pk}/').json()['changed'], False)
+        self.assertCountsExact()
+
+        self.assertEqual(self.client.post('/api/v1/favorites/', {'add': [1], 'remove': [1]},
+                                          content_type='application/json').status_code, 400)
+        self.assertEqual(self.client.post('/api/v1/favorites/', 'junk', content_type='application/json').status_code,
+                         400)
+        self.assertEqual(self.client.put('/api/v1/favorites/999999/').status_code, 404)
+        # Id за пределами BIGINT - ошибка клиента, а не 500 из драйвера базы
+        for ids in ([10 ** 30], [0], [-1]):
+            with self.subTest(ids=ids):
+                self.assertEqual(self.client.post('/api/v1/favorites/', {'add': ids},
+                                                  content_type='application/json').status_code, 400)
+        self.assertEqual(self.client.put(f'/api/v1/favorites/{10 ** 30}/').status_code, 404)
+
+
+class FavoritesConcurrencyTests(TransactionTestCase):
+    def test_concurrent_toggles_keep_counts_exact(self):
+        book = Book.objects.create(title='Идиот', author='Достоевский', mood='sad', complexity='hard')
+        users = [User.objects.create_user(f'reader{i}') for i in range(4)]
+        errors = []
+
+        def toggle(user):
+            # Каждое второе действие повторяет предыдущее - оно ничего не должно менять
+            actions = [{'add': [book.pk]}, {'add': [book.pk]}, {'remove': [book.pk]}, {'remove': [book.pk]}] * 5
+            try:
+                for action in actions + [{'add': [book.pk]}]:
+                    for attempt in range(200):
+                        try:
+                            favorites.update_favorites(user, **action)
+                            break
+                        except OperationalError:
+                            # SQLite в памяти не ждет блокировку, а сразу отказывает
+                            time.sleep(0.005)
+                    else:
+                        raise AssertionError('база так и не освободилась')
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=toggle, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        book.refresh_from_db()
+        self.assertEqual(book.favorites_count, favorites_in_table(book))
+        self.assertEqual(book.favorites_count, len(users))
+
+
+class StaticAssetsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(recommender.reset_recommender)
+        self.addCleanup(analytics.reset_recorder)
+
+    def test_pages_load_scripts_from_static_files(self):
+        make_books(3, mood='calm')
+        for path, script in (('/books/', 'books/js/book_list.js'), ('/selection/?mood=calm', 'books/js/selection.js'),
+                             ('/search/?q=книга', 'books/js/search.js')):
+            html = self.client.get(path).content.decode()
+            self.assertIn(f'/static/{script}', html)
+            inline = [body for _, attributes, body in benchmarks.INLINE_RE.findall(html)
+                      if 'application/json' not in attributes and body.strip()]
+            self.assertEqual(inline, [], path)
+        # Карточки из books/includes/ - без HTML-комментариев и пробелов между тегами
+        html = self.client.get('/books/').content.decode()
+        self.assertNotIn('Бейдж настроения', html)
+        self.assertIn('<div class="col-lg-4 col-md-6 mb-4"><div class="card book-card">', html)
+
+    def test_collectstatic_writes_hashed_compressed_files(self):
+        with tempfile.TemporaryDirectory() as root, override_settings(
+            STATIC_ROOT=root,
+            STORAGES={**settings.STORAGES, 'staticfiles': {
+                'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'}},
+        ):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            with open(os.path.join(root, 'staticfiles.json'), encoding='utf-8') as file:
+                hashed = json.load(file)['paths']['books/js/selection.js']
+            self.assertNotEqual(hashed, 'books/js/selection.js')
+            self.assertTrue(os.path.exists(os.path.join(root, hashed + '.gz')))
+
+            self.assertIn(f'/static/{hashed}', self.client.get('/selection/').content.decode())
+            response = self.client.get(f'/static/{hashed}', HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertIn('immutable', response['Cache-Control'])
+
+    def test_collectstatic_without_debug_uses_manifest_storage(self):
+        # Настройки читаются при запуске: отдельный процесс, как в Procfile.txt
+        with tempfile.TemporaryDirectory() as root:
+            env = {**os.environ, 'DJANGO_DEBUG': '0', 'STATIC_ROOT': root}
+            subprocess.run([sys.executable, 'manage.py', 'collectstatic', '--noinput', '-v', '0'],
+                           cwd=settings.BASE_DIR, env=env, check=True, capture_output=True)
+            with open(os.path.join(root, 'staticfiles.json'), encoding='utf-8') as file:
+                hashed = json.load(file)['paths']['books/css/selection.css']
+            self.assertRegex(hashed, r'^books/css/selection\.[0-9a-f]{12}\.css$')
+            self.assertTrue(os.path.exists(os.path.join(root, hashed + '.gz')))
+
+    def test_pages_benchmark(self):
+        make_books(5)
+        rows = benchmarks.bench_pages(requests=2)
+        self.assertEqual([row['page'] for row in rows], list(benchmarks.PAGE_SCENARIOS))
+        selection = rows[benchmarks.PAGE_SCENARIOS.index('selection')]
+        self.assertEqual(selection['inline_kb'], 0)
+        self.assertGreater(selection['assets'], 0)
+        self.assertGreater(selection['first_visit_kb'], selection['repeat_visit_kb'])
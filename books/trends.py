@@ -0,0 +1,173 @@
+# books/trends.py
+"""Свертки истории подборок по часам и дням для графиков трендов.
+
+Команда ``manage.py rollup_selections`` читает подборки пачками по id
+после отметки ``RollupWatermark`` и собирает множество часов, которых
+касаются новые строки. Каждый такой час пересчитывается целиком из
+исходной таблицы (``GROUP BY`` по диапазону ``selected_date`` с индексом),
+дни - суммой своих часовых сверток. Так как корзины пересчитываются, а не
+увеличиваются, повтор пачки после сбоя ничего не задваивает, а поздние
+строки (подборка с давней датой, записанная отложенно) попадают в свой
+старый час. Свертки и отметка меняются в одной транзакции.
+
+Последние ``RECENT_HOURS`` часов пересчитываются при каждом запуске:
+строка с меньшим id может закоммититься позже строки с большим, и
+отметка уже ушла бы дальше нее.
+
+Часовые корзины хранятся в UTC, дневные - с полуночи по ``TIME_ZONE``.
+"""
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.db import router, transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .models import Book, BookSelection, RollupWatermark, SelectionRollup
+
+WATERMARK = 'selections'
+HOUR = timedelta(hours=1)
+RECENT_HOURS = 2
+# Непрерывные часы пересчитываются одним запросом, но не больше недели за раз
+MAX_RUN_HOURS = 24 * 7
+
+MOOD_NAMES = dict(Book.MOOD_CHOICES)
+
+
+def hour_floor(moment):
+    return moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def day_start(day):
+    """Полночь даты ``day`` в часовом поясе проекта"""
+    return timezone.make_aware(datetime.combine(day, time()))
+
+
+def _runs(values, step, limit):
+    """Разбивает отсортированные значения на непрерывные участки с шагом step"""
+    run = []
+    for value in values:
+        if run and (value - run[-1] != step or len(run) >= limit):
+            yield run
+            run = []
+        run.append(value)
+    if run:
+        yield run
+
+
+def recompute_hours(hours, using=None):
+    """Пересчитывает часовые свертки для множества часов из исходной таблицы"""
+    selections = BookSelection.objects.using(using).order_by()
+    rollups = SelectionRollup.objects.using(using)
+    for run in _runs(sorted(hours), HOUR, MAX_RUN_HOURS):
+        start, end = run[0], run[-1] + HOUR
+        rows = selections.filter(selected_date__gte=start, selected_date__lt=end).annotate(
+            hour=TruncHour('selected_date', tzinfo=dt_timezone.utc),
+        ).values('hour', 'selected_mood', 'selected_complexity').annotate(n=Count('id'))
+        fresh = [
+            SelectionRollup(period='hour', bucket=row['hour'], selected_mood=row['selected_mood'],
+                            selected_complexity=row['selected_complexity'], count=row['n'])
+            for row in rows
+        ]
+        rollups.filter(period='hour', bucket__gte=start, bucket__lt=end).delete()
+        rollups.bulk_create(fresh, batch_size=1000)
+
+
+def recompute_days(days, using=None):
+    """Дневные свертки - суммы часовых за местные сутки"""
+    rollups = SelectionRollup.objects.using(using)
+    for run in _runs(sorted(days), timedelta(days=1), 366):
+        start, end = day_start(run[0]), day_start(run[-1] + timedelta(days=1))
+        totals = {}
+        hourly = rollups.filter(period='hour', bucket__gte=start, bucket__lt=end).values_list(
+            'bucket', 'selected_mood', 'selected_complexity', 'count',
+        )
+        for bucket, mood, complexity, count in hourly:
+            key = (timezone.localdate(bucket), mood, complexity)
+            totals[key] = totals.get(key, 0) + count
+        rollups.filter(period='day', bucket__gte=start, bucket__lt=end).delete()
+        rollups.bulk_create([
+            SelectionRollup(period='day', bucket=day_start(day), selected_mood=mood,
+                            selected_complexity=complexity, count=count)
+            for (day, mood, complexity), count in totals.items()
+        ], batch_size=1000)
+
+
+def _recompute(hours, using):
+    recompute_hours(hours, using)
+    recompute_days({timezone.localdate(hour) for hour in hours}, using)
+
+
+def roll_up(batch_size=50000, recent_hours=RECENT_HOURS, using=None, progress=None):
+    """Учитывает подборки после отметки. Возвращает словарь со статистикой"""
+    using = using or router.db_for_write(SelectionRollup)
+    RollupWatermark.objects.using(using).get_or_create(name=WATERMARK)
+    result = {'rows': 0, 'hours': 0, 'batches': 0}
+
+    while True:
+        with transaction.atomic(using=using):
+            watermark = RollupWatermark.objects.using(using).select_for_update().get(name=WATERMARK)
+            rows = list(
+                BookSelection.objects.using(using).filter(id__gt=watermark.last_id)
+                .order_by('id').values_list('id', 'selected_date')[:batch_size]
+            )
+            if not rows:
+                break
+            hours = {hour_floor(selected_date) for _, selected_date in rows}
+            _recompute(hours, using)
+            watermark.last_id = rows[-1][0]
+            watermark.save(using=using)
+
+        result['rows'] += len(rows)
+        result['hours'] += len(hours)
+        result['batches'] += 1
+        if progress:
+            progress(result)
+
+    if recent_hours:
+        now = hour_floor(timezone.now())
+        with transaction.atomic(using=using):
+            _recompute({now - HOUR * i for i in range(recent_hours)}, using)
+    return result
+
+
+def last_rolled_id(using=None):
+    """Отметка свертки - часть ключа кеша страницы статистики"""
+    marks = RollupWatermark.objects.using(using).filter(name=WATERMARK).values_list('last_id', flat=True)
+    return next(iter(marks[:1]), 0)
+
+
+def chart_data(period='day', span=14, now=None, using=None):
+    """Данные для Chart.js: подписи корзин и по набору точек на настроение"""
+    now = now or timezone.now()
+    if period == 'hour':
+        step = HOUR
+        first = hour_floor(now) - HOUR * (span - 1)
+        label_format = '%d.%m %H:00'
+    else:
+        step = None
+        first = day_start(timezone.localdate(now) - timedelta(days=span - 1))
+        label_format = '%d.%m'
+
+    buckets = []
+    for i in range(span):
+        buckets.append(first + step * i if step else day_start(timezone.localdate(first) + timedelta(days=i)))
+    position = {bucket: i for i, bucket in enumerate(buckets)}
+
+    series = {}
+    rows = SelectionRollup.objects.using(using).filter(period=period, bucket__gte=first).values(
+        'bucket', 'selected_mood',
+    ).annotate(n=Sum('count')).order_by()
+    for row in rows:
+        i = position.get(row['bucket'])
+        if i is not None:
+            series.setdefault(row['selected_mood'], [0] * span)[i] = row['n']
+
+    return {
+        'period': period,
+        'labels': [timezone.localtime(bucket).strftime(label_format) for bucket in buckets],
+        'datasets': [
+            {'key': mood, 'label': MOOD_NAMES.get(mood, mood), 'data': series[mood]}
+            for mood, _ in Book.MOOD_CHOICES if mood in series
+        ],
+    }
@@ -0,0 +1,264 @@
+# books/trigram.py
+"""Триграммный индекс для подсказок и поиска с опечатками.
+
+Индекс целиком живет в памяти воркера и строится один раз при старте
+(см. ``books.warmup``), дальше обновляется сигналами ``post_save`` /
+``post_delete``. Чтобы занимать мало памяти, все хранится в массивах:
+
+* ``_ids`` - id книги по порядковому номеру (ординалу), отсортирован;
+* ``_text``/``_offsets``/``_lengths`` - "название\\x1fавтор" в UTF-8;
+* ``_postings`` - триграмма → ``array('I')`` ординалов.
+
+Поиск кандидатов использует prefix filtering: если книга должна делить с
+запросом хотя бы ``m`` из ``n`` триграмм, она обязательно встретится в одном
+из ``n - m + 1`` самых коротких списков. Совпадения считаются numpy по
+ограниченному бюджету элементов, а точное сходство проверяется только у
+лучших ``limit * VERIFY_FACTOR`` кандидатов.
+"""
+import heapq
+import math
+import re
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+
+import numpy as np
+
+from .models import Book
+
+SEPARATOR = '\x1f'
+NON_WORD = re.compile(r'[\W_]+')
+
+# Минимальная доля общих триграмм, чтобы считать книгу похожей
+DEFAULT_THRESHOLD = 0.3
+# Сколько элементов списков читаем на запрос и во сколько раз больше
+# кандидатов, чем нужно подсказок, проверяем по тексту
+MAX_SCANNED_POSTINGS = 8192
+VERIFY_FACTOR = 2
+
+
+def normalize(text):
+    """Нижний регистр, ё → е, только буквы и цифры через пробел"""
+    return NON_WORD.sub(' ', (text or '').lower().replace('ё', 'е')).strip()
+
+
+def trigrams(text, prefix=False):
+    """Множество триграмм текста в стиле pg_trgm.
+
+    Каждое слово дополняется двумя пробелами слева и одним справа.
+    С ``prefix=True`` последнее слово считается недописанным и правый
+    пробел к нему не добавляется - так работает автодополнение.
+    """
+    words = normalize(text).split()
+    result = set()
+    for position, word in enumerate(words):
+        last = prefix and position == len(words) - 1
+        padded = f'  {word}' if last else f'  {word} '
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+class TrigramIndex:
+    """Компактный in-memory индекс по названию и автору"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._ids = array('q')
+        self._offsets = array('Q')
+        self._lengths = array('I')
+        self._alive = bytearray()
+        self._text = bytearray()
+        self._postings = {}
+        # Книги, добавленные не по возрастанию id (редкий случай, явный pk):
+        # в _ids для них повторяется предыдущее значение, чтобы массив
+        # оставался отсортированным, а настоящий id хранится здесь
+        self._unordered = {}
+        self._unordered_ids = {}
+        self._stale_bytes = 0
+
+    # --- построение ---------------------------------------------------
+
+    @classmethod
+    def build(cls, rows):
+        """Строит индекс из итерируемого (id, title, author)"""
+        index = cls()
+        for book_id, title, author in rows:
+            index._append(book_id, title, author)
+        return index
+
+    @classmethod
+    def from_database(cls, using=None, chunk_size=5000):
+        rows = Book.objects.using(using).order_by('id').values_list('id', 'title', 'author')
+        return cls.build(rows.iterator(chunk_size=chunk_size))
+
+    def _append(self, book_id, title, author):
+        ordinal = len(self._ids)
+        if self._ids and book_id <= self._ids[-1]:
+            self._unordered[book_id] = ordinal
+            self._unordered_ids[ordinal] = book_id
+            self._ids.append(self._ids[-1])
+        else:
+            self._ids.append(book_id)
+        self._alive.append(1)
+        self._store_text(ordinal, title, author, new=True)
+        for gram in trigrams(f'{title} {author}'):
+            self._postings.setdefault(gram, array('I')).append(ordinal)
+
+    def _store_text(self, ordinal, title, author, new=False):
+        encoded = f'{title}{SEPARATOR}{author}'.encode('utf-8')
+        if new:
+            self._offsets.append(len(self._text))
+            self._lengths.append(len(encoded))
+        else:
+            self._stale_bytes += self._lengths[ordinal]
+            self._offsets[ordinal] = len(self._text)
+            self._lengths[ordinal] = len(encoded)
+        self._text.extend(encoded)
+
+    def _ordinal_of(self, book_id):
+        if book_id in self._unordered:
+            return self._unordered[book_id]
+        position = bisect_left(self._ids, book_id)
+        if position < len(self._ids) and self._ids[position] == book_id \
+                and position not in self._unordered_ids:
+            return position
+        return None
+
+    def _document(self, ordinal):
+        start = self._offsets[ordinal]
+        raw = self._text[start:start + self._lengths[ordinal]].decode('utf-8')
+        title, _, author = raw.partition(SEPARATOR)
+        return title, author
+
+    # --- инкрементальные обновления -------------------------------------
+
+    def add_or_update(self, book_id, title, author):
+        """Добавить книгу или обновить ее название/автора"""
+        with self._lock:
+            ordinal = self._ordinal_of(book_id)
+            if ordinal is None:
+                self._append(book_id, title, author)
+                return
+
+            old_grams = trigrams(' '.join(self._document(ordinal))) if self._alive[ordinal] else set()
+            self._alive[ordinal] = 1
+            self._store_text(ordinal, title, author)
+            # Исчезнувшие триграммы оставляем: кандидаты все равно проверяются
+            # по актуальному тексту, а дубликатов в списках не появится
+            for gram in trigrams(f'{title} {author}') - old_grams:
+                self._postings.setdefault(gram, array('I')).append(ordinal)
+
+    def remove(self, book_id):
+        with self._lock:
+            ordinal = self._ordinal_of(book_id)
+            if ordinal is not None:
+                self._alive[ordinal] = 0
+
+    # --- поиск ----------------------------------------------------------
+
+    def suggest(self, query, limit=10, threshold=DEFAULT_THRESHOLD):
+        """Лучшие совпадения: список (id, title, author, score)"""
+        query_grams = trigrams(query, prefix=True)
+        if not query_grams:
+            return []
+
+        with self._lock:
+            lists = sorted(
+                (self._postings[gram] for gram in query_grams if gram in self._postings),
+                key=len,
+            )
+            if not lists:
+                return []
+
+            # Prefix filtering: книга с долей общих триграмм >= threshold обязана
+            # встретиться в одном из n - m + 1 самых коротких списков.
+            # Длинные списки (частые триграммы) читаем только в пределах бюджета.
+            required = max(1, math.ceil(len(query_grams) * threshold))
+            chunks = [np.frombuffer(lists[0], dtype=np.uint32)[:MAX_SCANNED_POSTINGS]]
+            scanned = len(chunks[0])
+            for position, postings in enumerate(lists[1:], start=1):
+                if scanned + len(postings) > MAX_SCANNED_POSTINGS:
+                    break
+                if position > len(lists) - required and scanned >= MAX_SCANNED_POSTINGS // 2:
+                    break
+                chunks.append(np.frombuffer(postings, dtype=np.uint32))
+                scanned += len(postings)
+
+            # Число общих триграмм у каждого кандидата одним проходом numpy
+            ordinals, hits = np.unique(np.concatenate(chunks), return_counts=True)
+            del chunks  # отпускаем буферы массивов до следующих append
+            # Точное сходство считаем только у лидеров по числу совпадений
+            verified = max(limit * VERIFY_FACTOR, 1)
+            if len(ordinals) > verified:
+                top = np.argpartition(hits, -verified)[-verified:]
+                ordinals = ordinals[top]
+
+            scored = []
+            for ordinal in ordinals.tolist():
+                if not self._alive[ordinal]:
+                    continue
+                title, author = self._document(ordinal)
+                score = self._similarity(query_grams, title, author)
+                if score >= threshold:
+                    scored.append((score, -len(title), ordinal, title, author))
+
+            best = heapq.nlargest(limit, scored)
+            return [(self._unordered_ids.get(ordinal, self._ids[ordinal]), title, author, round(score, 3))
+                    for score, _, ordinal, title, author in best]
+
+    @staticmethod
+    def _similarity(query_grams, title, author):
+        # Доля триграмм запроса, найденных в названии или авторе
+        return len(query_grams & trigrams(f'{title} {author}')) / len(query_grams)
+
+    # --- статистика -----------------------------------------------------
+
+    def __len__(self):
+        return sum(self._alive)
+
+    def memory_usage(self):
+        """Примерный размер индекса в байтах"""
+        total = sum(
+            sys.getsizeof(buffer)
+            for buffer in (self._ids, self._offsets, self._lengths, self._alive, self._text)
+        )
+        total += sys.getsizeof(self._postings)
+        total += sum(sys.getsizeof(gram) + sys.getsizeof(postings) for gram, postings in self._postings.items())
+        total += sys.getsizeof(self._unordered) + sys.getsizeof(self._unordered_ids)
+        return total
+
+    def stats(self):
+        return {
+            'books': len(self),
+            'ordinals': len(self._ids),
+            'trigrams': len(self._postings),
+            'postings': sum(len(postings) for postings in self._postings.values()),
+            'stale_text_bytes': self._stale_bytes,
+            'memory_bytes': self.memory_usage(),
+        }
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Индекс текущего воркера, строится при первом обращении"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = TrigramIndex.from_database()
+    return _index
+
+
+def loaded_index():
+    """Индекс, если он уже построен, иначе None (для сигналов)"""
+    return _index
+
+
+def reset_index():
+    global _index
+    with _index_lock:
+        _index = None
@@ -1,6 +1,6 @@
 # books/urls.py
 from django.urls import path
-from . import views
+from . import api, metrics, views
 
 urlpatterns = [
     # Главная страница
@@ -8,6 +8,21 @@ urlpatterns = [
 
     path('books/', views.all_books, name='all_books'),
     path('search/', views.search_books, name='search'),
+    path('search/suggest/', views.search_suggest, name='search_suggest'),
+    path('book/<int:book_id>/', views.book_detail, name='book_detail'),
     path('selection/', views.selection, name='selection'),
     path('statistics/', views.statistics, name='statistics'),
+    path('statistics/trends/', views.statistics_trends, name='statistics_trends'),
+    path('export/<slug:name>/', views.export_data, name='export_data'),
+    path('internal/history/', views.history_status, name='history_status'),
+    path('internal/cache/', views.cache_status, name='cache_status'),
+    path('metrics', metrics.metrics_view, name='metrics'),
+
+    # JSON API для мобильного клиента (books/api.py)
+    path('api/v1/books/', api.books, name='api_books'),
+    path('api/v1/books/<int:book_id>/', api.book_detail, name='api_book_detail'),
+    path('api/v1/search/', api.search_books, name='api_search'),
+    path('api/v1/selection/', api.selection, name='api_selection'),
+    path('api/v1/favorites/', api.favorites_list, name='api_favorites'),
+    path('api/v1/favorites/<int:book_id>/', api.favorite, name='api_favorite'),
 ]
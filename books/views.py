@@ -1,54 +1,178 @@
 # books/views.py
+import logging
+import secrets
+import time
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
-from django.db.models import Q
+from django.db import DatabaseError
+from . import (analytics, caching, export, facets, favorites, history, metrics, recommender, sampling, search, seen,
+               similarity, snapshot, stats, trends, trigram)
+from .forms import GENRE_PREFERENCE_CHOICES, TIME_AVAILABLE_CHOICES
 from .models import Book
+from .pagination import InvalidCursor, paginate
+
+logger = logging.getLogger('books.requests')
 
+@caching.cache_catalog_page('home', extra_key=favorites.most_loved_window)
 def home(request):
     books = Book.objects.all()[:6]
     total_books = Book.objects.count()
     return render(request, 'books/home.html', {
         'books': books,
         'total_books': total_books,
+        'most_loved': favorites.most_loved(),
         'title': 'BookMood - Главная'
     })
 
 def book_list(request):
-    books = Book.objects.all()
+    """Каталог с курсорной пагинацией, сортировкой и фильтрами"""
+    mood = request.GET.get('mood', '')
+    complexity = request.GET.get('complexity', '')
+    sort = request.GET.get('sort', 'title')
+
+    books = Book.objects.only('id', 'title', 'author', 'mood', 'complexity', 'description', 'genre', 'pages')
+    if mood in dict(Book.MOOD_CHOICES):
+        books = books.filter(mood=mood)
+    else:
+        mood = ''
+    if complexity in dict(Book.COMPLEXITY_CHOICES):
+        books = books.filter(complexity=complexity)
+    else:
+        complexity = ''
+
+    try:
+        page = paginate(books, sort=sort, cursor=request.GET.get('cursor'))
+    except InvalidCursor:
+        # Битый или устаревший курсор - просто начинаем с первой страницы
+        page = paginate(books, sort=sort)
+
+    # Сколько книг даст каждый фильтр при текущем выборе - из битовых строк воркера
+    counts, total = facets.get_index().counts({'mood': mood, 'complexity': complexity})
+
     return render(request, 'books/book_list.html', {
-        'books': books,
+        'books': page.items,
+        'page': page,
+        'mood': mood,
+        'complexity': complexity,
+        'sort': sort,
+        'moods_list': facet_choices(Book.MOOD_CHOICES, counts['mood']),
+        'complexity_list': facet_choices(Book.COMPLEXITY_CHOICES, counts['complexity']),
+        'total': total,
+        'catalog_version': caching.catalog_version(),
         'title': 'Все книги'
     })
 
+def facet_choices(choices, counts):
+    """(ключ, название, число книг) для кнопок фильтра"""
+    return [(key, label, counts.get(key, 0)) for key, label in choices]
+
+
 def all_books(request):
     return book_list(request)
 
+def sample_books(request, mood, complexity, seen_ids, k=6):
+    """Случайные книги корзины (настроение, сложность) и номер страницы.
+
+    С ``?page=N`` выборка идет по зерну сессии: страницы стабильны и не
+    пересекаются, показанные книги не исключаются (повторов и так нет);
+    номера за пределами корзины идут по кругу (``sampling.page_count``).
+    Без него - новая выборка без уже показанных книг; если непоказанных
+    не хватает, добираем рекомендателем.
+    """
+    try:
+        page = max(int(request.GET.get('page', '')), 0)
+    except ValueError:
+        page = None
+    sampler = sampling.get_sampler()
+    if page is not None:
+        seed = request.session.setdefault('selection_seed', secrets.token_hex(8))
+        ids = sampler.sample(k, mood, complexity, seed=seed, page=page)
+    else:
+        ids = sampler.sample(k, mood, complexity, seen_ids=seen_ids)
+        if len(ids) < k:
+            ids += recommender.get_recommender().recommend(
+                k=k - len(ids), exclude_ids=ids, seen_ids=seen_ids, mood=mood, complexity=complexity,
+            )
+    books_by_id = Book.objects.in_bulk(ids)
+    return [books_by_id[pk] for pk in ids if pk in books_by_id], page
+
+
 def selection(request):
-    """Подбор книг по настроению и сложности"""
+    """Подбор книг по настроению, сложности, времени и жанру"""
     # Получаем параметры
     mood = request.GET.get('mood', '')
     complexity = request.GET.get('complexity', '')
+    time_available = request.GET.get('time_available', '')
+    genre = request.GET.get('genre_preference', '')
+    if time_available not in dict(TIME_AVAILABLE_CHOICES):
+        time_available = ''
+    if genre not in dict(GENRE_PREFERENCE_CHOICES) or genre == 'any':
+        genre = ''
 
     recommended_books = []
     show_results = False
+    sampled = False
+    page = None
 
-    if mood or complexity:
+    if mood or complexity or time_available or genre:
         show_results = True
 
         try:
-            books = Book.objects.all()
-
-            if mood:
-                books = books.filter(mood=mood)
-                print(f"🔍 Ищем книги с настроением: '{mood}'")
-                print(f"📚 Найдено: {books.count()}")
-                
-            if complexity:
-                books = books.filter(complexity=complexity)
-
-            recommended_books = books[:6]
-
-        except Exception as e:
-            print(f"❌ Ошибка подбора: {e}")
+            reading_speed = 'medium'
+            if request.user.is_authenticated and hasattr(request.user, 'userprofile'):
+                reading_speed = request.user.userprofile.reading_speed
+
+            # Оцениваем весь каталог в памяти, из базы берем только итоговые книги.
+            # Уже показанные пользователю книги уходят в конец выдачи
+            seen_ids = seen.seen_for(request.user)
+            query = {
+                'mood': mood,
+                'complexity': complexity,
+                'genre': genre,
+                'time_available': time_available,
+                'reading_speed': reading_speed,
+            }
+
+            def pick_books():
+                # Готовая подборка из снимка (build_selection_snapshot), без снимка - расчет по каталогу
+                current = snapshot.get_snapshot()
+                ids = current.pick(k=6, seen_ids=seen_ids, **query) if current is not None else None
+                if ids is None:
+                    ids = recommender.get_recommender().recommend(k=6, seen_ids=seen_ids, **query)
+                try:
+                    books_by_id = Book.objects.in_bulk(ids)
+                except DatabaseError:
+                    if current is None:
+                        raise
+                    # База каталога недоступна - карточки из самого снимка
+                    logger.warning('⚠️ База недоступна, подборка из снимка', extra={'mood': mood})
+                    return current.books(ids)
+                return [books_by_id[pk] for pk in ids if pk in books_by_id]
+
+            if (mood or complexity) and not (time_available or genre):
+                # Только настроение и сложность: все книги корзины подходят одинаково,
+                # берем случайные - каждый подбор разный, цена не зависит от размера корзины
+                try:
+                    recommended_books, page = sample_books(request, mood, complexity, seen_ids)
+                    sampled = True
+                except DatabaseError:
+                    recommended_books = pick_books()
+            elif len(seen_ids):
+                # Персональная выдача не кешируется
+                recommended_books = pick_books()
+            else:
+                recommended_books = caching.cached_value('selection', query.values(), pick_books)
+            # В историю пишем отложенно, пачками в фоновом потоке
+            history.record_selection(request.user, mood, complexity, recommended_books)
+            logger.info('🔍 Подбор: подобрано %s', len(recommended_books), extra={
+                'mood': mood, 'complexity': complexity, 'time_available': time_available,
+                'genre': genre, 'found': len(recommended_books),
+            })
+
+        except Exception:
+            logger.exception('❌ Ошибка подбора', extra={'mood': mood, 'complexity': complexity})
             recommended_books = []
 
     # Словарь для формы: английский ключ → русское название с эмодзи
@@ -68,12 +192,19 @@ def selection(request):
 
     context = {
         'title': 'Подобрать книгу',
+        'sampled': sampled,
+        'next_page': 0 if page is None else page + 1,
         'mood': mood,
         'complexity': complexity,
+        'time_available': time_available,
+        'genre_preference': genre,
         'recommended_books': recommended_books,
         'show_results': show_results,
         'mood_choices': MOOD_FORM_CHOICES,
+        'time_choices': TIME_AVAILABLE_CHOICES,
+        'genre_choices': GENRE_PREFERENCE_CHOICES,
         'mood_display_dict': mood_display_dict,
+        'catalog_version': caching.catalog_version(),
     }
 
     return render(request, 'books/selection.html', context)
@@ -81,45 +212,127 @@ def selection(request):
 
 # Поиск книг
 def search_books(request):
-    """Простой и надёжный поиск"""
+    """Полнотекстовый поиск с ранжированием и постраничным выводом"""
     # Получаем запрос
     query = request.GET.get('q', '').strip()
-
-    print(f"🎯 ЗАПРОС ПОИСКА: '{query}'")
+    try:
+        page_number = int(request.GET.get('page', 1))
+    except ValueError:
+        page_number = 1
+    selected = {
+        'mood': request.GET.get('mood', '') if request.GET.get('mood') in dict(Book.MOOD_CHOICES) else '',
+        'complexity': (request.GET.get('complexity', '')
+                       if request.GET.get('complexity') in dict(Book.COMPLEXITY_CHOICES) else ''),
+    }
 
     results = []
+    page = None
+    facet_lists = {}
     if query:
-        from django.db.models import Q
-
-        # Ищем БЕЗ УЧЁТА РЕГИСТРА (icontains)
-        results = Book.objects.filter(
-            Q(title__icontains=query) |
-            Q(author__icontains=query) |
-            Q(description__icontains=query)
-        )
-
-        print(f"📚 НАЙДЕНО РЕЗУЛЬТАТОВ: {len(results)}")
-
-        # Для отладки покажем что нашли
-        for book in results[:3]:  # Покажем первые 3
-            print(f"   📖 {book.title} (автор: {book.author})")
+        started = time.perf_counter()
+        page = search.search_books(query, page=page_number, filters=selected, with_matches=True)
+        results = page.books
+        if page.matched_ids:
+            index = facets.get_index()
+            counts, _ = index.counts(selected, within=index.bitset_of(page.matched_ids))
+            facet_lists = {
+                'moods_list': facet_choices(Book.MOOD_CHOICES, counts['mood']),
+                'complexity_list': facet_choices(Book.COMPLEXITY_CHOICES, counts['complexity']),
+            }
+        if page_number == 1:
+            # Листание страниц - не новый поиск
+            analytics.record_search(query, page.total, (time.perf_counter() - started) * 1000)
+        if page.timed_out:
+            metrics.registry.inc('bookmood_search_timeouts_total', {})
+            logger.warning('⏱️ Поиск прерван по времени', extra={'query': query, 'page': page_number})
+        logger.info('🎯 Поиск: найдено %s', page.total, extra={
+            'query': query, 'page': page_number, 'found': page.total,
+            'top': [book.pk for book in results[:3]],
+        })
+
+    # Ничего не нашли - возможно, опечатка: предлагаем похожие книги
+    suggestions = []
+    if query and not results and not page.timed_out:
+        suggestions = trigram.get_index().suggest(query, limit=5)
 
     return render(request, 'books/search.html', {
         'results': results,
+        'page': page,
+        'total': page.total if page else 0,
+        'suggestions': suggestions,
         'query': query,
+        **selected,
+        **facet_lists,
         'title': f'Поиск: {query}' if query else 'Поиск книг'
     })
 
 
+def search_suggest(request):
+    """Подсказки для автодополнения: /search/suggest/?q=достаевский"""
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = min(max(int(request.GET.get('limit', 10)), 1), 20)
+    except ValueError:
+        limit = 10
+
+    suggestions = trigram.get_index().suggest(query, limit=limit) if query else []
+    return JsonResponse({
+        'query': query,
+        'suggestions': [
+            {'id': book_id, 'title': title, 'author': author, 'score': score}
+            for book_id, title, author, score in suggestions
+        ],
+    })
+
+
+# Выгрузка данных для аналитики
+@staff_member_required
+def export_data(request, name):
+    """Потоковая выгрузка: /export/books/?format=jsonl&gzip=1&after=1000"""
+    if name not in export.EXPORTS:
+        raise Http404('Неизвестная выгрузка')
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in export.FORMATS:
+        fmt = 'csv'
+    compress = request.GET.get('gzip') == '1'
+    try:
+        after = max(int(request.GET.get('after', 0)), 0)
+    except ValueError:
+        after = 0
+
+    # Тело отдается по мере чтения базы, целиком в памяти не собирается
+    response = StreamingHttpResponse(
+        export.export(name, fmt, compress=compress, after=after),
+        content_type='application/gzip' if compress else export.CONTENT_TYPES[fmt],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{export.filename(name, fmt, compress)}"'
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+@staff_member_required
+def history_status(request):
+    """Счетчики буфера истории подборок текущего воркера"""
+    return JsonResponse(history.get_writer().stats())
+
+
+@staff_member_required
+def cache_status(request):
+    """Версия каталога и попадания в кеш по представлениям текущего воркера"""
+    return JsonResponse({'catalog_version': caching.catalog_version(), 'views': caching.counters()})
+
+
 # Статистика
+def _statistics_cache_key():
+    # Свертки подборок и «самые любимые» меняются независимо от каталога
+    return f'{trends.last_rolled_id()}:{favorites.most_loved_window()}'
+
+
+@caching.cache_catalog_page('statistics', extra_key=_statistics_cache_key)
 def statistics(request):
     """Страница со статистикой"""
-    from django.db.models import Count
-
-    # Статистика по настроениям
-    mood_stats = Book.objects.values('mood').annotate(
-        count=Count('id')
-    ).order_by('-count')
+    # Счетчики поддерживаются сигналами (books/stats.py) - без GROUP BY по каталогу
+    context = stats.read_statistics()
 
     # Преобразуем английские ключи в русские названия
     MOOD_RU_NAMES = {
@@ -133,28 +346,30 @@ def statistics(request):
         'thoughtful': 'Задумчивое',
     }
 
-    for stat in mood_stats:
+    for stat in context['mood_stats']:
         stat['mood_ru'] = MOOD_RU_NAMES.get(stat['mood'], stat['mood'])
 
-    # Статистика по сложности
-    complexity_stats = Book.objects.values('complexity').annotate(
-        count=Count('id')
-    ).order_by('-count')
-
-    # Популярные авторы
-    top_authors = Book.objects.values('author').annotate(
-        book_count=Count('id')
-    ).order_by('-book_count')[:5]
+    # Тренды настроений за две недели из дневных сверток подборок
+    context['trends'] = trends.chart_data('day', 14)
+    # Самые любимые - по индексу на Book.favorites_count, без подсчета по таблице избранного
+    context['most_loved'] = favorites.most_loved(10)
+    context['title'] = 'Статистика'
+    return render(request, 'books/statistics.html', context)
 
-    context = {
-        'title': 'Статистика',
-        'mood_stats': mood_stats,
-        'complexity_stats': complexity_stats,
-        'top_authors': top_authors,
-        'total_books': Book.objects.count(),
-    }
 
-    return render(request, 'books/statistics.html', context)
+def statistics_trends(request):
+    """Данные графика трендов для Chart.js: /statistics/trends/?period=hour&span=48"""
+    period = request.GET.get('period', 'day')
+    if period not in ('day', 'hour'):
+        period = 'day'
+    try:
+        span = min(max(int(request.GET.get('span', 14)), 1), 24 * 31 if period == 'hour' else 366)
+    except ValueError:
+        span = 14
+    response = JsonResponse(trends.chart_data(period, span))
+    # Свертки обновляются командой по расписанию - минуту можно не перечитывать
+    response['Cache-Control'] = 'public, max-age=60'
+    return response
 
 
 # Детальная информация о книге
@@ -165,7 +380,15 @@ def book_detail(request, book_id):
     except Book.DoesNotExist:
         book = None
 
+    # Соседи из индекса build_similarity_index: одна строка mmap-файла
+    similar_books = []
+    if book is not None:
+        ids = similarity.similar_ids(book.pk)
+        books_by_id = Book.objects.in_bulk(ids)
+        similar_books = [books_by_id[pk] for pk in ids if pk in books_by_id]
+
     return render(request, 'books/book_detail.html', {
         'book': book,
+        'similar_books': similar_books,
         'title': book.title if book else 'Книга не найдена'
     })
@@ -0,0 +1,29 @@
+# books/warmup.py
+"""Прогрев in-memory индексов при старте воркера.
+
+Вызывается из ``bookmood/wsgi.py`` и ``bookmood/asgi.py``: gunicorn без
+``--preload`` импортирует приложение в каждом воркере, поэтому индексы
+строятся один раз на процесс, а не на первом запросе пользователя.
+"""
+import logging
+
+from django.db import DatabaseError
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up():
+    """Строит индексы; ошибки базы (например, до migrate) не мешают старту"""
+    from . import recommender, snapshot, trigram
+
+    loaders = [
+        ('trigram', trigram.get_index),
+        ('recommender', recommender.get_recommender),
+        # Только mmap файла, без чтения базы
+        ('selection snapshot', snapshot.get_snapshot),
+    ]
+    for name, loader in loaders:
+        try:
+            loader()
+        except DatabaseError as exc:
+            logger.warning('Не удалось прогреть индекс %s: %s', name, exc)
@@ -0,0 +1,26 @@
+// Поиск на странице
+document.addEventListener('DOMContentLoaded', function() {
+    const searchInput = document.createElement('input');
+    searchInput.className = 'form-control mb-3';
+    searchInput.placeholder = 'Искать на этой странице...';
+    searchInput.id = 'page-search';
+
+    const booksContainer = document.getElementById('books-container');
+    if (booksContainer) {
+        booksContainer.parentNode.insertBefore(searchInput, booksContainer);
+
+        searchInput.addEventListener('input', function() {
+            const query = this.value.toLowerCase();
+            const books = booksContainer.children;
+
+            for (let book of books) {
+                const text = book.textContent.toLowerCase();
+                if (text.includes(query)) {
+                    book.style.display = '';
+                } else {
+                    book.style.display = 'none';
+                }
+            }
+        });
+    }
+});
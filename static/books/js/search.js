@@ -0,0 +1,25 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const input = document.querySelector('input[name="q"]');
+    const datalist = document.getElementById('search-suggestions');
+    let timer = null;
+
+    input.addEventListener('input', function() {
+        clearTimeout(timer);
+        const query = this.value.trim();
+        if (query.length < 2) return;
+
+        timer = setTimeout(function() {
+            fetch('/search/suggest/?q=' + encodeURIComponent(query))
+                .then(response => response.json())
+                .then(data => {
+                    datalist.innerHTML = '';
+                    data.suggestions.forEach(item => {
+                        const option = document.createElement('option');
+                        option.value = item.title;
+                        option.label = item.author;
+                        datalist.appendChild(option);
+                    });
+                });
+        }, 150);
+    });
+});
@@ -0,0 +1,39 @@
+document.addEventListener('DOMContentLoaded', function() {
+    // Выбор варианта: выделение снимается только внутри своей группы (name)
+    const options = document.querySelectorAll('.mood-option, .complexity-option');
+    options.forEach(option => {
+        option.addEventListener('click', function() {
+            const radio = this.querySelector('input[type="radio"]');
+            if (!radio) return;
+            // Убираем выделение с вариантов той же группы
+            document.querySelectorAll(`input[name="${radio.name}"]`).forEach(input => {
+                input.parentElement.classList.remove('selected');
+            });
+            // Выделяем выбранное и активируем радио-кнопку
+            this.classList.add('selected');
+            radio.checked = true;
+        });
+    });
+
+    // Восстановление выбранных значений из URL
+    const urlParams = new URLSearchParams(window.location.search);
+    ['mood', 'complexity', 'time_available', 'genre_preference'].forEach(name => {
+        const value = urlParams.get(name);
+        if (!value) return;
+        const radio = document.querySelector(`input[name="${name}"][value="${value}"]`);
+        if (radio) {
+            radio.checked = true;
+            radio.parentElement.classList.add('selected');
+        }
+    });
+
+    // Анимация при отправке формы
+    const form = document.querySelector('form');
+    form.addEventListener('submit', function(e) {
+        const submitBtn = this.querySelector('button[type="submit"]');
+        if (submitBtn) {
+            submitBtn.innerHTML = '<i class="bi bi-hourglass-split me-2"></i>Подбираем...';
+            submitBtn.disabled = true;
+        }
+    });
+});
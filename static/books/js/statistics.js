@@ -0,0 +1,27 @@
+(function () {
+    const canvas = document.getElementById('mood-trends');
+    if (!canvas || typeof Chart === 'undefined') return;
+
+    const toChart = (data) => ({
+        labels: data.labels,
+        datasets: data.datasets.map((set) => ({label: set.label, data: set.data, tension: 0.3})),
+    });
+    const chart = new Chart(canvas, {
+        type: 'line',
+        data: toChart(JSON.parse(document.getElementById('trends-data').textContent)),
+        options: {scales: {y: {beginAtZero: true, ticks: {precision: 0}}}},
+    });
+
+    document.querySelectorAll('[data-period]').forEach((link) => {
+        link.addEventListener('click', (event) => {
+            event.preventDefault();
+            const params = new URLSearchParams({period: link.dataset.period, span: link.dataset.span});
+            fetch(canvas.dataset.trendsUrl + '?' + params)
+                .then((response) => response.json())
+                .then((data) => {
+                    chart.data = toChart(data);
+                    chart.update();
+                });
+        });
+    });
+})();
@@ -1,8 +1,2 @@
 # users/admin.py
-from django.contrib import admin
-from .models import UserProfile
-
-@admin.register(UserProfile)
-class UserProfileAdmin(admin.ModelAdmin):
-    list_display = ('user', 'favorite_books')
-    search_fields = ('user__username', 'user__email')
\ No newline at end of file
+# Профиль регистрируется в админке приложения books (books/admin.py)
@@ -1,25 +1,5 @@
 # users/models.py
-from django.db import models
-from django.contrib.auth.models import User
-from django.db.models.signals import post_save
-from django.dispatch import receiver
-
-
-class UserProfile(models.Model):
-    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
-    favorite_books = models.TextField(blank=True, verbose_name='Любимые книги')
-
-    def __str__(self):
-        return f"Профиль {self.user.username}"
-
-
-# Сигналы для автоматического создания профиля
-@receiver(post_save, sender=User)
-def create_user_profile(sender, instance, created, **kwargs):
-    if created:
-        UserProfile.objects.create(user=instance)
-
-
-@receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    instance.profile.save()
\ No newline at end of file
+# Профиль пользователя один - books.models.UserProfile (бывшая модель этого
+# приложения перенесена туда миграцией books 0011). Импорт оставлен для
+# старого кода, который берет профиль отсюда
+from books.models import UserProfile, get_profile  # noqa: F401